@@ -1,23 +1,41 @@
 from django.contrib import admin
+from .analysis_metrics import STAGES, latency_report
+from .resilience import analysis_bulkhead
 from .models import (
     UserProfile, FoodCategory, DrinkCategory, Food, Drink,
     FoodImage, OpenAIAnalysis, MealRecord, DrinkRecord,
-    MealDetail, UserSettings, ActivityLog
+    MealDetail, UserSettings, ActivityLog, AnalysisCacheEntry,
+    AnalysisJob, FoodCategoryKeyword, RateLimitBucket, ImageBlob, ChunkedUpload, FoodImageRendition,
+    DirectUpload
 )
 
 
 @admin.register(UserProfile)
 class UserProfileAdmin(admin.ModelAdmin):
-    list_display = ['user', 'daily_calorie_goal', 'notifications_enabled', 'created_at']
-    list_filter = ['notifications_enabled', 'created_at']
+    list_display = ['user', 'daily_calorie_goal', 'analysis_tier', 'notifications_enabled', 'created_at']
+    list_filter = ['analysis_tier', 'notifications_enabled', 'created_at']
     search_fields = ['user__username', 'user__email']
 
 
+class FoodCategoryKeywordInline(admin.TabularInline):
+    model = FoodCategoryKeyword
+    extra = 1
+
+
 @admin.register(FoodCategory)
 class FoodCategoryAdmin(admin.ModelAdmin):
     list_display = ['name', 'color', 'created_at']
     search_fields = ['name']
     list_filter = ['created_at']
+    inlines = [FoodCategoryKeywordInline]
+
+
+@admin.register(FoodCategoryKeyword)
+class FoodCategoryKeywordAdmin(admin.ModelAdmin):
+    list_display = ['keyword', 'category', 'priority', 'created_at']
+    list_filter = ['category']
+    search_fields = ['keyword', 'category__name']
+    list_select_related = ['category']
 
 
 @admin.register(DrinkCategory)
@@ -43,19 +61,100 @@ class DrinkAdmin(admin.ModelAdmin):
     list_select_related = ['category']
 
 
+class FoodImageRenditionInline(admin.TabularInline):
+    model = FoodImageRendition
+    extra = 0
+    can_delete = False
+    readonly_fields = ['kind', 'format', 'name', 'width', 'height', 'size', 'created_at']
+
+
 @admin.register(FoodImage)
 class FoodImageAdmin(admin.ModelAdmin):
     list_display = ['user', 'original_name', 'file_size', 'mime_type', 'created_at']
     list_filter = ['created_at', 'mime_type']
-    search_fields = ['user__username', 'original_name']
-    readonly_fields = ['file_size', 'mime_type']
+    search_fields = ['user__username', 'original_name', 'perceptual_hash', 'blob__content_hash']
+    readonly_fields = ['file_size', 'mime_type', 'perceptual_hash', 'blob', 'primary_image']
+    inlines = [FoodImageRenditionInline]
+
+
+@admin.register(ImageBlob)
+class ImageBlobAdmin(admin.ModelAdmin):
+    list_display = ['content_hash', 'size', 'ref_count', 'created_at']
+    search_fields = ['content_hash', 'name']
+    readonly_fields = ['content_hash', 'name', 'size', 'ref_count', 'acquired_at', 'created_at']
 
 
 @admin.register(OpenAIAnalysis)
 class OpenAIAnalysisAdmin(admin.ModelAdmin):
-    list_display = ['image', 'calculated_calories', 'confidence_score', 'created_at']
-    list_filter = ['confidence_score', 'created_at']
-    readonly_fields = ['prompt_sent', 'response_received', 'identified_foods']
+    list_display = [
+        'image', 'calculated_calories', 'confidence_score', 'model_used', 'routing_tier',
+        'total_latency_ms', 'prompt_tokens', 'completion_tokens', 'retry_count', 'cache_hit', 'created_at'
+    ]
+    list_filter = [
+        'confidence_score', 'model_used', 'routing_tier', 'escalated', 'cache_hit', 'coalesced', 'fallback_used',
+        'json_repaired', 'created_at'
+    ]
+    readonly_fields = [
+        'prompt_sent', 'response_received', 'identified_foods', 'model_used', 'prompt_tokens',
+        'completion_tokens', 'image_tokens', 'payload_bytes', 'retry_count', 'routing_tier', 'escalated',
+        'tier_latencies', 'fallback_used', 'json_repaired', 'cache_hit', 'coalesced', 'repeated_from', 'screening_warnings', 'total_latency_ms', 'stage_timings'
+    ]
+    change_list_template = 'admin/core/openaianalysis/change_list.html'
+
+    def changelist_view(self, request, extra_context=None):
+        """Añade percentiles de latencia y tokens de los análisis filtrados"""
+        response = super().changelist_view(request, extra_context=extra_context)
+        try:
+            queryset = response.context_data['cl'].queryset
+        except (AttributeError, KeyError):
+            # Redirecciones o acciones masivas no tienen changelist
+            return response
+        report = latency_report(queryset)
+        rows = [('total', report['total'])] + [(stage, report['stages'][stage]) for stage in STAGES]
+        response.context_data['latency_report'] = report
+        response.context_data['bulkhead'] = analysis_bulkhead().status()
+        response.context_data['latency_rows'] = [(label, summary) for label, summary in rows if summary['count']]
+        return response
+
+
+@admin.register(AnalysisCacheEntry)
+class AnalysisCacheEntryAdmin(admin.ModelAdmin):
+    list_display = ['content_hash', 'prompt_version', 'hit_count', 'last_used_at', 'created_at']
+    list_filter = ['prompt_version', 'created_at']
+    search_fields = ['content_hash']
+    readonly_fields = ['content_hash', 'prompt_version', 'payload', 'hit_count']
+
+
+@admin.register(RateLimitBucket)
+class RateLimitBucketAdmin(admin.ModelAdmin):
+    list_display = ['key', 'tokens', 'updated_at']
+    search_fields = ['key']
+    readonly_fields = ['updated_at']
+
+
+@admin.register(ChunkedUpload)
+class ChunkedUploadAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'file_name', 'offset', 'length', 'expires_at', 'created_at']
+    search_fields = ['user__username', 'file_name']
+    list_select_related = ['user']
+    readonly_fields = ['offset', 'length', 'expires_at']
+
+
+@admin.register(DirectUpload)
+class DirectUploadAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'file_name', 'content_type', 'size', 'expires_at', 'created_at']
+    search_fields = ['user__username', 'file_name', 'name']
+    list_select_related = ['user']
+    readonly_fields = ['name', 'content_type', 'size', 'expires_at']
+
+
+@admin.register(AnalysisJob)
+class AnalysisJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'status', 'attempts', 'worker_id', 'created_at', 'finished_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['user__username', 'worker_id']
+    list_select_related = ['user']
+    readonly_fields = ['result', 'error', 'attempts', 'worker_id', 'started_at', 'finished_at']
 
 
 @admin.register(MealRecord)
@@ -0,0 +1,117 @@
+import logging
+import threading
+from datetime import timedelta
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import AnalysisCacheEntry
+
+logger = logging.getLogger(__name__)
+
+# Contadores del proceso actual (los totales persistentes viven en AnalysisCacheEntry.hit_count)
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+
+def _bump(counter: str, amount: int = 1):
+    with _stats_lock:
+        _stats[counter] += amount
+
+
+class AnalysisCache:
+    """
+    Caché persistente de análisis de OpenAI.
+    La clave es el SHA-256 de la imagen más la versión del análisis (prompt, esquema y
+    niveles de modelo, ver services.analysis_version),
+    con expiración por TTL y desalojo LRU cuando se supera el máximo de entradas.
+    """
+
+    def __init__(self, prompt_version: str):
+        self.prompt_version = prompt_version
+        self.enabled = getattr(settings, 'ANALYSIS_CACHE_ENABLED', True)
+        self.ttl = timedelta(seconds=getattr(settings, 'ANALYSIS_CACHE_TTL_SECONDS', 30 * 24 * 3600))
+        self.max_entries = getattr(settings, 'ANALYSIS_CACHE_MAX_ENTRIES', 5000)
+
+    def get(self, content_hash: str) -> Optional[Dict]:
+        """Retorna el análisis cacheado o None si no existe o expiró"""
+        if not self.enabled:
+            return None
+        try:
+            entry = AnalysisCacheEntry.objects.filter(
+                content_hash=content_hash,
+                prompt_version=self.prompt_version
+            ).first()
+            if entry is None:
+                _bump('misses')
+                return None
+
+            now = timezone.now()
+            if entry.created_at < now - self.ttl:
+                entry.delete()
+                _bump('evictions')
+                _bump('misses')
+                return None
+
+            AnalysisCacheEntry.objects.filter(pk=entry.pk).update(
+                hit_count=F('hit_count') + 1,
+                last_used_at=now
+            )
+            _bump('hits')
+            return dict(entry.payload)
+
+        except Exception as e:
+            # La caché nunca debe impedir un análisis
+            logger.error(f"Error leyendo caché de análisis: {e}")
+            return None
+
+    def set(self, content_hash: str, payload: Dict):
+        """Guarda un análisis y aplica el desalojo LRU si es necesario"""
+        if not self.enabled:
+            return
+        try:
+            try:
+                AnalysisCacheEntry.objects.update_or_create(
+                    content_hash=content_hash,
+                    prompt_version=self.prompt_version,
+                    defaults={'payload': payload, 'last_used_at': timezone.now()}
+                )
+            except IntegrityError:
+                # Otro worker guardó la misma imagen al mismo tiempo
+                return
+            _bump('stores')
+            self.evict()
+        except Exception as e:
+            logger.error(f"Error guardando en caché de análisis: {e}")
+
+    def evict(self) -> int:
+        """Elimina entradas expiradas y las menos usadas por encima del máximo"""
+        removed, _ = AnalysisCacheEntry.objects.filter(
+            created_at__lt=timezone.now() - self.ttl
+        ).delete()
+
+        overflow = AnalysisCacheEntry.objects.count() - self.max_entries
+        if overflow > 0:
+            stale_ids = list(
+                AnalysisCacheEntry.objects.order_by('last_used_at').values_list('id', flat=True)[:overflow]
+            )
+            lru_removed, _ = AnalysisCacheEntry.objects.filter(id__in=stale_ids).delete()
+            removed += lru_removed
+
+        if removed:
+            _bump('evictions', removed)
+        return removed
+
+    @staticmethod
+    def stats() -> Dict:
+        """Contadores de aciertos/fallos del proceso y totales persistentes"""
+        with _stats_lock:
+            process_stats = dict(_stats)
+        lookups = process_stats['hits'] + process_stats['misses']
+        process_stats['hit_ratio'] = round(process_stats['hits'] / lookups, 4) if lookups else 0.0
+        process_stats['entries'] = AnalysisCacheEntry.objects.count()
+        process_stats['total_hits'] = AnalysisCacheEntry.objects.aggregate(total=Sum('hit_count'))['total'] or 0
+        return process_stats
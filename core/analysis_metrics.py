@@ -0,0 +1,183 @@
+import math
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+# Etapas medidas en cada análisis, en orden de ejecución
+STAGES = ('read', 'cache', 'screen', 'encode', 'api', 'parse', 'db')
+
+PERCENTILES = (50, 95, 99)
+
+
+def estimate_image_tokens(width: int, height: int, detail: str = 'high') -> int:
+    """
+    Estima los tokens de imagen con la regla de teselas de OpenAI (detail=high):
+    la imagen se ajusta a 2048x2048, el lado menor se reduce a 768 px y
+    cada tesela de 512x512 cuesta 170 tokens, más 85 de base. Con detail=low son 85 fijos.
+    """
+    if not width or not height:
+        return 0
+    if detail == 'low':
+        return 85
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return 85 + 170 * tiles
+
+
+class AnalysisMetrics:
+    """Tokens, latencias por etapa y reintentos de un análisis"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stage_timings: Dict[str, float] = {}
+        self.model_used = ''
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.image_tokens = 0
+        self.payload_bytes = 0
+        self.requests = 0
+        self.fallback_used = False
+        self.json_repaired = False
+        self.cache_hit = False
+        self.coalesced = False
+        self.screening_warnings: List[str] = []
+        self.image_size = (0, 0)
+        self.routing_tier = ''
+        self.escalated = False
+        self.tier_latencies: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        """Acumula en milisegundos el tiempo de una etapa"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            self.stage_timings[name] = round(self.stage_timings.get(name, 0.0) + elapsed, 2)
+
+    def record_response(self, response):
+        """Suma el uso de tokens de una respuesta de chat.completions (o del último chunk de un stream)"""
+        self.model_used = getattr(response, 'model', None) or self.model_used
+        usage = getattr(response, 'usage', None)
+        if usage is not None:
+            self.prompt_tokens += usage.prompt_tokens or 0
+            self.completion_tokens += usage.completion_tokens or 0
+
+    def record_tier(self, tier_name: str, elapsed_ms: float):
+        """Latencia de la llamada de un nivel del enrutado de modelos"""
+        self.tier_latencies[tier_name] = round(self.tier_latencies.get(tier_name, 0.0) + elapsed_ms, 2)
+
+    @property
+    def retry_count(self) -> int:
+        """Peticiones a la API además de la primera (reintentos, peticiones hedged, escalado de nivel y fallback JSON)"""
+        return max(0, self.requests - 1)
+
+    @property
+    def total_latency_ms(self) -> float:
+        return round((time.perf_counter() - self.started) * 1000, 2)
+
+    def model_fields(self) -> Dict:
+        """Campos de OpenAIAnalysis con las métricas"""
+        return {
+            'model_used': self.model_used,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'image_tokens': self.image_tokens,
+            'payload_bytes': self.payload_bytes,
+            'retry_count': self.retry_count,
+            'fallback_used': self.fallback_used,
+            'json_repaired': self.json_repaired,
+            'cache_hit': self.cache_hit,
+            'coalesced': self.coalesced,
+            'screening_warnings': list(self.screening_warnings),
+            'routing_tier': self.routing_tier,
+            'escalated': self.escalated,
+            'tier_latencies': dict(self.tier_latencies),
+            'stage_timings': dict(self.stage_timings),
+            'total_latency_ms': self.total_latency_ms,
+        }
+
+
+def percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    """Percentil por rango más cercano sobre una lista ya ordenada"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def _summary(values: Iterable[float]) -> Dict:
+    values = sorted(value for value in values if value is not None)
+    summary = {f'p{pct}': percentile(values, pct) for pct in PERCENTILES}
+    summary['count'] = len(values)
+    summary['max'] = values[-1] if values else None
+    return summary
+
+
+def _tier_report(api_rows: List[Dict]) -> Dict:
+    """
+    Por nivel de modelo: análisis que lo intentaron, cuántos se quedaron con su resultado
+    (tasa de acierto) y percentiles de la latencia de su llamada. El primer nivel, que
+    siempre se intenta, queda primero.
+    """
+    attempts: Dict[str, List[float]] = {}
+    for row in api_rows:
+        for tier, elapsed_ms in (row['tier_latencies'] or {}).items():
+            attempts.setdefault(tier, []).append(elapsed_ms)
+    report = {}
+    for tier, latencies in sorted(attempts.items(), key=lambda item: -len(item[1])):
+        accepted = sum(1 for row in api_rows if row['routing_tier'] == tier)
+        report[tier] = {
+            'attempts': len(latencies),
+            'accepted': accepted,
+            'hit_rate': accepted / len(latencies),
+            'latency': _summary(latencies),
+        }
+    return report
+
+
+def latency_report(queryset) -> Dict:
+    """
+    Percentiles de latencia total y por etapa, y uso de tokens, de un queryset de OpenAIAnalysis.
+    Los percentiles se calculan en Python porque SQLite no tiene percentile_cont.
+    """
+    rows = list(queryset.filter(total_latency_ms__isnull=False).values(
+        'total_latency_ms', 'stage_timings', 'prompt_tokens', 'completion_tokens',
+        'image_tokens', 'retry_count', 'fallback_used', 'json_repaired', 'cache_hit', 'coalesced', 'repeated_from',
+        'routing_tier', 'escalated', 'tier_latencies'
+    ))
+    # Los aciertos de caché y los análisis compartidos (single-flight) no llamaron a la API
+    api_rows = [row for row in rows if not row['cache_hit'] and not row['coalesced']]
+    # Cada reparación local evita una llamada de fallback; se estima su coste con el de una llamada media
+    repaired = sum(1 for row in api_rows if row['json_repaired'])
+    calls_tokens = [row['prompt_tokens'] + row['completion_tokens'] for row in api_rows if not row['fallback_used']]
+
+    return {
+        'count': len(rows),
+        'cache_hit_rate': sum(1 for row in rows if row['cache_hit']) / len(rows) if rows else 0.0,
+        'coalesce_rate': sum(1 for row in rows if row['coalesced']) / len(rows) if rows else 0.0,
+        'repeat_rate': sum(1 for row in rows if row['repeated_from']) / len(rows) if rows else 0.0,
+        'retry_rate': sum(1 for row in api_rows if row['retry_count']) / len(api_rows) if api_rows else 0.0,
+        'fallback_rate': sum(1 for row in api_rows if row['fallback_used']) / len(api_rows) if api_rows else 0.0,
+        'repair_rate': repaired / len(api_rows) if api_rows else 0.0,
+        'round_trips_saved': repaired,
+        'tokens_saved': round(repaired * sum(calls_tokens) / len(calls_tokens)) if calls_tokens else 0,
+        'escalation_rate': sum(1 for row in api_rows if row['escalated']) / len(api_rows) if api_rows else 0.0,
+        'tiers': _tier_report(api_rows),
+        'total': _summary(row['total_latency_ms'] for row in rows),
+        'stages': {
+            stage: _summary((row['stage_timings'] or {}).get(stage) for row in rows)
+            for stage in STAGES
+        },
+        'tokens': {
+            field: {
+                'sum': sum(row[field] for row in api_rows),
+                **_summary(row[field] for row in api_rows),
+            }
+            for field in ('prompt_tokens', 'completion_tokens', 'image_tokens')
+        },
+    }
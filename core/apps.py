@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        # Registra las señales de los índices en memoria (alimentos, categorizador, comidas repetidas)
+        # y del almacenamiento deduplicado de imágenes y sus versiones reducidas
+        from . import categorizer, food_matching, image_blobs, meal_matching, renditions  # noqa: F401
@@ -0,0 +1,326 @@
+import asyncio
+import logging
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import openai
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .analysis_cache import AnalysisCache
+from .analysis_metrics import AnalysisMetrics
+from .model_routing import ModelTier, TierRouter, get_model_tiers
+from .models import FoodImage, OpenAIAnalysis
+from .openai_client import get_async_openai_client
+from .resilience import (
+    AnalysisError, AnalysisTimeout, CircuitBreaker, Deadline, acall_with_retries, stream_error
+)
+from .services import FoodAnalysisService, ImageSource, OpenAIService, _read_file, analysis_version
+from .single_flight import analysis_single_flight
+from .streaming import FoodItemStreamParser
+from .uploads import AnalysisUploadedFile
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncOpenAIService(OpenAIService):
+    """
+    Versión asíncrona de OpenAIService para las vistas servidas por ASGI.
+    Reutiliza la construcción de peticiones y el parseo del servicio síncrono;
+    solo cambian la E/S de red (AsyncOpenAI) y la de disco/BD (hilos).
+    """
+
+    def __init__(self):
+        self.client = get_async_openai_client()
+        self.cache = AnalysisCache(analysis_version())
+        self.breaker = CircuitBreaker('openai')
+        self.single_flight = analysis_single_flight()
+
+    async def analyze_food_image(self, image_path: ImageSource) -> Dict:
+        """Analiza una imagen sin bloquear el event loop"""
+        analysis_data, _ = await self.analyze_food_image_with_metrics(image_path)
+        return analysis_data
+
+    async def analyze_food_image_with_metrics(self, image_path: ImageSource, user_id: Optional[int] = None,
+                                              upload: Optional[AnalysisUploadedFile] = None,
+                                              use_cache: bool = True) -> Tuple[Dict, AnalysisMetrics]:
+        """Igual que analyze_food_image, pero retorna también tokens, latencias y reintentos"""
+        metrics = AnalysisMetrics()
+        try:
+            with metrics.stage('read'):
+                if upload is not None:
+                    image_bytes = upload.getvalue()
+                else:
+                    image_bytes = await asyncio.to_thread(_read_file, image_path)
+        except Exception as e:
+            logger.error(f"Error leyendo imagen: {e}")
+            raise
+
+        with metrics.stage('cache'):
+            content_hash = self._content_hash(image_bytes, upload)
+            cached = await sync_to_async(self.cache.get)(content_hash) if use_cache else None
+        if cached is not None:
+            logger.info("Análisis servido desde caché (hash=%s)", content_hash[:12])
+            metrics.cache_hit = True
+            return cached, metrics
+
+        shared, flight = await self.single_flight.ajoin(self._flight_key(content_hash, user_id))
+        if flight is None:
+            logger.info("Análisis compartido con una petición idéntica en curso (hash=%s)", content_hash[:12])
+            metrics.coalesced = True
+            return shared, metrics
+        async with flight:
+            await asyncio.to_thread(self._screen_image, image_bytes, metrics)
+            analysis_data = await self._request_analysis(image_bytes, image_path, metrics, upload)
+            if self._is_cacheable(analysis_data):
+                with metrics.stage('cache'):
+                    await sync_to_async(self.cache.set)(content_hash, analysis_data)
+            await flight.apublish(analysis_data)
+        return analysis_data, metrics
+
+    async def _request_analysis(self, image_bytes: bytes, image_path: ImageSource, metrics: Optional[AnalysisMetrics] = None,
+                                upload: Optional[AnalysisUploadedFile] = None) -> Dict:
+        """Envía la imagen a los niveles de modelo con AsyncOpenAI y extrae el análisis"""
+        metrics = metrics or AnalysisMetrics()
+        try:
+            # El preprocesado con Pillow es CPU: fuera del event loop
+            with metrics.stage('encode'):
+                base64_image, mime_type = await asyncio.to_thread(self._encode_image_bytes, image_bytes, metrics, upload)
+            image_url = f"data:{mime_type};base64,{base64_image}"
+            tiers = get_model_tiers()
+            logger.debug(
+                "Async vision request -> tiers=%s, image_path=%s, image_size_bytes=%s, payload_bytes=%s, mime=%s",
+                tiers, image_path, len(image_bytes), len(base64_image), mime_type
+            )
+
+            deadline = Deadline(settings.ANALYSIS_DEADLINE_SECONDS)
+            router = TierRouter(tiers, deadline, metrics)
+            for tier in router:
+                try:
+                    router.record(tier, await self._analyze_with_tier(image_url, tier, deadline, metrics))
+                except AnalysisError as e:
+                    router.failed(tier, e)
+            analysis_data = router.result
+
+            if self._needs_fallback(analysis_data, deadline, metrics):
+                logger.debug("Retrying with response_format=json_object and no tools")
+                retry = await self._call_provider(self._json_retry_request(image_url), deadline, metrics)
+                with metrics.stage('parse'):
+                    analysis_data = self._extract_retry_analysis(retry)
+
+            return analysis_data
+
+        except Exception as e:
+            logger.error(f"Error analizando imagen con OpenAI: {e}")
+            raise
+
+    async def _analyze_with_tier(self, image_url: str, tier: ModelTier, deadline: Deadline,
+                                 metrics: AnalysisMetrics) -> Optional[Dict]:
+        """Versión asíncrona de OpenAIService._analyze_with_tier"""
+        started = time.perf_counter()
+        try:
+            response = await self._call_provider(self._tool_call_request(image_url, tier), deadline, metrics)
+            with metrics.stage('parse'):
+                return self._extract_analysis(response, metrics)
+        finally:
+            metrics.record_tier(tier.name, (time.perf_counter() - started) * 1000)
+
+    async def stream_food_analysis(self, image_path: ImageSource, user_id: Optional[int] = None,
+                                   upload: Optional[AnalysisUploadedFile] = None) -> AsyncIterator[Tuple[str, Any]]:
+        """Versión asíncrona de OpenAIService.stream_food_analysis"""
+        metrics = AnalysisMetrics()
+        with metrics.stage('read'):
+            if upload is not None:
+                image_bytes = upload.getvalue()
+            else:
+                image_bytes = await asyncio.to_thread(_read_file, image_path)
+
+        with metrics.stage('cache'):
+            content_hash = self._content_hash(image_bytes, upload)
+            cached = await sync_to_async(self.cache.get)(content_hash)
+        if cached is not None:
+            metrics.cache_hit = True
+            for event in self._replay_events(cached, metrics):
+                yield event
+            return
+
+        shared, flight = await self.single_flight.ajoin(self._flight_key(content_hash, user_id))
+        if flight is None:
+            metrics.coalesced = True
+            for event in self._replay_events(shared, metrics):
+                yield event
+            return
+        async with flight:
+            await asyncio.to_thread(self._screen_image, image_bytes, metrics)
+            with metrics.stage('encode'):
+                base64_image, mime_type = await asyncio.to_thread(self._encode_image_bytes, image_bytes, metrics, upload)
+            image_url = f"data:{mime_type};base64,{base64_image}"
+            deadline = Deadline(settings.ANALYSIS_DEADLINE_SECONDS)
+
+            router = TierRouter(get_model_tiers(), deadline, metrics)
+            for tier in router:
+                if self._is_escalation(router, tier):
+                    yield 'reset', {'tier': tier.name}
+                try:
+                    # Un generador asíncrono no puede retornar valor: el análisis llega como último evento
+                    async for event, payload in self._stream_tier(image_url, tier, deadline, metrics):
+                        if event == 'item':
+                            yield event, payload
+                        else:
+                            router.record(tier, payload)
+                except AnalysisError as e:
+                    router.failed(tier, e)
+            analysis_data = router.result
+
+            if self._needs_fallback(analysis_data, deadline, metrics):
+                logger.debug("Streamed tool call was not valid JSON, retrying with response_format=json_object")
+                retry = await self._call_provider(self._json_retry_request(image_url), deadline, metrics)
+                with metrics.stage('parse'):
+                    analysis_data = self._extract_retry_analysis(retry)
+
+            if self._is_cacheable(analysis_data):
+                with metrics.stage('cache'):
+                    await sync_to_async(self.cache.set)(content_hash, analysis_data)
+            await flight.apublish(analysis_data)
+        yield 'done', (analysis_data, metrics)
+
+    async def _stream_tier(self, image_url: str, tier: ModelTier, deadline: Deadline,
+                           metrics: AnalysisMetrics) -> AsyncIterator[Tuple[str, Any]]:
+        """Tool call en streaming de un nivel: emite ('item', alimento) y al final ('parsed', análisis)"""
+        started = time.perf_counter()
+        try:
+            stream = await self._call_provider(self._stream_request(image_url, tier), deadline, metrics)
+            parser = FoodItemStreamParser()
+            try:
+                with metrics.stage('api'):
+                    async for chunk in stream:
+                        for food in parser.feed(self._chunk_text(chunk, metrics)):
+                            yield 'item', food
+                        if deadline.expired():
+                            raise AnalysisTimeout()
+            except openai.APIError as e:
+                await sync_to_async(self.breaker.record_failure)()
+                logger.error(f"Error en el stream de OpenAI: {e}")
+                raise stream_error(e)
+            finally:
+                await stream.close()
+        finally:
+            metrics.record_tier(tier.name, (time.perf_counter() - started) * 1000)
+
+        with metrics.stage('parse'):
+            yield 'parsed', self._parse_streamed_analysis(parser.text, metrics)
+
+    async def _call_provider(self, request_kwargs: Dict, deadline: Deadline,
+                             metrics: Optional[AnalysisMetrics] = None):
+        """Llama a la API asíncrona con timeout por intento, reintentos y circuit breaker"""
+        metrics = metrics or AnalysisMetrics()
+
+        async def attempt(timeout: float):
+            metrics.requests += 1
+            client = self.client.with_options(timeout=timeout, max_retries=0)
+            return await client.chat.completions.create(**request_kwargs)
+
+        with metrics.stage('api'):
+            response = await acall_with_retries(attempt, deadline, self.breaker, hedge=not request_kwargs.get('stream'))
+        metrics.record_response(response)
+        return response
+
+    async def save_analysis_to_database(self, food_image: FoodImage, analysis_data: Dict,
+                                        metrics: Optional[AnalysisMetrics] = None) -> OpenAIAnalysis:
+        """Guarda el análisis usando el ORM asíncrono"""
+        try:
+            if metrics is None:
+                analysis = await OpenAIAnalysis.objects.acreate(**self._analysis_fields(food_image, analysis_data))
+            else:
+                with metrics.stage('db'):
+                    analysis = await OpenAIAnalysis.objects.acreate(
+                        **self._analysis_fields(food_image, analysis_data, metrics)
+                    )
+                await OpenAIAnalysis.objects.filter(pk=analysis.pk).aupdate(**self._timing_fields(analysis, metrics))
+            logger.info(f"Análisis guardado para imagen {food_image.id}")
+            return analysis
+        except Exception as e:
+            logger.error(f"Error guardando análisis en BD: {e}")
+            raise
+
+
+class AsyncFoodAnalysisService(FoodAnalysisService):
+    """Versión asíncrona de FoodAnalysisService"""
+
+    def __init__(self):
+        self.openai_service = AsyncOpenAIService()
+
+    async def analyze_and_save(self, food_image: FoodImage) -> Tuple[OpenAIAnalysis, Dict]:
+        """Analiza una imagen de comida y guarda los resultados sin bloquear"""
+        try:
+            analysis_data, metrics = await self.openai_service.analyze_food_image_with_metrics(
+                food_image.image, food_image.user_id, getattr(food_image, 'upload', None)
+            )
+            analysis = await self.openai_service.save_analysis_to_database(food_image, analysis_data, metrics)
+            processed_data = await self._aprocess_analysis_for_ui(analysis_data)
+            return analysis, processed_data
+
+        except Exception as e:
+            logger.error(f"Error en análisis completo: {e}")
+            raise
+
+    async def _aprocess_analysis_for_ui(self, analysis_data: Dict) -> Dict:
+        """El categorizador puede cargar sus palabras clave de la BD: se ejecuta fuera del event loop"""
+        return await sync_to_async(self._process_analysis_for_ui)(analysis_data)
+
+    async def suggest_repeat_meal(self, food_image: FoodImage) -> Optional[Tuple[OpenAIAnalysis, Dict]]:
+        """La búsqueda y la copia del análisis acceden a la BD: se ejecutan fuera del event loop"""
+        return await sync_to_async(super().suggest_repeat_meal)(food_image)
+
+    async def stream_analyze_and_save(self, food_image: FoodImage,
+                                      suggest_repeat: bool = False) -> AsyncIterator[Tuple[str, Dict]]:
+        """Versión asíncrona de FoodAnalysisService.stream_analyze_and_save"""
+        if suggest_repeat:
+            suggestion = await self.suggest_repeat_meal(food_image)
+            if suggestion is not None:
+                for event in self._suggestion_events(suggestion):
+                    yield event
+                return
+
+        async for event, payload in self.openai_service.stream_food_analysis(
+            food_image.image, food_image.user_id, getattr(food_image, 'upload', None)
+        ):
+            if event == 'item':
+                yield 'item', await sync_to_async(self._stream_item)(payload)
+                continue
+            if event == 'reset':
+                yield 'reset', payload
+                continue
+            analysis_data, metrics = payload
+            analysis = await self.openai_service.save_analysis_to_database(food_image, analysis_data, metrics)
+            processed_data = await self._aprocess_analysis_for_ui(analysis_data)
+            yield 'done', self._stream_result(analysis, processed_data)
+
+    async def analyze_many_and_save(self, food_images: List[FoodImage]) -> Tuple[List[OpenAIAnalysis], Dict]:
+        """Analiza varias fotos concurrentemente con un semáforo y combina los resultados"""
+        semaphore = asyncio.Semaphore(max(1, settings.MULTI_IMAGE_MAX_PARALLEL))
+        duplicates = self._duplicate_frames(food_images)
+
+        async def analyze(index, food_image):
+            if index in duplicates:
+                return None
+            async with semaphore:
+                return await self.openai_service.analyze_food_image_with_metrics(
+                    food_image.image, food_image.user_id, getattr(food_image, 'upload', None)
+                )
+
+        gathered = await asyncio.gather(
+            *(analyze(index, food_image) for index, food_image in enumerate(food_images)),
+            return_exceptions=True
+        )
+        outcomes = [(None, outcome) if isinstance(outcome, Exception) else (outcome, None) for outcome in gathered]
+
+        successful = self._batch_successes(food_images, duplicates, outcomes)
+        saved = {}
+        for index, analysis_data, metrics in successful:
+            saved[index] = await self.openai_service.save_analysis_to_database(food_images[index], analysis_data, metrics)
+        analyses = list(saved.values())
+
+        await self._extra_images(food_images, analyses[0]).aupdate(primary_image_id=analyses[0].image_id)
+
+        return analyses, await sync_to_async(self._batch_result)(food_images, duplicates, outcomes, saved)
@@ -0,0 +1,151 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import FoodCategory, FoodCategoryKeyword
+from .text import normalize_food_name
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CATEGORY = 'otros'
+
+# Separa los nombres al categorizar un lote en una sola pasada; nunca aparece en un nombre normalizado
+_SEPARATOR = '\n'
+
+
+class KeywordAutomaton:
+    """
+    Autómata Aho-Corasick sobre palabras clave normalizadas (sin acentos, minúsculas).
+    Encuentra todas las apariciones de todas las palabras clave en un único recorrido del texto.
+    """
+
+    def __init__(self, keywords: Iterable[Tuple[str, str, int]]):
+        # Nodo 0 = raíz; por nodo: transiciones, enlace de fallo y palabras clave que terminan ahí
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[List[Tuple[int, str, int]]] = [[]]
+        self.size = 0
+
+        for keyword, category, priority in keywords:
+            keyword = normalize_food_name(keyword)
+            if not keyword:
+                continue
+            node = 0
+            for char in keyword:
+                next_node = self.goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self.goto)
+                    self.goto[node][char] = next_node
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                node = next_node
+            self.output[node].append((len(keyword), category, priority))
+            self.size += 1
+
+        # Enlaces de fallo por anchura
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def matches(self, text: str):
+        """Genera (posición inicial, longitud, categoría, prioridad) de cada palabra clave encontrada"""
+        node = 0
+        for position, char in enumerate(text):
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+            for length, category, priority in self.output[node]:
+                yield position - length + 1, length, category, priority
+
+
+class FoodCategorizer:
+    """Categoriza nombres de alimentos con las palabras clave de FoodCategoryKeyword"""
+
+    def __init__(self, keywords: Iterable[Tuple[str, str, int]]):
+        self.automaton = KeywordAutomaton(keywords)
+
+    def categorize(self, food_name: str) -> str:
+        return self.categorize_many([food_name])[0]
+
+    def categorize_many(self, food_names: List[str]) -> List[str]:
+        """
+        Categoriza un lote de nombres en un solo recorrido del texto concatenado.
+        Solo cuentan las palabras clave que empiezan al inicio de una palabra ('fresa' en
+        'fresas', pero no 'res' en 'fresco'). Con varias coincidencias gana la de menor
+        prioridad y, a igualdad, la palabra clave más larga.
+        """
+        normalized = [normalize_food_name(name) for name in food_names]
+        text = _SEPARATOR.join(normalized)
+
+        # Inicio de cada nombre en el texto concatenado
+        starts = []
+        offset = 0
+        for name in normalized:
+            starts.append(offset)
+            offset += len(name) + len(_SEPARATOR)
+
+        best: List[Optional[Tuple[int, int, str]]] = [None] * len(food_names)
+        current = 0
+        for start, length, category, priority in self.automaton.matches(text):
+            if start > 0 and text[start - 1].isalnum():
+                continue
+            while current + 1 < len(starts) and starts[current + 1] <= start:
+                current += 1
+            candidate = (priority, -length, category)
+            if best[current] is None or candidate < best[current]:
+                best[current] = candidate
+
+        return [match[2] if match else DEFAULT_CATEGORY for match in best]
+
+
+_categorizer_lock = threading.Lock()
+_categorizer: Optional[FoodCategorizer] = None
+_categorizer_built_at = 0.0
+
+
+def get_categorizer() -> FoodCategorizer:
+    """
+    Categorizador del proceso, construido una vez y recargado cuando cambian las categorías
+    o sus palabras clave (señales) o tras FOOD_CATEGORIZER_TTL segundos (cambios de otros procesos).
+    """
+    global _categorizer, _categorizer_built_at
+    categorizer = _categorizer
+    if categorizer is not None and time.monotonic() - _categorizer_built_at < settings.FOOD_CATEGORIZER_TTL:
+        return categorizer
+
+    with _categorizer_lock:
+        if _categorizer is None or time.monotonic() - _categorizer_built_at >= settings.FOOD_CATEGORIZER_TTL:
+            rows = FoodCategoryKeyword.objects.values_list('keyword', 'category__name', 'priority')
+            _categorizer = FoodCategorizer(
+                (keyword, category_name.lower(), priority) for keyword, category_name, priority in rows
+            )
+            _categorizer_built_at = time.monotonic()
+            logger.info(f"Categorizador de alimentos construido con {_categorizer.automaton.size} palabras clave")
+        return _categorizer
+
+
+def invalidate_categorizer():
+    global _categorizer
+    _categorizer = None
+
+
+@receiver(post_save, sender=FoodCategory)
+@receiver(post_delete, sender=FoodCategory)
+@receiver(post_save, sender=FoodCategoryKeyword)
+@receiver(post_delete, sender=FoodCategoryKeyword)
+def _categories_changed(sender, **kwargs):
+    invalidate_categorizer()
@@ -0,0 +1,144 @@
+import base64
+import logging
+import os
+from datetime import timedelta
+from pathlib import Path
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files import File
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .image_processing import detect_mime_type
+from .models import ChunkedUpload
+from .resilience import ImageTooLarge, UnsupportedImageType, UploadOffsetMismatch
+from .uploads import ALLOWED_MIME_TYPES, AnalysisUploadedFile, analysis_image_from_file
+
+logger = logging.getLogger(__name__)
+
+TUS_VERSION = '1.0.0'
+
+# Como mucho una limpieza de subidas caducadas cada 5 minutos al crear subidas
+PURGE_INTERVAL_SECONDS = 300
+
+
+def part_path(upload: ChunkedUpload) -> Path:
+    """Archivo donde se acumulan las partes recibidas"""
+    return Path(settings.CHUNKED_UPLOAD_DIR) / f'{upload.id}.part'
+
+
+def parse_upload_metadata(header: str) -> Dict[str, str]:
+    """Cabecera Upload-Metadata de tus: pares 'clave valor_base64' separados por comas"""
+    metadata = {}
+    for pair in filter(None, (item.strip() for item in header.split(','))):
+        key, _, value = pair.partition(' ')
+        try:
+            metadata[key] = base64.b64decode(value).decode('utf-8') if value else ''
+        except (ValueError, UnicodeDecodeError):
+            continue
+    return metadata
+
+
+def _expiry():
+    return timezone.now() + timedelta(seconds=settings.CHUNKED_UPLOAD_EXPIRY_SECONDS)
+
+
+def create_upload(user, length: int, file_name: str) -> ChunkedUpload:
+    """Reserva una subida de `length` bytes; el tamaño se comprueba antes de recibir nada"""
+    if length > settings.ANALYSIS_UPLOAD_MAX_BYTES:
+        raise ImageTooLarge()
+    if cache.add('chunked_uploads:purge', True, timeout=PURGE_INTERVAL_SECONDS):
+        purge_expired_uploads()
+    upload = ChunkedUpload.objects.create(
+        user=user, file_name=file_name[:255] or 'imagen', length=length, expires_at=_expiry()
+    )
+    path = part_path(upload)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.touch()
+    logger.info(f"Subida por partes {upload.id} creada ({length} bytes)")
+    return upload
+
+
+def get_active_upload(user, upload_id) -> Optional[ChunkedUpload]:
+    """Subida del usuario sin caducar, o None"""
+    return ChunkedUpload.objects.filter(id=upload_id, user=user, expires_at__gt=timezone.now()).first()
+
+
+def append_chunk(upload: ChunkedUpload, offset: int, data: bytes) -> ChunkedUpload:
+    """
+    Escribe una parte en `offset`, que debe coincidir con los bytes ya recibidos.
+    La fila queda bloqueada mientras se escribe: de dos PATCH simultáneos con el mismo
+    desplazamiento solo uno escribe, y el offset nuevo (el que ve un HEAD) solo se
+    confirma cuando los bytes ya están en disco.
+    """
+    if offset != upload.offset:
+        raise UploadOffsetMismatch()
+    if offset + len(data) > upload.length:
+        raise ImageTooLarge('La parte supera el tamaño anunciado de la subida')
+    if offset == 0 and len(data) >= 12 and detect_mime_type(data[:12]) not in ALLOWED_MIME_TYPES:
+        delete_upload(upload)
+        raise UnsupportedImageType()
+
+    new_offset = offset + len(data)
+    with transaction.atomic():
+        # Escribir primero toma el bloqueo también en SQLite (ver core/rate_limits.py)
+        ChunkedUpload.objects.filter(id=upload.id).update(offset=F('offset'))
+        current = ChunkedUpload.objects.select_for_update().filter(id=upload.id).values_list('offset', flat=True).first()
+        if current != offset:
+            raise UploadOffsetMismatch()
+        with open(part_path(upload), 'r+b') as part_file:
+            part_file.seek(offset)
+            part_file.write(data)
+            part_file.truncate()
+            part_file.flush()
+            os.fsync(part_file.fileno())
+        ChunkedUpload.objects.filter(id=upload.id).update(
+            offset=new_offset, expires_at=_expiry(), updated_at=timezone.now()
+        )
+    upload.offset = new_offset
+    return upload
+
+
+def read_upload(upload: ChunkedUpload) -> AnalysisUploadedFile:
+    """
+    Lee la subida completa con las mismas comprobaciones que una subida normal (ver
+    core/uploads.py). El resultado queda en memoria y se usa como request.FILES['image'].
+    Si la imagen se rechaza la subida se descarta; si no, sigue en disco hasta delete_upload.
+    """
+    if not upload.is_complete:
+        raise UploadOffsetMismatch(f'Faltan {upload.length - upload.offset} bytes por subir')
+    try:
+        with open(part_path(upload), 'rb') as part_file:
+            return analysis_image_from_file(File(part_file), upload.file_name)
+    except Exception:
+        delete_upload(upload)
+        raise
+
+
+def finalize_upload(upload: ChunkedUpload) -> AnalysisUploadedFile:
+    """Lee la subida completa (ver read_upload) y la descarta del disco"""
+    image_file = read_upload(upload)
+    delete_upload(upload)
+    return image_file
+
+
+def delete_upload(upload: ChunkedUpload):
+    """Borra la subida y sus bytes"""
+    try:
+        os.remove(part_path(upload))
+    except FileNotFoundError:
+        pass
+    upload.delete()
+
+
+def purge_expired_uploads() -> int:
+    """Borra las subidas caducadas (las que dejaron de recibir partes) y sus archivos"""
+    expired = list(ChunkedUpload.objects.filter(expires_at__lte=timezone.now()))
+    for upload in expired:
+        delete_upload(upload)
+    if expired:
+        logger.info(f"{len(expired)} subidas por partes caducadas borradas")
+    return len(expired)
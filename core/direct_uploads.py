@@ -0,0 +1,132 @@
+import logging
+import uuid
+from datetime import timedelta
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import DirectUpload, FoodImage
+from .renditions import schedule_renditions
+from .resilience import AnalysisError, ImageTooLarge, UnsupportedImageType, UploadNotReceived
+from .storage import food_image_storage
+from .uploads import ALLOWED_MIME_TYPES, analysis_image_from_file
+
+logger = logging.getLogger(__name__)
+
+# Carpeta de los objetos subidos por los clientes hasta que el worker los pasa a su blob
+DIRECT_UPLOAD_PREFIX = 'direct_uploads'
+
+DIRECT_UPLOAD_EXTENSIONS = {'image/jpeg': '.jpg', 'image/png': '.png', 'image/webp': '.webp'}
+
+# Margen para confirmar la subida después de que caduque el POST prefirmado
+COMPLETION_GRACE_SECONDS = 3600
+
+# Como mucho una limpieza de subidas caducadas cada 5 minutos al crear subidas
+PURGE_INTERVAL_SECONDS = 300
+
+
+def create_direct_upload(user, file_name: str, content_type: str, size: int) -> Tuple[DirectUpload, Dict]:
+    """
+    Reserva una ruta provisional y retorna el POST prefirmado para subirla: el almacenamiento
+    solo acepta ese tipo y como mucho `size` bytes, así que los límites se aplican sin ver los bytes.
+    """
+    if size > settings.ANALYSIS_UPLOAD_MAX_BYTES:
+        raise ImageTooLarge()
+    if content_type not in ALLOWED_MIME_TYPES:
+        raise UnsupportedImageType()
+    if cache.add('direct_uploads:purge', True, timeout=PURGE_INTERVAL_SECONDS):
+        purge_expired_direct_uploads()
+
+    upload_id = uuid.uuid4()
+    expiry = settings.DIRECT_UPLOAD_EXPIRY_SECONDS
+    upload = DirectUpload.objects.create(
+        id=upload_id,
+        user=user,
+        name=f'{DIRECT_UPLOAD_PREFIX}/{upload_id}{DIRECT_UPLOAD_EXTENSIONS[content_type]}',
+        file_name=file_name[:255] or 'imagen',
+        content_type=content_type,
+        size=size,
+        expires_at=timezone.now() + timedelta(seconds=expiry + COMPLETION_GRACE_SECONDS),
+    )
+    post = food_image_storage().presigned_post(upload.name, content_type, size, expiry)
+    logger.info(f"Subida directa {upload.id} preparada ({size} bytes)")
+    return upload, post
+
+
+def get_active_direct_upload(user, upload_id) -> Optional[DirectUpload]:
+    """Subida directa del usuario sin caducar, o None"""
+    return DirectUpload.objects.filter(id=upload_id, user=user, expires_at__gt=timezone.now()).first()
+
+
+def complete_direct_upload(upload: DirectUpload) -> FoodImage:
+    """
+    Callback del cliente al terminar la subida: comprueba el objeto con una consulta de
+    metadatos, sin descargarlo, y crea la FoodImage que apunta a él. La imagen se lee, se
+    valida y se pasa a su blob en el worker de análisis (ver ingest_direct_upload).
+    """
+    storage = food_image_storage()
+    if not storage.exists(upload.name):
+        raise UploadNotReceived()
+    size = storage.size(upload.name)
+    if size > upload.size:
+        storage.delete(upload.name)
+        upload.delete()
+        raise ImageTooLarge()
+
+    # bulk_create no envía las señales de guardado, que leerían la imagen aquí (hash, blob, versiones)
+    food_image, = FoodImage.objects.bulk_create([FoodImage(
+        user=upload.user,
+        image=upload.name,
+        original_name=upload.file_name,
+        file_size=size,
+        mime_type=upload.content_type,
+    )])
+    upload.delete()
+    logger.info(f"Subida directa {upload.id} confirmada como imagen {food_image.id}")
+    return food_image
+
+
+def is_direct_upload(food_image: FoodImage) -> bool:
+    """La imagen sigue en la ruta provisional de una subida directa"""
+    return food_image.blob_id is None and food_image.image.name.startswith(f'{DIRECT_UPLOAD_PREFIX}/')
+
+
+def ingest_direct_upload(food_image: FoodImage) -> FoodImage:
+    """
+    Pasa una subida directa por las mismas comprobaciones que una subida normal, la guarda en
+    su blob y borra el objeto provisional. La imagen queda en memoria en food_image.upload para
+    que el análisis no la vuelva a descargar. Si se rechaza, se borra y la imagen queda vacía.
+    """
+    storage = food_image.image.storage
+    staged_name = food_image.image.name
+    try:
+        with storage.open(staged_name, 'rb') as staged_file:
+            image_file = analysis_image_from_file(staged_file, food_image.original_name)
+    except AnalysisError:
+        storage.delete(staged_name)
+        FoodImage.objects.filter(id=food_image.id).update(image='')
+        raise
+
+    food_image.image = image_file
+    food_image.file_size = image_file.size
+    food_image.mime_type = image_file.content_type
+    # Las señales de guardado se encargan del blob y del hash perceptual, desde memoria
+    food_image.save()
+    storage.delete(staged_name)
+    if settings.IMAGE_RENDITIONS_ENABLED:
+        schedule_renditions(food_image)
+    return food_image
+
+
+def purge_expired_direct_uploads() -> int:
+    """Borra las subidas directas que nunca se confirmaron y sus objetos"""
+    expired = list(DirectUpload.objects.filter(expires_at__lte=timezone.now()))
+    storage = food_image_storage()
+    for upload in expired:
+        storage.delete(upload.name)
+        upload.delete()
+    if expired:
+        logger.info(f"{len(expired)} subidas directas caducadas borradas")
+    return len(expired)
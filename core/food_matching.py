@@ -0,0 +1,217 @@
+import logging
+import os
+import threading
+import time
+import zlib
+from typing import List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Food, FoodCategory
+from .text import normalize_food_name
+
+logger = logging.getLogger(__name__)
+
+# Palabras que no distinguen un alimento de otro al comparar nombres
+_STOPWORDS = frozenset({'a', 'al', 'con', 'de', 'del', 'e', 'el', 'en', 'la', 'las', 'los', 'y'})
+
+
+def _ngrams(normalized_name: str, n: int) -> List[str]:
+    """N-gramas de caracteres con relleno para que los bordes de palabra cuenten"""
+    padded = f' {normalized_name} '
+    if len(padded) <= n:
+        return [padded]
+    return [padded[i:i + n] for i in range(len(padded) - n + 1)]
+
+
+def vectorize(name: str, dimensions: int, n: int = 3) -> np.ndarray:
+    """Vector L2-normalizado de n-gramas (hashing trick con crc32, estable entre procesos)"""
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for gram in _ngrams(normalize_food_name(name), n):
+        vector[zlib.crc32(gram.encode('utf-8')) % dimensions] += 1.0
+    norm = np.linalg.norm(vector)
+    if norm:
+        vector /= norm
+    return vector
+
+
+def _words(name: str) -> List[str]:
+    return [word for word in normalize_food_name(name).split() if word not in _STOPWORDS]
+
+
+def _same_word(word: str, other: str) -> bool:
+    """Misma palabra salvo plural o errata al final ('tomates'/'tomate', 'arros'/'arroz')"""
+    if word == other:
+        return True
+    shorter = min(len(word), len(other))
+    return (shorter >= 4 and abs(len(word) - len(other)) <= 2
+            and len(os.path.commonprefix([word, other])) >= shorter - 1)
+
+
+def same_food_words(name: str, candidate: str) -> bool:
+    """
+    Los dos nombres tienen las mismas palabras (sin contar plurales, erratas ni palabras vacías).
+    Los trigramas dan similitudes altas a las variantes de un alimento ("mayonesa light" frente
+    a "mayonesa" 0.76, "arroz con pollo y papas" frente a "arroz con pollo" 0.81), que tienen
+    otras calorías: una palabra de más en cualquiera de los dos nombres impide asociarlos.
+    """
+    words, candidate_words = _words(name), _words(candidate)
+    return (all(any(_same_word(word, other) for other in candidate_words) for word in words)
+            and all(any(_same_word(other, word) for word in words) for other in candidate_words))
+
+
+class FoodIndex:
+    """
+    Índice en memoria de los nombres del catálogo Food para reconciliar los nombres
+    libres que devuelve el modelo (similitud coseno de n-gramas de caracteres).
+    Las versiones creadas con with_food comparten las matrices, que tienen capacidad de
+    sobra (se duplica al llenarse): cada versión solo ve sus primeras `count` columnas.
+    """
+
+    def __init__(self, foods: List[Tuple[int, str]], dimensions: int):
+        self.dimensions = dimensions
+        self.count = len(foods)
+        self._ids = np.array([food_id for food_id, _ in foods], dtype=np.int64)
+        self._names = [name for _, name in foods]
+        self._exact = {}
+        for position, (_, name) in enumerate(foods):
+            self._exact.setdefault(normalize_food_name(name), position)
+        # Matriz traspuesta (dimensiones x alimentos): una consulta solo tiene unas decenas de
+        # n-gramas, así que basta con multiplicar esas filas en vez de la matriz completa
+        self._columns = np.zeros((dimensions, len(foods)), dtype=np.float32)
+        for position, (_, name) in enumerate(foods):
+            self._columns[:, position] = vectorize(name, dimensions)
+        # Columnas escritas en las matrices compartidas (en una lista para compartirlo entre versiones)
+        self._filled = [self.count]
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._ids[:self.count]
+
+    @property
+    def columns(self) -> np.ndarray:
+        return self._columns[:, :self.count]
+
+    def with_food(self, food_id: int, name: str) -> 'FoodIndex':
+        """
+        Versión del índice con un alimento más. Esta versión no cambia (otros hilos pueden
+        estar leyéndola): la nueva escribe en la columna siguiente a las suyas, que esta no ve,
+        y la matriz solo se copia al ampliar la capacidad.
+        """
+        index = FoodIndex.__new__(FoodIndex)
+        index.dimensions = self.dimensions
+        if self._filled[0] != self.count or self.count == self._columns.shape[1]:
+            # Sin sitio, o con la columna siguiente ya usada por otra versión: matrices nuevas
+            capacity = max(2 * self.count, 16)
+            index._columns = np.zeros((self.dimensions, capacity), dtype=np.float32)
+            index._columns[:, :self.count] = self.columns
+            index._ids = np.zeros(capacity, dtype=np.int64)
+            index._ids[:self.count] = self.ids
+            index._names = self._names[:self.count]
+            index._exact = {key: position for key, position in self._exact.items() if position < self.count}
+            index._filled = [self.count]
+        else:
+            index._columns, index._ids, index._names = self._columns, self._ids, self._names
+            index._exact, index._filled = self._exact, self._filled
+        index._columns[:, self.count] = vectorize(name, self.dimensions)
+        index._ids[self.count] = food_id
+        index._names.append(name)
+        index._exact.setdefault(normalize_food_name(name), self.count)
+        index.count = self.count + 1
+        index._filled[0] = index.count
+        return index
+
+    def search(self, name: str, k: int = 5) -> List[Tuple[int, str, float]]:
+        """Los k alimentos más parecidos como (food_id, nombre, similitud)"""
+        if not len(self):
+            return []
+        position = self._exact.get(normalize_food_name(name))
+        if position is not None and position < self.count and k == 1:
+            return [(int(self._ids[position]), self._names[position], 1.0)]
+
+        query = vectorize(name, self.dimensions)
+        active = np.flatnonzero(query)
+        scores = query[active] @ self._columns[active, :self.count]
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(self._ids[i]), self._names[i], float(scores[i])) for i in top]
+
+
+_index_lock = threading.Lock()
+_index: Optional[FoodIndex] = None
+_index_built_at = 0.0
+
+
+def get_food_index() -> FoodIndex:
+    """
+    Índice del proceso, reconstruido cuando cambia el catálogo (señales) o tras
+    FOOD_MATCH_INDEX_TTL segundos, para ver los cambios hechos por otros procesos.
+    """
+    global _index, _index_built_at
+    index = _index
+    if index is not None and time.monotonic() - _index_built_at < settings.FOOD_MATCH_INDEX_TTL:
+        return index
+
+    with _index_lock:
+        if _index is None or time.monotonic() - _index_built_at >= settings.FOOD_MATCH_INDEX_TTL:
+            started = time.perf_counter()
+            foods = list(Food.objects.order_by('id').values_list('id', 'name'))
+            _index = FoodIndex(foods, settings.FOOD_MATCH_DIMENSIONS)
+            _index_built_at = time.monotonic()
+            logger.info(f"Índice de alimentos construido: {len(foods)} alimentos en {(time.perf_counter() - started) * 1000:.1f} ms")
+        return _index
+
+
+def invalidate_food_index():
+    global _index
+    _index = None
+
+
+@receiver(post_save, sender=Food)
+def _food_saved(sender, instance, created, **kwargs):
+    global _index
+    with _index_lock:
+        if created and _index is not None:
+            # Un alimento nuevo se añade sin reconstruir el índice completo
+            _index = _index.with_food(instance.id, instance.name)
+        else:
+            _index = None
+
+
+@receiver(post_delete, sender=Food)
+def _food_deleted(sender, **kwargs):
+    invalidate_food_index()
+
+
+def reconcile_food(name: str, calories_per_100g: float) -> Tuple[Food, bool, float]:
+    """
+    Asocia un nombre de alimento analizado a un Food existente del catálogo: el más parecido
+    que supere FOOD_MATCH_THRESHOLD y tenga las mismas palabras (ver same_food_words); si no
+    hay ninguno crea un alimento nuevo. Retorna (food, creado, similitud).
+    """
+    matches = get_food_index().search(name, k=5)
+    for food_id, matched_name, score in matches:
+        if score < settings.FOOD_MATCH_THRESHOLD:
+            break
+        if same_food_words(name, matched_name):
+            food = Food.objects.filter(id=food_id).first()
+            if food is not None:
+                if score < 1.0:
+                    logger.debug(f"Alimento '{name}' reconciliado con '{matched_name}' (similitud {score:.2f})")
+                return food, False, score
+
+    food, created = Food.objects.get_or_create(
+        name=name,
+        defaults={
+            'category': FoodCategory.objects.first(),  # Usar primera categoría por defecto
+            'calories_per_100g': calories_per_100g
+        }
+    )
+    return food, created, matches[0][2] if matches else 0.0
@@ -0,0 +1,78 @@
+import logging
+from typing import Optional
+
+from django.core.files import File
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import FoodImage, ImageBlob
+from .renditions import rendition_names
+from .storage import blob_name, file_sha256, food_image_storage
+from .uploads import AnalysisUploadedFile
+
+logger = logging.getLogger(__name__)
+
+
+def acquire_blob(file: File, content_hash: Optional[str] = None) -> ImageBlob:
+    """
+    Suma una referencia al blob con el contenido de `file`, creándolo si no existe.
+    La fila se bloquea antes de escribir el archivo: un release_blob simultáneo que la
+    dejara en 0 espera, o bien terminó y el archivo se vuelve a escribir.
+    """
+    content_hash = content_hash or file_sha256(file)
+    with transaction.atomic():
+        ImageBlob.objects.bulk_create([
+            ImageBlob(content_hash=content_hash, name=blob_name(content_hash, file.name or ''), size=file.size)
+        ], ignore_conflicts=True)
+        ImageBlob.objects.filter(content_hash=content_hash).update(
+            ref_count=F('ref_count') + 1, acquired_at=timezone.now()
+        )
+        blob = ImageBlob.objects.select_for_update().get(content_hash=content_hash)
+        # No escribe nada si el archivo ya existe
+        food_image_storage().save(blob.name, file)
+    return blob
+
+
+def release_blob(blob_id: int):
+    """Resta una referencia al blob y lo borra, con su archivo y sus versiones, si ya no lo usa ninguna FoodImage"""
+    with transaction.atomic():
+        ImageBlob.objects.filter(id=blob_id, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+        blob = ImageBlob.objects.select_for_update().filter(id=blob_id).first()
+        if blob is None or blob.ref_count > 0 or FoodImage.objects.filter(blob_id=blob_id).exists():
+            return
+        blob.delete()
+        # Dentro de la transacción: un acquire_blob del mismo contenido espera al bloqueo
+        storage = food_image_storage()
+        storage.delete(blob.name)
+        for name in rendition_names(blob.name):
+            storage.delete(name)
+    logger.info(f"Blob de imagen {blob.content_hash[:12]} borrado ({blob.size} bytes)")
+
+
+@receiver(pre_save, sender=FoodImage)
+def _store_food_image(sender, instance, raw=False, **kwargs):
+    """
+    Guarda la imagen subida en su blob y apunta la fila a él en lugar de escribir otra copia.
+    Si la procesó AnalysisImageUploadHandler se reutiliza su hash y queda en instance.upload
+    para que el análisis no vuelva a leerla.
+    """
+    if raw or not instance.image or instance.image._committed:
+        return
+    upload = instance.image.file
+    previous_blob_id = instance.blob_id
+    blob = acquire_blob(instance.image, getattr(upload, 'content_hash', None))
+    instance.blob = blob
+    instance.image = blob.name
+    if isinstance(upload, AnalysisUploadedFile):
+        instance.upload = upload
+    if previous_blob_id and previous_blob_id != blob.id:
+        release_blob(previous_blob_id)
+
+
+@receiver(post_delete, sender=FoodImage)
+def _food_image_deleted(sender, instance, **kwargs):
+    if instance.blob_id:
+        release_blob(instance.blob_id)
@@ -0,0 +1,146 @@
+import io
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+FORMAT_MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'WEBP': 'image/webp',
+    'PNG': 'image/png',
+    'GIF': 'image/gif',
+}
+
+
+def prepare_image_for_analysis(image_bytes: bytes) -> Tuple[bytes, str]:
+    """
+    Prepara una foto para enviarla al modelo de visión:
+    aplica la orientación EXIF, limita el lado mayor y la recomprime.
+    Retorna los bytes resultantes y su MIME type real.
+    """
+    max_side = settings.ANALYSIS_IMAGE_MAX_SIDE
+    output_format = settings.ANALYSIS_IMAGE_FORMAT.upper()
+    quality = settings.ANALYSIS_IMAGE_QUALITY
+
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        source_format = image.format
+        # En JPEG, decodificar directamente a escala reducida ahorra CPU y memoria
+        image.draft('RGB', (max_side, max_side))
+        image = ImageOps.exif_transpose(image)
+
+        if max(image.size) > max_side:
+            image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+
+        if output_format == 'JPEG' and image.mode != 'RGB':
+            image = _flatten_to_rgb(image)
+        elif image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGB')
+
+        buffer = io.BytesIO()
+        image.save(buffer, format=output_format, quality=quality, optimize=True)
+        processed = buffer.getvalue()
+
+        logger.debug(
+            "Imagen preparada: %s %s bytes -> %s %s bytes (%sx%s)",
+            source_format, len(image_bytes), output_format, len(processed), image.width, image.height
+        )
+        return processed, FORMAT_MIME_TYPES.get(output_format, 'image/jpeg')
+
+    except Exception as e:
+        # Si Pillow no puede procesarla se envía la original con su MIME detectado
+        logger.warning(f"No se pudo preprocesar la imagen, se envía original: {e}")
+        return image_bytes, sniff_mime_type(image_bytes)
+
+
+def _flatten_to_rgb(image: Image.Image) -> Image.Image:
+    """Convierte a RGB poniendo la transparencia sobre fondo blanco"""
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def render_renditions(image_bytes: bytes, sides: Dict[str, int], formats: Dict[str, str],
+                      quality: int) -> List[Tuple[str, str, bytes, int, int]]:
+    """
+    Versiones reducidas de una foto: una por cada lado máximo de `sides` y formato de `formats`.
+    Decodifica la original una sola vez y reduce cada versión a partir de la anterior, de mayor
+    a menor. No usa la configuración de Django, para poder ejecutarse en un ProcessPoolExecutor.
+    Retorna tuplas (versión, formato, bytes, ancho, alto); vacío si Pillow no puede leerla.
+    """
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        largest = max(sides.values())
+        image.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        if image.mode != 'RGB':
+            image = _flatten_to_rgb(image)
+    except Exception as e:
+        logger.warning(f"No se pudieron generar las versiones reducidas: {e}")
+        return []
+
+    rendered = []
+    for kind, side in sorted(sides.items(), key=lambda item: item[1], reverse=True):
+        if max(image.size) > side:
+            image.thumbnail((side, side), Image.Resampling.LANCZOS)
+        for image_format, pillow_format in formats.items():
+            buffer = io.BytesIO()
+            image.save(buffer, format=pillow_format, quality=quality, optimize=True)
+            rendered.append((kind, image_format, buffer.getvalue(), image.width, image.height))
+    return rendered
+
+
+def detect_mime_type(head: bytes) -> Optional[str]:
+    """MIME type según la firma de los primeros 12 bytes, o None si no es una imagen conocida"""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    return None
+
+
+def sniff_mime_type(image_bytes: bytes) -> str:
+    """Detecta el MIME type por la firma del archivo"""
+    return detect_mime_type(image_bytes) or 'image/jpeg'
+
+
+def image_dimensions(image_bytes: bytes) -> Tuple[int, int]:
+    """Ancho y alto leyendo solo la cabecera de la imagen; (0, 0) si no se puede leer"""
+    try:
+        return Image.open(io.BytesIO(image_bytes)).size
+    except Exception:
+        return 0, 0
+
+
+def difference_hash(image_bytes: bytes, hash_size: int = 8) -> Optional[int]:
+    """
+    Hash perceptual dHash de 64 bits: la imagen en grises y reducida a 9x8 se codifica
+    comparando cada píxel con su vecino derecho. Fotos casi iguales (recompresión,
+    pequeños cambios de encuadre o luz) difieren en pocos bits. None si no se puede leer.
+    """
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        image.draft('L', (hash_size * 16, hash_size * 16))
+        image = ImageOps.exif_transpose(image).convert('L')
+        image = image.resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+    except Exception as e:
+        logger.warning(f"No se pudo calcular el hash perceptual: {e}")
+        return None
+
+    pixels = list(image.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for column in range(hash_size):
+            value = (value << 1) | (pixels[offset + column] > pixels[offset + column + 1])
+    return value
@@ -0,0 +1,131 @@
+import logging
+from datetime import timedelta
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.db.models import F
+from django.urls import reverse
+from django.utils import timezone
+
+from .direct_uploads import ingest_direct_upload, is_direct_upload
+from .models import ActivityLog, AnalysisJob, FoodImage, MealRecord
+from .resilience import ImageRejected, ImageTooLarge, UnsupportedImageType
+from .services import FoodAnalysisService
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_analysis(food_image: FoodImage, meal: Optional[MealRecord] = None) -> AnalysisJob:
+    """Crea un trabajo de análisis pendiente para la imagen"""
+    job = AnalysisJob.objects.create(user=food_image.user, image=food_image, meal=meal)
+    logger.info(f"Trabajo de análisis {job.id} encolado para imagen {food_image.id}")
+    return job
+
+
+def requeue_stale_jobs() -> int:
+    """Devuelve a la cola los trabajos cuyo worker murió a mitad del análisis"""
+    stale_before = timezone.now() - timedelta(seconds=settings.ANALYSIS_JOB_STALE_SECONDS)
+    stale = AnalysisJob.objects.filter(status='running', started_at__lt=stale_before)
+    requeued = stale.filter(attempts__lt=settings.ANALYSIS_JOB_MAX_ATTEMPTS).update(status='pending', worker_id='')
+    stale.update(status='failed', error='El worker no completó el análisis', finished_at=timezone.now())
+    if requeued:
+        logger.warning(f"{requeued} trabajos de análisis reencolados")
+    return requeued
+
+
+def claim_next_job(worker_id: str) -> Optional[AnalysisJob]:
+    """
+    Reserva el siguiente trabajo pendiente.
+    La reserva es un UPDATE condicional sobre el estado, de modo que dos workers
+    nunca toman el mismo trabajo (funciona igual en SQLite y PostgreSQL).
+    """
+    candidates = AnalysisJob.objects.filter(status='pending').order_by('created_at').values_list('id', flat=True)[:10]
+    for job_id in candidates:
+        claimed = AnalysisJob.objects.filter(id=job_id, status='pending').update(
+            status='running',
+            worker_id=worker_id,
+            started_at=timezone.now(),
+            attempts=F('attempts') + 1
+        )
+        if claimed:
+            return AnalysisJob.objects.select_related('image', 'meal', 'user').get(id=job_id)
+    return None
+
+
+def run_job(job: AnalysisJob, analysis_service: Optional[FoodAnalysisService] = None) -> AnalysisJob:
+    """Ejecuta el análisis de un trabajo reservado y guarda el resultado"""
+    analysis_service = analysis_service or FoodAnalysisService()
+    try:
+        if is_direct_upload(job.image):
+            ingest_direct_upload(job.image)
+        analysis, processed_data = analysis_service.analyze_and_save(job.image)
+
+        if job.meal:
+            job.meal.image = job.image
+            job.meal.total_calories = processed_data['total_calories']
+            job.meal.save()
+
+            ActivityLog.objects.create(
+                user=job.user,
+                action='analysis_requested',
+                details={
+                    'meal_id': job.meal.id,
+                    'analysis_id': analysis.id,
+                    'calories_found': processed_data['total_calories'],
+                    'job_id': job.id
+                }
+            )
+
+        job.analysis = analysis
+        job.status = 'completed'
+        job.error = ''
+        job.result = {
+            'analysis_id': analysis.id,
+            'items': FoodAnalysisService.format_items(processed_data),
+            'total_calories': processed_data.get('total_calories', 0),
+            'analysis_confidence': processed_data.get('analysis_confidence', 0.5)
+        }
+        job.finished_at = timezone.now()
+        job.save()
+        logger.info(f"Trabajo de análisis {job.id} completado")
+
+    except (ImageRejected, ImageTooLarge, UnsupportedImageType) as e:
+        # Reintentar no cambia la imagen: el trabajo falla en el primer intento
+        logger.info(f"Trabajo de análisis {job.id} rechazado ({e.code}): {e.message}")
+        job.status = 'failed'
+        job.error = e.message
+        job.finished_at = timezone.now()
+        job.save()
+
+    except Exception as e:
+        logger.error(f"Error en trabajo de análisis {job.id}: {e}")
+        job.error = str(e)
+        if job.attempts < settings.ANALYSIS_JOB_MAX_ATTEMPTS:
+            job.status = 'pending'
+            job.worker_id = ''
+        else:
+            job.status = 'failed'
+            job.finished_at = timezone.now()
+        job.save()
+
+    return job
+
+
+def job_payload(job: AnalysisJob) -> Dict:
+    """Representación JSON del trabajo para los endpoints de consulta"""
+    payload = {
+        'job_id': job.id,
+        'status': job.status,
+        'attempts': job.attempts,
+        'created_at': job.created_at.isoformat(),
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'status_url': reverse('core:api_analysis_job_status', args=[job.id]),
+        'events_url': reverse('core:api_analysis_job_events', args=[job.id]),
+    }
+    if job.meal_id:
+        payload['meal_id'] = job.meal_id
+    if job.status == 'completed':
+        payload.update(job.result)
+    elif job.status == 'failed':
+        payload['error'] = job.error
+    return payload
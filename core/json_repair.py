@@ -0,0 +1,255 @@
+import json
+import logging
+import math
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_NUMBER_RE = re.compile(r'-?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?')
+_LOOSE_NUMBER_RE = re.compile(r'-?\d+(?:[.,]\d+)?')
+_BARE_KEY_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+_LITERALS = {
+    'true': True, 'false': False, 'null': None,
+    'True': True, 'False': False, 'None': None, 'NaN': None,
+}
+
+# Valor ausente (distinto de null): fin del texto o carácter inesperado
+_MISSING = object()
+
+
+class _TolerantParser:
+    """
+    Parser JSON tolerante a los fallos habituales de los modelos: comas finales o ausentes,
+    respuestas truncadas, comillas simples, claves sin comillas y literales de Python.
+    Los valores que quedan a medias al final del texto se descartan y `complete` queda en False.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.position = 0
+        self.complete = False
+
+    def parse(self) -> Any:
+        starts = [index for index in (self.text.find('{'), self.text.find('[')) if index != -1]
+        if not starts:
+            return None
+        self.position = min(starts)
+        value, self.complete = self._value()
+        return None if value is _MISSING else value
+
+    def _skip_whitespace(self):
+        while self.position < len(self.text) and self.text[self.position] in ' \t\r\n':
+            self.position += 1
+
+    def _at_end(self) -> bool:
+        return self.position >= len(self.text)
+
+    def _value(self) -> Tuple[Any, bool]:
+        """Retorna (valor, completo). Un valor incompleto se cortó al final del texto"""
+        self._skip_whitespace()
+        if self._at_end():
+            return _MISSING, False
+        char = self.text[self.position]
+        if char == '{':
+            return self._object()
+        if char == '[':
+            return self._array()
+        if char in '"\'':
+            return self._string()
+        match = _NUMBER_RE.match(self.text, self.position)
+        if match:
+            self.position = match.end()
+            number = match.group()
+            value = float(number) if any(c in number for c in '.eE') else int(number)
+            return value, not self._at_end()
+        match = _BARE_KEY_RE.match(self.text, self.position)
+        if match and match.group() in _LITERALS:
+            self.position = match.end()
+            return _LITERALS[match.group()], True
+        return _MISSING, False
+
+    def _string(self) -> Tuple[Any, bool]:
+        quote = self.text[self.position]
+        self.position += 1
+        chars = []
+        while not self._at_end():
+            char = self.text[self.position]
+            if char == '\\' and self.position + 1 < len(self.text):
+                chars.append(self.text[self.position:self.position + 2])
+                self.position += 2
+                continue
+            self.position += 1
+            if char == quote:
+                return self._decode_string(''.join(chars), quote), True
+            chars.append(char)
+        return self._decode_string(''.join(chars), quote), False
+
+    def _decode_string(self, raw: str, quote: str) -> str:
+        if quote == "'":
+            raw = raw.replace("\\'", "'").replace('"', '\\"')
+        try:
+            return json.loads(f'"{raw}"')
+        except ValueError:
+            return raw
+
+    def _key(self) -> Any:
+        if self.text[self.position] in '"\'':
+            key, complete = self._string()
+            return key if complete else _MISSING
+        match = _BARE_KEY_RE.match(self.text, self.position)
+        if not match:
+            return _MISSING
+        self.position = match.end()
+        return match.group()
+
+    def _object(self) -> Tuple[Dict, bool]:
+        self.position += 1
+        result = {}
+        while True:
+            self._skip_whitespace()
+            if self._at_end():
+                return result, False
+            char = self.text[self.position]
+            if char == '}':
+                self.position += 1
+                return result, True
+            if char == ',':
+                self.position += 1
+                continue
+            key = self._key()
+            if key is _MISSING:
+                return result, False
+            self._skip_whitespace()
+            if not self._at_end() and self.text[self.position] in ':=':
+                self.position += 1
+            value, complete = self._value()
+            if value is _MISSING:
+                return result, False
+            # Un escalar cortado al final del texto (p. ej. "150" truncado a "15") no es fiable
+            if complete or isinstance(value, (dict, list)):
+                result[key] = value
+            if not complete:
+                return result, False
+
+    def _array(self) -> Tuple[List, bool]:
+        self.position += 1
+        result = []
+        while True:
+            self._skip_whitespace()
+            if self._at_end():
+                return result, False
+            char = self.text[self.position]
+            if char == ']':
+                self.position += 1
+                return result, True
+            if char == ',':
+                self.position += 1
+                continue
+            value, complete = self._value()
+            if value is _MISSING:
+                return result, False
+            if complete or isinstance(value, (dict, list)):
+                result.append(value)
+            if not complete:
+                return result, False
+
+
+def repair_json(text: str) -> Any:
+    """Parsea JSON mal formado o truncado; retorna None si no hay ningún objeto o array"""
+    return _TolerantParser(text or '').parse()
+
+
+def _to_number(value: Any) -> Optional[float]:
+    """Convierte números o textos como '150 g' o '0,8' en número; descarta infinitos y NaN (p. ej. 1e400)"""
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, str):
+        match = _LOOSE_NUMBER_RE.search(value)
+        if match:
+            number = float(match.group().replace(',', '.'))
+            if not math.isfinite(number):
+                return None
+            return int(number) if number.is_integer() else number
+    return None
+
+
+def _to_confidence(value: Any) -> Optional[float]:
+    """Confianza entre 0 y 1 (acepta porcentajes como 85 o '85%')"""
+    number = _to_number(value)
+    if number is None:
+        return None
+    if 1 < number <= 100:
+        number = number / 100
+    return round(min(max(number, 0.0), 1.0), 2)
+
+
+def coerce_food_item(item: Any) -> Optional[Dict]:
+    """Valida un alimento del array 'foods'; retorna None si falta el nombre, los gramos o las calorías"""
+    if not isinstance(item, dict):
+        return None
+    name = item.get('name')
+    grams = _to_number(item.get('estimated_grams'))
+    calories = _to_number(item.get('calories_per_100g'))
+    if not isinstance(name, str) or not name.strip() or grams is None or calories is None:
+        logger.debug(f"Alimento descartado al validar el esquema: {item}")
+        return None
+    confidence = _to_confidence(item.get('confidence'))
+    return {
+        'name': name.strip(),
+        'estimated_grams': grams,
+        'calories_per_100g': calories,
+        'confidence': 0.5 if confidence is None else confidence,
+    }
+
+
+def coerce_food_analysis(data: Any) -> Optional[Dict]:
+    """
+    Ajusta un resultado al esquema de 'return_food_analysis': convierte tipos, descarta
+    alimentos sin nombre, gramos o calorías y recalcula los totales que falten.
+    Retorna None si no tiene la estructura mínima (lista de alimentos).
+    """
+    if isinstance(data, list):
+        data = {'foods': data}
+    if not isinstance(data, dict) or not isinstance(data.get('foods'), list):
+        return None
+
+    foods = [food for food in (coerce_food_item(item) for item in data['foods']) if food is not None]
+
+    total_calories = _to_number(data.get('total_calories'))
+    if total_calories is None:
+        total_calories = round(sum(food['estimated_grams'] * food['calories_per_100g'] / 100 for food in foods), 2)
+    analysis_confidence = _to_confidence(data.get('analysis_confidence'))
+    if analysis_confidence is None:
+        analysis_confidence = round(sum(food['confidence'] for food in foods) / len(foods), 2) if foods else 0.0
+    notes = data.get('notes')
+
+    return {
+        'foods': foods,
+        'total_calories': total_calories,
+        'analysis_confidence': analysis_confidence,
+        'notes': notes if isinstance(notes, str) else '',
+    }
+
+
+def parse_food_analysis(text: str) -> Tuple[Optional[Dict], bool]:
+    """
+    Parsea y valida la salida del modelo. Retorna (análisis, reparado): `reparado` indica
+    que el JSON estricto falló y se recuperó localmente, evitando una segunda llamada a la API.
+    Si la respuesta estaba truncada el análisis lleva 'truncated': puede faltar algún alimento,
+    así que no es definitivo (no se cachea y se escala de nivel, ver core/model_routing.py).
+    """
+    try:
+        return coerce_food_analysis(json.loads(text)), False
+    except (TypeError, ValueError):
+        pass
+    parser = _TolerantParser(text or '')
+    analysis = coerce_food_analysis(parser.parse())
+    if analysis is not None and not parser.complete:
+        logger.info("Respuesta del análisis truncada: se marca como no definitiva")
+        analysis['truncated'] = True
+    return analysis, analysis is not None
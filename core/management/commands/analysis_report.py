@@ -0,0 +1,91 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.analysis_metrics import PERCENTILES, STAGES, latency_report
+from core.models import OpenAIAnalysis
+from core.resilience import analysis_bulkhead
+
+
+class Command(BaseCommand):
+    help = 'Percentiles de latencia y uso de tokens de los análisis con OpenAI'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=7,
+            help='Analizar los últimos N días (default: 7, 0 = todo)',
+        )
+        parser.add_argument(
+            '--model',
+            help='Filtrar por modelo usado',
+        )
+
+    def handle(self, *args, **options):
+        queryset = OpenAIAnalysis.objects.all()
+        if options['days']:
+            queryset = queryset.filter(created_at__gte=timezone.now() - timedelta(days=options['days']))
+        if options['model']:
+            queryset = queryset.filter(model_used=options['model'])
+
+        bulkhead = analysis_bulkhead().status()
+        if bulkhead:
+            self.stdout.write(
+                f"🚦 Bulkhead: {bulkhead['in_flight']}/{bulkhead['max_in_flight']} en curso, "
+                f"{bulkhead['waiting']}/{bulkhead['queue_size']} esperando. "
+                f"Últimos {bulkhead['window_minutes']} min: {bulkhead['admitted']} admitidos "
+                f"({bulkhead['queued']} tras esperar), {bulkhead['rejected']} rechazados "
+                f"({bulkhead['rejection_rate']:.1%})"
+            )
+
+        report = latency_report(queryset)
+        if not report['count']:
+            self.stdout.write(self.style.WARNING('⚠️ No hay análisis con métricas en el periodo indicado'))
+            return
+
+        self.stdout.write(self.style.SUCCESS(f"📊 {report['count']} análisis con métricas"))
+        self.stdout.write(
+            f"  Caché: {report['cache_hit_rate']:.1%}  "
+            f"Compartidos: {report['coalesce_rate']:.1%}  "
+            f"Comidas repetidas: {report['repeat_rate']:.1%}  "
+            f"Con reintentos: {report['retry_rate']:.1%}  "
+            f"Fallback JSON: {report['fallback_rate']:.1%}  "
+            f"JSON reparado: {report['repair_rate']:.1%}"
+        )
+        if report['round_trips_saved']:
+            self.stdout.write(
+                f"  🔧 Llamadas de fallback evitadas: {report['round_trips_saved']} "
+                f"(~{report['tokens_saved']} tokens)"
+            )
+
+        self.stdout.write('\n⏱️ Latencia (ms):')
+        header = ''.join(f'{f"p{pct}":>10}' for pct in PERCENTILES)
+        self.stdout.write(f"  {'etapa':<8}{header}{'max':>10}{'n':>8}")
+        self._write_row('total', report['total'])
+        for stage in STAGES:
+            self._write_row(stage, report['stages'][stage])
+
+        if report['tiers']:
+            self.stdout.write(f"\n🧭 Niveles de modelo (escalados: {report['escalation_rate']:.1%}):")
+            self.stdout.write(f"  {'nivel':<8}{'intentos':>10}{'aceptados':>11}{'acierto':>9}{'p50 ms':>10}{'p95 ms':>10}")
+            for tier, stats in report['tiers'].items():
+                latency = stats['latency']
+                self.stdout.write(
+                    f"  {tier:<8}{stats['attempts']:>10}{stats['accepted']:>11}{stats['hit_rate']:>9.1%}"
+                    f"{latency['p50']:>10.1f}{latency['p95']:>10.1f}"
+                )
+
+        self.stdout.write('\n🔢 Tokens (solo llamadas a la API):')
+        for field, summary in report['tokens'].items():
+            self.stdout.write(
+                f"  {field:<18} total={summary['sum']:>10}  "
+                f"p50={summary['p50'] or 0:>7}  p95={summary['p95'] or 0:>7}"
+            )
+
+    def _write_row(self, label, summary):
+        if not summary['count']:
+            return
+        values = ''.join(f"{summary[f'p{pct}']:>10.1f}" for pct in PERCENTILES)
+        self.stdout.write(f"  {label:<8}{values}{summary['max']:>10.1f}{summary['count']:>8}")
@@ -0,0 +1,114 @@
+import io
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings
+from PIL import Image
+
+from core.models import FoodImage
+from core.openai_transport import TRANSPORT_MODES
+from core.services import FoodAnalysisService
+
+
+class Command(BaseCommand):
+    help = 'Mide el pipeline de análisis sin red usando respuestas grabadas o sintéticas'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'images',
+            nargs='*',
+            help='Imágenes a analizar (por defecto se generan imágenes de prueba)',
+        )
+        parser.add_argument(
+            '--mode',
+            choices=[mode for mode in TRANSPORT_MODES if mode != 'live'],
+            default='synthetic',
+            help='Transporte de OpenAI a usar (default: synthetic)',
+        )
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=50,
+            help='Número de análisis a ejecutar (default: 50)',
+        )
+        parser.add_argument(
+            '--latency',
+            type=float,
+            default=0.0,
+            help='Latencia simulada de la API en segundos (default: 0)',
+        )
+
+    def handle(self, *args, **options):
+        images = [self._read(path) for path in options['images']] or self._generate_images(5)
+
+        with override_settings(
+            OPENAI_TRANSPORT_MODE=options['mode'],
+            OPENAI_REPLAY_LATENCY=options['latency'],
+            ANALYSIS_CACHE_ENABLED=False,
+        ):
+            timings = self._run(images, options['iterations'])
+
+        self.stdout.write(f"📊 {options['iterations']} análisis en modo {options['mode']}:")
+        for stage, values in timings.items():
+            values_ms = sorted(value * 1000 for value in values)
+            p95 = values_ms[min(len(values_ms) - 1, int(len(values_ms) * 0.95))]
+            self.stdout.write(
+                f'  - {stage:<10} p50={statistics.median(values_ms):8.2f} ms  '
+                f'p95={p95:8.2f} ms  max={values_ms[-1]:8.2f} ms'
+            )
+
+    def _run(self, images, iterations):
+        """Ejecuta el análisis, el procesado y el guardado dentro de una transacción que se descarta"""
+        service = FoodAnalysisService()
+        openai_service = service.openai_service
+        timings = {'analyze': [], 'process': [], 'save': []}
+
+        with transaction.atomic():
+            user = User.objects.create(username=f'benchmark-{time.time_ns()}')
+            food_image = FoodImage.objects.create(
+                user=user,
+                image='benchmark/benchmark.jpg',
+                original_name='benchmark.jpg',
+                file_size=0,
+                mime_type='image/jpeg'
+            )
+
+            for iteration in range(iterations):
+                image_bytes = images[iteration % len(images)]
+
+                started = time.perf_counter()
+                try:
+                    analysis_data = openai_service._request_analysis(image_bytes, 'benchmark')
+                except LookupError as e:
+                    raise CommandError(f'{e}. Graba respuestas con OPENAI_TRANSPORT_MODE=record primero.')
+                timings['analyze'].append(time.perf_counter() - started)
+
+                started = time.perf_counter()
+                service._process_analysis_for_ui(analysis_data)
+                timings['process'].append(time.perf_counter() - started)
+
+                started = time.perf_counter()
+                analysis = openai_service.save_analysis_to_database(food_image, analysis_data)
+                timings['save'].append(time.perf_counter() - started)
+                analysis.delete()
+
+            transaction.set_rollback(True)
+
+        return timings
+
+    def _read(self, path):
+        with open(path, 'rb') as image_file:
+            return image_file.read()
+
+    def _generate_images(self, count):
+        """Imágenes de tamaño similar a una foto de móvil para medir el preprocesado"""
+        images = []
+        for index in range(count):
+            image = Image.effect_noise((3024, 4032), 40 + index).convert('RGB')
+            buffer = io.BytesIO()
+            image.save(buffer, format='JPEG', quality=90)
+            images.append(buffer.getvalue())
+        return images
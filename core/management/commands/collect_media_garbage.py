@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.media_gc import collect_media_garbage
+
+
+class Command(BaseCommand):
+    help = 'Borra las fotos que no llegaron a ninguna comida y los archivos de imagen que ya no usa ninguna fila'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-hours',
+            type=float,
+            default=settings.MEDIA_GC_GRACE_SECONDS / 3600,
+            help='Solo se borra lo que tenga más de estas horas (default: MEDIA_GC_GRACE_SECONDS)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=settings.MEDIA_GC_BATCH_SIZE,
+            help='Filas o archivos comprobados por consulta (default: MEDIA_GC_BATCH_SIZE)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Solo cuenta lo que se borraría',
+        )
+        parser.add_argument(
+            '--files-only',
+            action='store_true',
+            help='No borra fotos abandonadas, solo archivos huérfanos',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'🧹 Buscando fotos abandonadas y archivos huérfanos de más de {options["grace_hours"]:g} h...')
+        report = collect_media_garbage(
+            grace_seconds=int(options['grace_hours'] * 3600),
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run'],
+            rows=not options['files_only'],
+        )
+
+        freed_mb = (report['image_bytes'] + report['file_bytes']) / 1024 / 1024
+        self.stdout.write(
+            f'📊 {report["files_scanned"]} archivos revisados, {report["uploads_purged"]} subidas caducadas borradas'
+        )
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(
+                f'🔍 Se borrarían {report["images_deleted"]} fotos abandonadas y {report["files_deleted"]} '
+                f'archivos huérfanos ({report["file_bytes"] / 1024 / 1024:.1f} MB en archivos)'
+            ))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'🎉 {report["images_deleted"]} fotos abandonadas y {report["files_deleted"]} archivos huérfanos '
+            f'borrados, {freed_mb:.1f} MB liberados'
+        ))
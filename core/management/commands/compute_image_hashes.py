@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from core.image_processing import difference_hash
+from core.models import FoodImage
+
+
+class Command(BaseCommand):
+    help = 'Calcula el hash perceptual de las imágenes subidas antes de existir la detección de comidas repetidas'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=200,
+            help='Imágenes leídas por consulta (default: 200)',
+        )
+
+    def handle(self, *args, **options):
+        pending = FoodImage.objects.filter(perceptual_hash='').order_by('id')
+        total = pending.count()
+        if not total:
+            self.stdout.write(self.style.SUCCESS('✅ Todas las imágenes tienen hash perceptual'))
+            return
+
+        self.stdout.write(f'📊 {total} imágenes sin hash perceptual')
+        hashed = failed = 0
+        last_id = 0
+        while True:
+            batch = list(pending.filter(id__gt=last_id)[:options['batch_size']])
+            if not batch:
+                break
+            for food_image in batch:
+                last_id = food_image.id
+                try:
+                    with food_image.image.open('rb') as image_file:
+                        value = difference_hash(image_file.read())
+                except (OSError, ValueError) as e:
+                    self.stdout.write(self.style.WARNING(f'⚠️ Imagen {food_image.id}: {e}'))
+                    value = None
+                if value is None:
+                    failed += 1
+                    continue
+                # update() evita tocar updated_at y las señales de guardado
+                FoodImage.objects.filter(id=food_image.id).update(perceptual_hash=f'{value:016x}')
+                hashed += 1
+
+        self.stdout.write(self.style.SUCCESS(f'🎉 {hashed} imágenes con hash perceptual, {failed} sin poder leer'))
@@ -0,0 +1,112 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from core.image_blobs import acquire_blob
+from core.models import FoodImage, ImageBlob
+from core.renditions import delete_renditions, rendition_names
+from core.storage import file_sha256, food_image_storage
+
+# acquire_blob suma la referencia antes de insertar la FoodImage: un blob sin filas que
+# acaba de tomar una referencia puede estar a mitad de una subida y no se borra
+RECOUNT_GRACE = timedelta(hours=1)
+
+
+class Command(BaseCommand):
+    help = 'Pasa las imágenes subidas antes del almacenamiento por contenido a blobs compartidos y borra las copias'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=200,
+            help='Imágenes leídas por consulta (default: 200)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Solo calcula cuántas copias hay y el espacio que se liberaría',
+        )
+
+    def handle(self, *args, **options):
+        storage = food_image_storage()
+        pending = FoodImage.objects.filter(blob__isnull=True).exclude(image='').order_by('id')
+        total = pending.count()
+        if total:
+            self.stdout.write(f'📊 {total} imágenes sin deduplicar')
+        else:
+            self.stdout.write(self.style.SUCCESS('✅ Todas las imágenes usan blobs compartidos'))
+
+        migrated = failed = 0
+        freed_bytes = 0
+        seen_hashes = set(ImageBlob.objects.values_list('content_hash', flat=True))
+        last_id = 0
+        while True:
+            batch = list(pending.filter(id__gt=last_id)[:options['batch_size']])
+            if not batch:
+                break
+            for food_image in batch:
+                last_id = food_image.id
+                legacy_name = food_image.image.name
+                try:
+                    with storage.open(legacy_name, 'rb') as image_file:
+                        content_hash = file_sha256(image_file)
+                        size = image_file.size
+                        # La primera copia de cada contenido pasa a ser el blob; las demás solo se borran
+                        if content_hash in seen_hashes:
+                            freed_bytes += size
+                        seen_hashes.add(content_hash)
+                        if options['dry_run']:
+                            continue
+                        blob = acquire_blob(image_file, content_hash)
+                except OSError as e:
+                    self.stdout.write(self.style.WARNING(f'⚠️ Imagen {food_image.id} ({legacy_name}): {e}'))
+                    failed += 1
+                    continue
+                # update() evita tocar updated_at y las señales de guardado
+                # Las versiones reducidas de la copia se vuelven a generar junto al blob al pedirlas
+                delete_renditions(food_image)
+                FoodImage.objects.filter(id=food_image.id).update(blob=blob, image=blob.name)
+                if legacy_name != blob.name and not FoodImage.objects.filter(image=legacy_name).exists():
+                    storage.delete(legacy_name)
+                migrated += 1
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(
+                f'🔍 {len(seen_hashes)} contenidos distintos; se liberarían {freed_bytes / 1024 / 1024:.1f} MB'
+            ))
+            return
+
+        fixed = self._recount_references()
+        self.stdout.write(self.style.SUCCESS(
+            f'🎉 {migrated} imágenes deduplicadas, {failed} sin poder leer, '
+            f'{freed_bytes / 1024 / 1024:.1f} MB liberados, {fixed} contadores corregidos'
+        ))
+
+    def _recount_references(self) -> int:
+        """
+        Ajusta ref_count al número real de FoodImage de cada blob y borra los que no usa ninguna
+        desde hace RECOUNT_GRACE. El borrado se vuelve a comprobar con la fila bloqueada, como
+        en release_blob, por si la aplicación tomó una referencia entre tanto.
+        """
+        storage = food_image_storage()
+        cutoff = timezone.now() - RECOUNT_GRACE
+        fixed = 0
+        drifted = ImageBlob.objects.annotate(references=Count('images')).exclude(ref_count=F('references'))
+        for blob in drifted:
+            if blob.references:
+                ImageBlob.objects.filter(id=blob.id).update(ref_count=blob.references)
+                fixed += 1
+                continue
+            with transaction.atomic():
+                locked = ImageBlob.objects.select_for_update().filter(id=blob.id, acquired_at__lt=cutoff).first()
+                if locked is None or FoodImage.objects.filter(blob_id=blob.id).exists():
+                    continue
+                locked.delete()
+                for name in [locked.name, *rendition_names(locked.name)]:
+                    storage.delete(name)
+            fixed += 1
+        return fixed
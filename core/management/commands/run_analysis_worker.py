@@ -0,0 +1,79 @@
+import os
+import signal
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core.chunked_uploads import purge_expired_uploads
+from core.direct_uploads import purge_expired_direct_uploads
+from core.jobs import claim_next_job, requeue_stale_jobs, run_job
+from core.media_gc import collect_media_garbage_if_due
+from core.services import FoodAnalysisService
+
+
+class Command(BaseCommand):
+    help = 'Procesa la cola de trabajos de análisis de imágenes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=1.0,
+            help='Segundos de espera cuando la cola está vacía (default: 1.0)',
+        )
+        parser.add_argument(
+            '--max-jobs',
+            type=int,
+            default=0,
+            help='Terminar tras procesar este número de trabajos (0 = sin límite)',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Procesar los trabajos pendientes y salir',
+        )
+
+    def handle(self, *args, **options):
+        worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        self._stopping = False
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        self.stdout.write(f'👷 Worker de análisis {worker_id} iniciado')
+        analysis_service = FoodAnalysisService()
+        processed = 0
+
+        while not self._stopping:
+            close_old_connections()
+            requeue_stale_jobs()
+            job = claim_next_job(worker_id)
+
+            if job is None:
+                # Con la cola vacía se aprovecha para borrar las subidas abandonadas
+                purge_expired_uploads()
+                purge_expired_direct_uploads()
+                # y, una vez al día entre todos los workers, las fotos y archivos huérfanos
+                report = collect_media_garbage_if_due()
+                if report is not None:
+                    self.stdout.write(
+                        f'🧹 GC de media: {report["images_deleted"]} fotos y {report["files_deleted"]} archivos borrados'
+                    )
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+
+            job = run_job(job, analysis_service)
+            processed += 1
+            self.stdout.write(f'   Trabajo {job.id}: {job.get_status_display()}')
+
+            if options['max_jobs'] and processed >= options['max_jobs']:
+                break
+
+        self.stdout.write(self.style.SUCCESS(f'✅ Worker detenido tras procesar {processed} trabajos'))
+
+    def _stop(self, signum, frame):
+        """Termina el trabajo actual antes de salir"""
+        self._stopping = True
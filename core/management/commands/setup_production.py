@@ -14,6 +14,7 @@ class Command(BaseCommand):
         # 1. Ejecutar migraciones
         self.stdout.write('📊 Ejecutando migraciones...')
         call_command('migrate')
+        call_command('createcachetable')
         
         # 2. Poblar categorías
         self.stdout.write('📂 Poblando categorías...')
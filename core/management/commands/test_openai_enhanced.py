@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.conf import settings
 from core.services import OpenAIService
+from core.openai_client import get_pool_stats
 import logging
 
 logger = logging.getLogger(__name__)
@@ -19,6 +20,11 @@ class Command(BaseCommand):
             action='store_true',
             help='Mostrar información del modelo',
         )
+        parser.add_argument(
+            '--pool-stats',
+            action='store_true',
+            help='Mostrar estadísticas del pool de conexiones tras validar la API key',
+        )
 
     def handle(self, *args, **options):
         if not settings.OPENAI_API_KEY:
@@ -35,6 +41,9 @@ class Command(BaseCommand):
             self._test_model_info(openai_service)
         else:
             self._test_full_integration(openai_service)
+        
+        if options['pool_stats']:
+            self._show_pool_stats()
 
     def _test_api_key(self, openai_service):
         """Probar que la API key sea válida"""
@@ -53,6 +62,12 @@ class Command(BaseCommand):
                 self.style.ERROR(f'❌ Error validando API key: {e}')
             )
 
+    def _show_pool_stats(self):
+        """Mostrar el estado del pool de conexiones del proceso"""
+        self.stdout.write('\n🔌 Pool de conexiones:')
+        for key, value in get_pool_stats().items():
+            self.stdout.write(f'  - {key}: {value}')
+
     def _test_model_info(self, openai_service):
         """Probar información del modelo"""
         try:
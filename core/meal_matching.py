@@ -0,0 +1,191 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Any, List, Optional, Tuple
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .image_processing import difference_hash
+from .models import FoodImage, OpenAIAnalysis
+
+logger = logging.getLogger(__name__)
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """
+    Árbol BK sobre la distancia de Hamming entre hashes perceptuales.
+    La desigualdad triangular permite descartar ramas enteras al buscar los hashes
+    a distancia <= d, sin comparar con todas las comidas del usuario.
+    """
+
+    def __init__(self):
+        # Nodo: (hash, elementos con ese hash, hijos por distancia al nodo)
+        self.root: Optional[Tuple[int, List[Any], dict]] = None
+        self.size = 0
+
+    def add(self, value: int, item: Any):
+        self.size += 1
+        if self.root is None:
+            self.root = (value, [item], {})
+            return
+        node = self.root
+        while True:
+            distance = hamming_distance(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (value, [item], {})
+                return
+            node = child
+
+    def remove(self, value: int, item: Any) -> bool:
+        """Quita un elemento; su nodo se conserva aunque quede vacío porque sigue ordenando a sus hijos"""
+        node = self.root
+        while node is not None:
+            distance = hamming_distance(value, node[0])
+            if distance == 0:
+                if item not in node[1]:
+                    return False
+                node[1].remove(item)
+                self.size -= 1
+                return True
+            node = node[2].get(distance)
+        return False
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, Any]]:
+        """Retorna (distancia, elemento) de los hashes a distancia <= max_distance, del más cercano al más lejano"""
+        results = []
+        pending = [self.root] if self.root is not None else []
+        while pending:
+            node = pending.pop()
+            distance = hamming_distance(value, node[0])
+            if distance <= max_distance:
+                results.extend((distance, item) for item in node[1])
+            # Copia de los hijos: otro hilo puede estar añadiendo análisis nuevos
+            for child_distance, child in list(node[2].items()):
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    pending.append(child)
+        results.sort(key=lambda result: result[0])
+        return results
+
+
+_indexes_lock = threading.Lock()
+# user_id -> (árbol, momento de construcción); los usuarios menos recientes salen primero
+_indexes: 'OrderedDict[int, Tuple[BKTree, float]]' = OrderedDict()
+
+
+def get_user_meal_index(user_id: int) -> BKTree:
+    """
+    Índice de las comidas analizadas de un usuario en los últimos REPEAT_MEAL_LOOKBACK_DAYS días.
+    Se guarda en el proceso para los últimos REPEAT_MEAL_INDEX_USERS usuarios y se reconstruye
+    tras REPEAT_MEAL_INDEX_TTL segundos para ver los análisis guardados por otros procesos.
+    """
+    with _indexes_lock:
+        entry = _indexes.get(user_id)
+        if entry is not None and time.monotonic() - entry[1] < settings.REPEAT_MEAL_INDEX_TTL:
+            _indexes.move_to_end(user_id)
+            return entry[0]
+
+    since = timezone.now() - timedelta(days=settings.REPEAT_MEAL_LOOKBACK_DAYS)
+    rows = (
+        OpenAIAnalysis.objects
+        .filter(image__user_id=user_id, created_at__gte=since, calculated_calories__gt=0)
+        .exclude(image__perceptual_hash='')
+        .values_list('id', 'image__perceptual_hash')
+    )
+    tree = BKTree()
+    for analysis_id, perceptual_hash in rows:
+        tree.add(int(perceptual_hash, 16), analysis_id)
+
+    with _indexes_lock:
+        _indexes[user_id] = (tree, time.monotonic())
+        _indexes.move_to_end(user_id)
+        while len(_indexes) > settings.REPEAT_MEAL_INDEX_USERS:
+            _indexes.popitem(last=False)
+    logger.debug(f"Índice de comidas del usuario {user_id} construido con {tree.size} análisis")
+    return tree
+
+
+def invalidate_user_meal_index(user_id: int):
+    with _indexes_lock:
+        _indexes.pop(user_id, None)
+
+
+def find_repeat_meal(food_image: FoodImage) -> Optional[Tuple[OpenAIAnalysis, int]]:
+    """
+    Busca una comida anterior del usuario cuya foto se parezca a esta
+    (distancia de Hamming <= REPEAT_MEAL_MAX_DISTANCE). Retorna (análisis, distancia).
+    """
+    if not food_image.perceptual_hash:
+        return None
+    matches = get_user_meal_index(food_image.user_id).search(
+        int(food_image.perceptual_hash, 16), settings.REPEAT_MEAL_MAX_DISTANCE
+    )
+    # A igual distancia se sugiere la última vez que se comió (los ids crecen con el tiempo)
+    for distance, analysis_id in sorted(matches, key=lambda match: (match[0], -match[1])):
+        analysis = OpenAIAnalysis.objects.filter(id=analysis_id).exclude(image=food_image).first()
+        if analysis is not None:
+            return analysis, distance
+    return None
+
+
+@receiver(pre_save, sender=FoodImage)
+def _hash_food_image(sender, instance, raw=False, **kwargs):
+    """Calcula el hash perceptual al subir la imagen"""
+    if raw or instance.perceptual_hash or not instance.image:
+        return
+    upload = getattr(instance, 'upload', None)
+    try:
+        if upload is not None:
+            image_bytes = upload.getvalue()
+        else:
+            instance.image.open('rb')
+            image_bytes = instance.image.read()
+            instance.image.seek(0)
+    except Exception as e:
+        logger.warning(f"No se pudo leer la imagen para calcular su hash perceptual: {e}")
+        return
+    value = difference_hash(image_bytes)
+    if value is not None:
+        instance.perceptual_hash = f'{value:016x}'
+
+
+@receiver(post_save, sender=OpenAIAnalysis)
+def _analysis_saved(sender, instance, created, **kwargs):
+    image = instance.image
+    if not created or not image.perceptual_hash or instance.calculated_calories <= 0:
+        return
+    with _indexes_lock:
+        entry = _indexes.get(image.user_id)
+    # Si el índice del usuario está cargado, el análisis nuevo se añade sin reconstruirlo
+    if entry is not None:
+        entry[0].add(int(image.perceptual_hash, 16), instance.id)
+
+
+@receiver(post_delete, sender=OpenAIAnalysis)
+def _analysis_deleted(sender, instance, **kwargs):
+    image = FoodImage.objects.filter(id=instance.image_id).values_list('user_id', 'perceptual_hash').first()
+    if image is None:
+        return
+    user_id, perceptual_hash = image
+    with _indexes_lock:
+        entry = _indexes.get(user_id)
+    # Si el índice está cargado se quita solo este análisis (p. ej. al reanalizar) sin reconstruirlo
+    if entry is not None and not (perceptual_hash and entry[0].remove(int(perceptual_hash, 16), instance.id)):
+        invalidate_user_meal_index(user_id)
+
+
+@receiver(post_delete, sender=FoodImage)
+def _image_deleted(sender, instance, **kwargs):
+    invalidate_user_meal_index(instance.user_id)
@@ -0,0 +1,151 @@
+import logging
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .chunked_uploads import purge_expired_uploads
+from .direct_uploads import DIRECT_UPLOAD_PREFIX, purge_expired_direct_uploads
+from .models import DirectUpload, FoodImage, FoodImageRendition, ImageBlob
+from .storage import BLOB_PREFIX, food_image_storage
+
+logger = logging.getLogger(__name__)
+
+# Carpetas del almacenamiento que son solo de las fotos; el resto de MEDIA_ROOT no se toca
+GC_PREFIXES = (BLOB_PREFIX, DIRECT_UPLOAD_PREFIX)
+
+StoredFile = Tuple[str, int, float]
+
+
+def abandoned_food_images(cutoff):
+    """
+    Fotos anteriores a `cutoff` que no llegaron a ninguna comida ni tienen un análisis en curso.
+    Las fotos secundarias de una comida con varias fotos cuentan como parte de ella.
+    """
+    return FoodImage.objects.filter(created_at__lt=cutoff, meal_records__isnull=True).exclude(
+        primary_image__meal_records__isnull=False
+    ).exclude(
+        analysis_jobs__status__in=['pending', 'running']
+    )
+
+
+def delete_abandoned_images(cutoff, batch_size: int, dry_run: bool = False) -> Tuple[int, int]:
+    """
+    Borra por lotes las fotos abandonadas (con su análisis y sus versiones). Los blobs que dejan
+    de usarse se borran con ellas (ver release_blob). Retorna (filas, bytes de originales liberados).
+    """
+    abandoned = abandoned_food_images(cutoff)
+    deleted = freed_bytes = 0
+    last_id = 0
+    while True:
+        batch = list(abandoned.filter(id__gt=last_id).order_by('id').values_list('id', 'blob_id', 'blob__size')[:batch_size])
+        if not batch:
+            break
+        last_id = batch[-1][0]
+        if dry_run:
+            deleted += len(batch)
+            continue
+        ids = [image_id for image_id, _, _ in batch]
+        blob_sizes = {blob_id: size for _, blob_id, size in batch if blob_id}
+        # Se vuelve a filtrar al borrar: una foto que entre tanto pasó a una comida se conserva
+        deleted += abandoned.filter(id__in=ids).delete()[1].get(FoodImage._meta.label, 0)
+        remaining = set(ImageBlob.objects.filter(id__in=blob_sizes).values_list('id', flat=True))
+        freed_bytes += sum(size for blob_id, size in blob_sizes.items() if blob_id not in remaining)
+    return deleted, freed_bytes
+
+
+def _referenced_names(names: List[str]) -> Set[str]:
+    referenced = set(FoodImage.objects.filter(image__in=names).values_list('image', flat=True))
+    for model in (ImageBlob, FoodImageRendition, DirectUpload):
+        referenced.update(model.objects.filter(name__in=names).values_list('name', flat=True))
+    return referenced
+
+
+def _delete_unreferenced(storage, batch: List[StoredFile], cutoff_ts: float, dry_run: bool) -> Tuple[int, int]:
+    referenced = _referenced_names([name for name, _, _ in batch])
+    deleted = freed_bytes = 0
+    for name, size, _ in batch:
+        if name in referenced:
+            continue
+        if not dry_run:
+            try:
+                # Un archivo reutilizado tras el listado (ver ContentAddressedStorage._save) se conserva
+                if storage.get_modified_time(name).timestamp() >= cutoff_ts:
+                    continue
+            except FileNotFoundError:
+                continue
+            storage.delete(name)
+        deleted += 1
+        freed_bytes += size
+    return deleted, freed_bytes
+
+
+def _batches(files: Iterable[StoredFile], cutoff_ts: float, batch_size: int):
+    batch = []
+    for stored_file in files:
+        if stored_file[2] >= cutoff_ts:
+            continue
+        batch.append(stored_file)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def delete_unreferenced_files(cutoff, batch_size: int, dry_run: bool = False) -> Tuple[int, int, int]:
+    """
+    Recorre las carpetas de fotos del almacenamiento y borra los archivos anteriores a `cutoff`
+    que no nombra ninguna fila: copias de imágenes borradas, versiones reducidas sueltas y
+    temporales de escrituras interrumpidas. Las referencias se consultan por lotes, así que la
+    memoria no crece con el número de archivos. Retorna (revisados, borrados, bytes liberados).
+    """
+    storage = food_image_storage()
+    cutoff_ts = cutoff.timestamp()
+    scanned = deleted = freed_bytes = 0
+
+    def counted(files):
+        nonlocal scanned
+        for stored_file in files:
+            scanned += 1
+            yield stored_file
+
+    for prefix in GC_PREFIXES:
+        for batch in _batches(counted(storage.iter_files(prefix)), cutoff_ts, batch_size):
+            batch_deleted, batch_bytes = _delete_unreferenced(storage, batch, cutoff_ts, dry_run)
+            deleted += batch_deleted
+            freed_bytes += batch_bytes
+            logger.debug(f"GC de media: {scanned} archivos revisados, {deleted} borrados")
+    return scanned, deleted, freed_bytes
+
+
+def collect_media_garbage(grace_seconds: Optional[int] = None, batch_size: Optional[int] = None,
+                          dry_run: bool = False, rows: bool = True) -> Dict[str, int]:
+    """Fotos abandonadas, subidas caducadas y archivos huérfanos más antiguos que el periodo de gracia"""
+    grace_seconds = settings.MEDIA_GC_GRACE_SECONDS if grace_seconds is None else grace_seconds
+    batch_size = batch_size or settings.MEDIA_GC_BATCH_SIZE
+    cutoff = timezone.now() - timedelta(seconds=grace_seconds)
+
+    report = {'images_deleted': 0, 'image_bytes': 0, 'uploads_purged': 0}
+    if rows:
+        report['images_deleted'], report['image_bytes'] = delete_abandoned_images(cutoff, batch_size, dry_run)
+        if not dry_run:
+            report['uploads_purged'] = purge_expired_uploads() + purge_expired_direct_uploads()
+    report['files_scanned'], report['files_deleted'], report['file_bytes'] = delete_unreferenced_files(
+        cutoff, batch_size, dry_run
+    )
+    logger.info(
+        f"GC de media: {report['images_deleted']} fotos abandonadas, {report['files_deleted']} archivos "
+        f"huérfanos, {(report['image_bytes'] + report['file_bytes']) / 1024 / 1024:.1f} MB liberados"
+    )
+    return report
+
+
+def collect_media_garbage_if_due() -> Optional[Dict[str, int]]:
+    """Para run_analysis_worker: como mucho una pasada cada MEDIA_GC_INTERVAL_SECONDS entre todos los workers"""
+    interval = settings.MEDIA_GC_INTERVAL_SECONDS
+    if interval <= 0 or not cache.add('media_gc:last_run', True, timeout=interval):
+        return None
+    return collect_media_garbage()
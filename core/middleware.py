@@ -1,9 +1,12 @@
 import os
 import logging
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
 from django.conf import settings
 from django.http import Http404
 from django.views.static import serve
 
+from .uploads import AnalysisImageUploadHandler
+
 # Configurar logger
 logger = logging.getLogger(__name__)
 
@@ -11,10 +14,31 @@ class StaticFilesMiddleware:
     """
     Middleware para servir archivos estáticos en producción
     """
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        static_response = self._serve_static(request)
+        if static_response is not None:
+            return static_response
+        
+        response = self.get_response(request)
+        return response
+
+    async def __acall__(self, request):
+        if request.path.startswith('/static/'):
+            return await sync_to_async(self._serve_static)(request)
+        return await self.get_response(request)
+
+    def _serve_static(self, request):
+        """Retorna la respuesta del archivo estático o None si la URL no es estática"""
         # Verificar si la URL es para archivos estáticos
         if request.path.startswith('/static/'):
             # Remover el prefijo /static/ para obtener la ruta del archivo
@@ -28,19 +52,37 @@ class StaticFilesMiddleware:
                 return serve(request, file_path, document_root=settings.STATIC_ROOT)
             else:
                 raise Http404("Static file not found")
-        
-        response = self.get_response(request)
-        return response
+        return None
 
 
 class AuthLoggingMiddleware:
     """
     Middleware para logging detallado de autenticación
     """
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        self._log_request(request)
+        response = self.get_response(request)
+        self._log_response(request, response)
+        return response
+
+    async def __acall__(self, request):
+        # Con ASGI el middleware no debe forzar el paso a un hilo síncrono
+        self._log_request(request)
+        response = await self.get_response(request)
+        self._log_response(request, response)
+        return response
+
+    def _log_request(self, request):
         # Log de la request
         logger.info(f"🔍 REQUEST: {request.method} {request.path}")
         logger.info(f"   User-Agent: {request.META.get('HTTP_USER_AGENT', 'N/A')}")
@@ -52,9 +94,8 @@ class AuthLoggingMiddleware:
             logger.info(f"   Username: {request.POST.get('username', 'N/A')}")
             logger.info(f"   Password length: {len(request.POST.get('password', ''))}")
             logger.info(f"   CSRF Token: {request.POST.get('csrfmiddlewaretoken', 'N/A')[:20]}...")
-        
-        response = self.get_response(request)
-        
+
+    def _log_response(self, request, response):
         # Log de la response
         logger.info(f"📤 RESPONSE: {response.status_code}")
         if hasattr(response, 'content'):
@@ -71,5 +112,31 @@ class AuthLoggingMiddleware:
                     content = response.content.decode('utf-8')
                     if 'error' in content.lower():
                         logger.error("   Error message found in response")
-        
-        return response 
\ No newline at end of file
+
+
+class AnalysisUploadMiddleware:
+    """
+    Instala AnalysisImageUploadHandler en las vistas marcadas con @analysis_upload.
+    Va antes de CsrfViewMiddleware, que lee el formulario (y con él las imágenes) con los
+    manejadores por defecto.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        return await self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method == 'POST' and getattr(view_func, 'analysis_upload', False):
+            request.upload_handlers = [AnalysisImageUploadHandler(request)]
+        return None
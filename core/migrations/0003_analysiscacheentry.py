@@ -0,0 +1,31 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:31
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_mealdetail_confidence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalysisCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(help_text='SHA-256 de los bytes de la imagen', max_length=64)),
+                ('prompt_version', models.CharField(help_text='Versión del prompt y del esquema de la herramienta', max_length=32)),
+                ('payload', models.JSONField(default=dict, help_text='Análisis devuelto por OpenAI')),
+                ('hit_count', models.IntegerField(default=0)),
+                ('last_used_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Entrada de Caché de Análisis',
+                'verbose_name_plural': 'Entradas de Caché de Análisis',
+                'unique_together': {('content_hash', 'prompt_version')},
+            },
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_analysisjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='openaianalysis',
+            name='cache_hit',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='openaianalysis',
+            name='completion_tokens',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='openaianalysis',
+            name='fallback_used',
+            field=models.BooleanField(default=False, help_text='Se usó el reintento sin tools (JSON)'),
+        ),
+        migrations.AddField(
+            model_name='openaianalysis',
+            name='image_tokens',
+            field=models.PositiveIntegerField(default=0, help_text='Estimado a partir del tamaño de la imagen enviada'),
+        ),
+        migrations.AddField(
+            model_name='openaianalysis',
+            name='model_used',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='openaianalysis',
+            name='payload_bytes',
+            field=models.PositiveIntegerField(default=0, help_text='Tamaño de la imagen en base64 enviada a la API'),
+        ),
+        migrations.AddField(
+            model_name='openaianalysis',
+            name='prompt_tokens',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='openaianalysis',
+            name='retry_count',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Peticiones a la API además de la primera'),
+        ),
+        migrations.AddField(
+            model_name='openaianalysis',
+            name='stage_timings',
+            field=models.JSONField(blank=True, default=dict, help_text='Milisegundos por etapa: read, cache, encode, api, parse, db'),
+        ),
+        migrations.AddField(
+            model_name='openaianalysis',
+            name='total_latency_ms',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_openaianalysis_metrics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FoodCategoryKeyword',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('keyword', models.CharField(help_text='Se compara sin acentos ni mayúsculas al inicio de una palabra', max_length=100)),
+                ('priority', models.PositiveSmallIntegerField(default=100, help_text='Si coinciden varias categorías gana la de menor prioridad')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='keywords', to='core.foodcategory')),
+            ],
+            options={
+                'verbose_name': 'Palabra Clave de Categoría',
+                'verbose_name_plural': 'Palabras Clave de Categorías',
+                'ordering': ['priority', 'keyword'],
+                'unique_together': {('category', 'keyword')},
+            },
+        ),
+    ]
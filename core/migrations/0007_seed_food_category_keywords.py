@@ -0,0 +1,58 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:47
+
+from django.db import migrations
+
+# Mapeo que antes estaba fijo en FoodAnalysisService._categorize_food.
+# El orden se conserva como prioridad: antes ganaba la primera categoría que coincidía.
+CATEGORY_KEYWORDS = [
+    ('Frutas', '#FF6B6B', 'Frutas frescas y secas',
+     ['manzana', 'plátano', 'naranja', 'fresa', 'uva', 'pera', 'piña', 'mango']),
+    ('Verduras', '#4ECDC4', 'Verduras y hortalizas',
+     ['lechuga', 'tomate', 'zanahoria', 'brócoli', 'espinaca', 'cebolla', 'pimiento']),
+    ('Carnes', '#FF8A80', 'Carnes rojas y blancas',
+     ['pollo', 'res', 'cerdo', 'pavo', 'cordero', 'ternera']),
+    ('Pescados', '#81C784', 'Pescados y mariscos',
+     ['salmón', 'atún', 'bacalao', 'trucha', 'merluza']),
+    ('Lácteos', '#90A4AE', 'Leche y productos lácteos',
+     ['leche', 'queso', 'yogur', 'mantequilla', 'crema']),
+    ('Cereales', '#D7CCC8', 'Cereales y granos',
+     ['arroz', 'pasta', 'pan', 'avena', 'trigo', 'maíz']),
+    ('Legumbres', '#8D6E63', 'Legumbres y granos',
+     ['frijol', 'lenteja', 'garbanzo', 'haba', 'guisante']),
+    ('Frutos secos', '#BCAAA4', 'Frutos secos y semillas',
+     ['almendra', 'nuez', 'cacahuete', 'avellana', 'pistacho']),
+]
+
+
+def seed_keywords(apps, schema_editor):
+    FoodCategory = apps.get_model('core', 'FoodCategory')
+    FoodCategoryKeyword = apps.get_model('core', 'FoodCategoryKeyword')
+
+    for position, (name, color, description, keywords) in enumerate(CATEGORY_KEYWORDS):
+        category, _ = FoodCategory.objects.get_or_create(
+            name=name,
+            defaults={'color': color, 'description': description}
+        )
+        for keyword in keywords:
+            FoodCategoryKeyword.objects.get_or_create(
+                category=category,
+                keyword=keyword,
+                defaults={'priority': (position + 1) * 10}
+            )
+
+
+def remove_keywords(apps, schema_editor):
+    FoodCategoryKeyword = apps.get_model('core', 'FoodCategoryKeyword')
+    for name, _, _, keywords in CATEGORY_KEYWORDS:
+        FoodCategoryKeyword.objects.filter(category__name=name, keyword__in=keywords).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_foodcategorykeyword'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_keywords, remove_keywords),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_seed_food_category_keywords'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='openaianalysis',
+            name='json_repaired',
+            field=models.BooleanField(default=False, help_text='El JSON mal formado se reparó localmente, sin reintento'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_openaianalysis_json_repaired'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='foodimage',
+            name='perceptual_hash',
+            field=models.CharField(blank=True, db_index=True, help_text='dHash de 64 bits en hexadecimal para detectar comidas repetidas', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='openaianalysis',
+            name='repeated_from',
+            field=models.ForeignKey(blank=True, help_text='Análisis copiado de una comida anterior parecida, sin llamar a la API', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='repeats', to='core.openaianalysis'),
+        ),
+    ]
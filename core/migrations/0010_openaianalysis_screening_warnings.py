@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_repeat_meal_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='openaianalysis',
+            name='screening_warnings',
+            field=models.JSONField(blank=True, default=list, help_text='Avisos del cribado local de la imagen (p. ej. foto algo borrosa)'),
+        ),
+        migrations.AlterField(
+            model_name='openaianalysis',
+            name='stage_timings',
+            field=models.JSONField(blank=True, default=dict, help_text='Milisegundos por etapa: read, cache, screen, encode, api, parse, db'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.4 on 2026-10-17 03:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_openaianalysis_screening_warnings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='openaianalysis',
+            name='escalated',
+            field=models.BooleanField(default=False, help_text='El primer nivel no bastó y se escaló a un modelo más completo'),
+        ),
+        migrations.AddField(
+            model_name='openaianalysis',
+            name='routing_tier',
+            field=models.CharField(blank=True, help_text='Nivel de modelo cuyo resultado se guardó (p. ej. fast, full)', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='openaianalysis',
+            name='tier_latencies',
+            field=models.JSONField(blank=True, default=dict, help_text='Milisegundos de la llamada de cada nivel de modelo intentado'),
+        ),
+    ]
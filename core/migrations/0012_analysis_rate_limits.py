@@ -0,0 +1,32 @@
+# Generated by Django 5.2.4 on 2026-10-17 03:08
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_model_routing'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RateLimitBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(help_text='p. ej. analysis:user:42 o analysis:global', max_length=100, unique=True)),
+                ('tokens', models.FloatField(help_text='Tokens disponibles en updated_at')),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Cuota de Análisis',
+                'verbose_name_plural': 'Cuotas de Análisis',
+            },
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='analysis_tier',
+            field=models.CharField(choices=[('free', 'Gratuito'), ('premium', 'Premium'), ('unlimited', 'Sin límite')], default='free', help_text='Cuota de análisis de imágenes (ANALYSIS_RATE_LIMIT_TIERS)', max_length=20),
+        ),
+    ]
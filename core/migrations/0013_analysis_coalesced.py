@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 03:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_analysis_rate_limits'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='openaianalysis',
+            name='coalesced',
+            field=models.BooleanField(default=False, help_text='Resultado compartido con un análisis idéntico en curso (single-flight), sin llamar a la API'),
+        ),
+    ]
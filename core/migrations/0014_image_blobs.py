@@ -0,0 +1,40 @@
+# Generated by Django 5.2.4 on 2026-10-17 03:15
+
+import core.storage
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_analysis_coalesced'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(help_text='SHA-256 del contenido', max_length=64, unique=True)),
+                ('name', models.CharField(help_text='Ruta en el almacenamiento, derivada del hash', max_length=255)),
+                ('size', models.PositiveIntegerField(help_text='Tamaño del archivo en bytes')),
+                ('ref_count', models.PositiveIntegerField(default=0, help_text='FoodImage que apuntan a este archivo; con 0 se borra')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Archivo de Imagen',
+                'verbose_name_plural': 'Archivos de Imagen',
+            },
+        ),
+        migrations.AlterField(
+            model_name='foodimage',
+            name='image',
+            field=models.ImageField(storage=core.storage.food_image_storage, upload_to='food_images/%Y/%m/%d/'),
+        ),
+        migrations.AddField(
+            model_name='foodimage',
+            name='blob',
+            field=models.ForeignKey(blank=True, help_text='Archivo compartido; vacío en imágenes anteriores sin deduplicar (dedupe_food_images)', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='images', to='core.imageblob'),
+        ),
+    ]
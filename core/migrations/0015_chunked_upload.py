@@ -0,0 +1,34 @@
+# Generated by Django 5.2.4 on 2026-10-17 03:21
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_image_blobs'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChunkedUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('file_name', models.CharField(max_length=255)),
+                ('length', models.PositiveIntegerField(help_text='Tamaño total anunciado por el cliente (Upload-Length)')),
+                ('offset', models.PositiveIntegerField(default=0, help_text='Bytes recibidos (Upload-Offset)')),
+                ('expires_at', models.DateTimeField(db_index=True, help_text='Se amplía con cada parte recibida')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunked_uploads', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Subida por Partes',
+                'verbose_name_plural': 'Subidas por Partes',
+            },
+        ),
+    ]
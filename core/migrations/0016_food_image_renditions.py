@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-17 03:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_chunked_upload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FoodImageRendition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('thumb', 'Miniatura'), ('medium', 'Mediana'), ('analysis', 'Tamaño de análisis')], max_length=20)),
+                ('format', models.CharField(choices=[('webp', 'WebP'), ('jpeg', 'JPEG')], max_length=10)),
+                ('name', models.CharField(help_text='Ruta en el almacenamiento, junto a la imagen original', max_length=255)),
+                ('width', models.PositiveIntegerField()),
+                ('height', models.PositiveIntegerField()),
+                ('size', models.PositiveIntegerField(help_text='Tamaño del archivo en bytes')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='renditions', to='core.foodimage')),
+            ],
+            options={
+                'verbose_name': 'Versión de Imagen',
+                'verbose_name_plural': 'Versiones de Imágenes',
+                'unique_together': {('image', 'kind', 'format')},
+            },
+        ),
+    ]
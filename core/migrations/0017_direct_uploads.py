@@ -0,0 +1,34 @@
+# Generated by Django 5.2.4 on 2026-10-17 03:30
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_food_image_renditions'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirectUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('name', models.CharField(help_text='Ruta provisional en el almacenamiento (direct_uploads/)', max_length=255)),
+                ('file_name', models.CharField(max_length=255)),
+                ('content_type', models.CharField(max_length=100)),
+                ('size', models.PositiveIntegerField(help_text='Tamaño anunciado por el cliente; el POST prefirmado no admite más')),
+                ('expires_at', models.DateTimeField(db_index=True, help_text='Pasada esta fecha se borra si no se ha confirmado')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='direct_uploads', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Subida Directa',
+                'verbose_name_plural': 'Subidas Directas',
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.4 on 2026-10-17 03:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_direct_uploads'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='foodimage',
+            name='primary_image',
+            field=models.ForeignKey(blank=True, help_text='En comidas con varias fotos, la foto que se asocia a la MealRecord', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='extra_images', to='core.foodimage'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.4 on 2026-10-17 03:44
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_food_image_primary_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageblob',
+            name='acquired_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, help_text='Última referencia tomada (la FoodImage se inserta después)'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.4 on 2026-10-17 04:10
+
+from django.db import migrations
+
+
+def reset_legacy_renditions(apps, schema_editor):
+    # Las versiones de las fotos anteriores a los blobs se nombraban sin la extensión de la
+    # original: x.jpg y x.png podían compartir archivos. Se regeneran al pedirlas con el nombre
+    # nuevo y collect_media_garbage borra los archivos antiguos.
+    FoodImageRendition = apps.get_model('core', 'FoodImageRendition')
+    FoodImageRendition.objects.filter(image__blob__isnull=True).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_image_blob_acquired_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(reset_legacy_renditions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,111 @@
+import logging
+from typing import Dict, List, Optional
+
+from django.conf import settings
+
+from .analysis_metrics import estimate_image_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class ModelTier:
+    """Nivel de la política de enrutado: modelo, detalle de imagen y prompt"""
+
+    def __init__(self, name: str, model: str, detail: str = 'auto', compact_prompt: bool = False):
+        self.name = name
+        self.model = model
+        self.detail = detail
+        self.compact_prompt = compact_prompt
+
+    def __repr__(self):
+        return f"ModelTier({self.name}: {self.model}, detail={self.detail})"
+
+
+def get_model_tiers() -> List[ModelTier]:
+    """
+    Niveles configurados en ANALYSIS_MODEL_TIERS, del más barato al más completo.
+    Sin ANALYSIS_ROUTING_ENABLED solo se usa el último (el modelo completo).
+    """
+    tiers = [ModelTier(**tier) for tier in settings.ANALYSIS_MODEL_TIERS]
+    return tiers if settings.ANALYSIS_ROUTING_ENABLED else tiers[-1:]
+
+
+def full_tier() -> ModelTier:
+    return ModelTier(**settings.ANALYSIS_MODEL_TIERS[-1])
+
+
+def get_tier(name: str) -> Optional[ModelTier]:
+    for tier in settings.ANALYSIS_MODEL_TIERS:
+        if tier['name'] == name:
+            return ModelTier(**tier)
+    return None
+
+
+def escalation_reason(analysis_data: Optional[Dict]) -> Optional[str]:
+    """Motivo para pasar al siguiente nivel, o None si el resultado es aceptable"""
+    if analysis_data is None:
+        return 'invalid'
+    if not analysis_data.get('foods'):
+        return 'empty'
+    if analysis_data.get('truncated'):
+        return 'truncated'
+    if analysis_data.get('analysis_confidence', 0) < settings.ANALYSIS_ESCALATION_CONFIDENCE:
+        return 'low_confidence'
+    return None
+
+
+class TierRouter:
+    """
+    Recorre los niveles de modelo de un análisis: pasa al siguiente solo si el resultado
+    del actual no es aceptable (escalation_reason) y queda presupuesto para otra llamada.
+    Si un nivel falla se pasa al siguiente mientras quede presupuesto; si falla uno superior
+    se conserva el resultado válido del anterior.
+    """
+
+    def __init__(self, tiers: List[ModelTier], deadline, metrics):
+        self.tiers = tiers
+        self.deadline = deadline
+        self.metrics = metrics
+        self.result: Optional[Dict] = None
+        self._reason: Optional[str] = None
+        self._stopped = False
+        self._image_tokens = 0
+
+    def __iter__(self):
+        for position, tier in enumerate(self.tiers):
+            if position > 0:
+                if self._stopped or self._reason is None:
+                    return
+                if self.deadline.remaining() < settings.ANALYSIS_FALLBACK_MIN_SECONDS:
+                    logger.info(f"Sin presupuesto para escalar desde el nivel '{self.tiers[position - 1].name}'")
+                    return
+                logger.info(f"Análisis escalado desde el nivel '{self.tiers[position - 1].name}' ({self._reason})")
+                self.metrics.escalated = True
+            yield tier
+
+    def record(self, tier: ModelTier, analysis_data: Optional[Dict]):
+        """Registra el resultado de un nivel; los niveles superiores sustituyen a los anteriores"""
+        self._count_image_tokens(tier)
+        if analysis_data is not None:
+            self.result = analysis_data
+            self.metrics.routing_tier = tier.name
+        self._reason = escalation_reason(analysis_data)
+
+    def failed(self, tier: ModelTier, error: Exception):
+        """
+        Un nivel falló tras sus reintentos. Sin resultado válido se escala al siguiente nivel
+        si lo hay y queda presupuesto; si no, se propaga el error.
+        """
+        self._count_image_tokens(tier)
+        if self.result is None:
+            if tier is self.tiers[-1] or self.deadline.remaining() < settings.ANALYSIS_FALLBACK_MIN_SECONDS:
+                raise error
+            logger.warning(f"Falló el nivel '{tier.name}' sin resultado, se escala: {error}")
+            self._reason = 'error'
+            return
+        logger.warning(f"Falló el nivel '{tier.name}', se usa el resultado de '{self.metrics.routing_tier}': {error}")
+        self._stopped = True
+
+    def _count_image_tokens(self, tier: ModelTier):
+        self._image_tokens += estimate_image_tokens(*self.metrics.image_size, detail=tier.detail)
+        self.metrics.image_tokens = self._image_tokens
@@ -1,13 +1,24 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 
+from .storage import food_image_storage
+
 
 class UserProfile(models.Model):
     """Modelo para el perfil extendido del usuario"""
+    ANALYSIS_TIERS = [
+        ('free', 'Gratuito'),
+        ('premium', 'Premium'),
+        ('unlimited', 'Sin límite'),
+    ]
+
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     daily_calorie_goal = models.IntegerField(default=1000, help_text="Objetivo de calorías diarias")
     notifications_enabled = models.BooleanField(default=True)
+    analysis_tier = models.CharField(max_length=20, choices=ANALYSIS_TIERS, default='free', help_text="Cuota de análisis de imágenes (ANALYSIS_RATE_LIMIT_TIERS)")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -35,6 +46,23 @@ class FoodCategory(models.Model):
         verbose_name_plural = "Categorías de Alimentos"
 
 
+class FoodCategoryKeyword(models.Model):
+    """Palabras clave para categorizar automáticamente los alimentos analizados"""
+    category = models.ForeignKey(FoodCategory, on_delete=models.CASCADE, related_name='keywords')
+    keyword = models.CharField(max_length=100, help_text="Se compara sin acentos ni mayúsculas al inicio de una palabra")
+    priority = models.PositiveSmallIntegerField(default=100, help_text="Si coinciden varias categorías gana la de menor prioridad")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.keyword} → {self.category.name}"
+
+    class Meta:
+        verbose_name = "Palabra Clave de Categoría"
+        verbose_name_plural = "Palabras Clave de Categorías"
+        unique_together = ['category', 'keyword']
+        ordering = ['priority', 'keyword']
+
+
 class DrinkCategory(models.Model):
     """Categorías de bebidas"""
     name = models.CharField(max_length=100, unique=True)
@@ -90,13 +118,34 @@ class Drink(models.Model):
         unique_together = ['name', 'category']
 
 
+class ImageBlob(models.Model):
+    """Archivo de imagen compartido por todas las FoodImage con el mismo contenido (ver core/image_blobs.py)"""
+    content_hash = models.CharField(max_length=64, unique=True, help_text="SHA-256 del contenido")
+    name = models.CharField(max_length=255, help_text="Ruta en el almacenamiento, derivada del hash")
+    size = models.PositiveIntegerField(help_text="Tamaño del archivo en bytes")
+    ref_count = models.PositiveIntegerField(default=0, help_text="FoodImage que apuntan a este archivo; con 0 se borra")
+    acquired_at = models.DateTimeField(default=timezone.now, help_text="Última referencia tomada (la FoodImage se inserta después)")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} referencias)"
+
+    class Meta:
+        verbose_name = "Archivo de Imagen"
+        verbose_name_plural = "Archivos de Imagen"
+
+
 class FoodImage(models.Model):
     """Modelo para almacenar imágenes de comidas"""
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='food_images')
-    image = models.ImageField(upload_to='food_images/%Y/%m/%d/')
+    # Las subidas nuevas se guardan con el nombre del blob; upload_to solo queda para las anteriores
+    image = models.ImageField(upload_to='food_images/%Y/%m/%d/', storage=food_image_storage)
+    blob = models.ForeignKey(ImageBlob, null=True, blank=True, on_delete=models.PROTECT, related_name='images', help_text="Archivo compartido; vacío en imágenes anteriores sin deduplicar (dedupe_food_images)")
     original_name = models.CharField(max_length=255)
     file_size = models.IntegerField(help_text="Tamaño del archivo en bytes")
     mime_type = models.CharField(max_length=100)
+    perceptual_hash = models.CharField(max_length=16, blank=True, db_index=True, help_text="dHash de 64 bits en hexadecimal para detectar comidas repetidas")
+    primary_image = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='extra_images', help_text="En comidas con varias fotos, la foto que se asocia a la MealRecord")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -108,6 +157,36 @@ class FoodImage(models.Model):
         verbose_name_plural = "Imágenes de Comidas"
 
 
+class FoodImageRendition(models.Model):
+    """Versión reducida de una FoodImage guardada junto a la original (ver core/renditions.py)"""
+    KIND_CHOICES = [
+        ('thumb', 'Miniatura'),
+        ('medium', 'Mediana'),
+        ('analysis', 'Tamaño de análisis'),
+    ]
+    FORMAT_CHOICES = [
+        ('webp', 'WebP'),
+        ('jpeg', 'JPEG'),
+    ]
+
+    image = models.ForeignKey(FoodImage, on_delete=models.CASCADE, related_name='renditions')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    format = models.CharField(max_length=10, choices=FORMAT_CHOICES)
+    name = models.CharField(max_length=255, help_text="Ruta en el almacenamiento, junto a la imagen original")
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    size = models.PositiveIntegerField(help_text="Tamaño del archivo en bytes")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.width}x{self.height})"
+
+    class Meta:
+        verbose_name = "Versión de Imagen"
+        verbose_name_plural = "Versiones de Imágenes"
+        unique_together = ['image', 'kind', 'format']
+
+
 class OpenAIAnalysis(models.Model):
     """Modelo para almacenar análisis de OpenAI"""
     image = models.OneToOneField(FoodImage, on_delete=models.CASCADE, related_name='analysis')
@@ -116,6 +195,24 @@ class OpenAIAnalysis(models.Model):
     identified_foods = models.JSONField(default=dict, help_text="Alimentos identificados en formato JSON")
     calculated_calories = models.DecimalField(max_digits=8, decimal_places=2)
     confidence_score = models.DecimalField(max_digits=3, decimal_places=2, help_text="Puntuación de confianza (0-1)")
+    # Métricas de la llamada
+    model_used = models.CharField(max_length=50, blank=True)
+    prompt_tokens = models.PositiveIntegerField(default=0)
+    completion_tokens = models.PositiveIntegerField(default=0)
+    image_tokens = models.PositiveIntegerField(default=0, help_text="Estimado a partir del tamaño de la imagen enviada")
+    payload_bytes = models.PositiveIntegerField(default=0, help_text="Tamaño de la imagen en base64 enviada a la API")
+    retry_count = models.PositiveSmallIntegerField(default=0, help_text="Peticiones a la API además de la primera")
+    fallback_used = models.BooleanField(default=False, help_text="Se usó el reintento sin tools (JSON)")
+    json_repaired = models.BooleanField(default=False, help_text="El JSON mal formado se reparó localmente, sin reintento")
+    routing_tier = models.CharField(max_length=20, blank=True, help_text="Nivel de modelo cuyo resultado se guardó (p. ej. fast, full)")
+    escalated = models.BooleanField(default=False, help_text="El primer nivel no bastó y se escaló a un modelo más completo")
+    tier_latencies = models.JSONField(default=dict, blank=True, help_text="Milisegundos de la llamada de cada nivel de modelo intentado")
+    cache_hit = models.BooleanField(default=False)
+    coalesced = models.BooleanField(default=False, help_text="Resultado compartido con un análisis idéntico en curso (single-flight), sin llamar a la API")
+    total_latency_ms = models.FloatField(null=True, blank=True)
+    stage_timings = models.JSONField(default=dict, blank=True, help_text="Milisegundos por etapa: read, cache, screen, encode, api, parse, db")
+    screening_warnings = models.JSONField(default=list, blank=True, help_text="Avisos del cribado local de la imagen (p. ej. foto algo borrosa)")
+    repeated_from = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='repeats', help_text="Análisis copiado de una comida anterior parecida, sin llamar a la API")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -127,6 +224,38 @@ class OpenAIAnalysis(models.Model):
         verbose_name_plural = "Análisis de OpenAI"
 
 
+class AnalysisCacheEntry(models.Model):
+    """Caché persistente de análisis indexada por el contenido de la imagen"""
+    content_hash = models.CharField(max_length=64, help_text="SHA-256 de los bytes de la imagen")
+    prompt_version = models.CharField(max_length=32, help_text="Versión del prompt y del esquema de la herramienta")
+    payload = models.JSONField(default=dict, help_text="Análisis devuelto por OpenAI")
+    hit_count = models.IntegerField(default=0)
+    last_used_at = models.DateTimeField(default=timezone.now, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Caché {self.content_hash[:12]} ({self.prompt_version})"
+
+    class Meta:
+        verbose_name = "Entrada de Caché de Análisis"
+        verbose_name_plural = "Entradas de Caché de Análisis"
+        unique_together = ['content_hash', 'prompt_version']
+
+
+class RateLimitBucket(models.Model):
+    """Token bucket compartido entre workers para las cuotas de análisis (ver core/rate_limits.py)"""
+    key = models.CharField(max_length=100, unique=True, help_text="p. ej. analysis:user:42 o analysis:global")
+    tokens = models.FloatField(help_text="Tokens disponibles en updated_at")
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.key}: {self.tokens:.1f}"
+
+    class Meta:
+        verbose_name = "Cuota de Análisis"
+        verbose_name_plural = "Cuotas de Análisis"
+
+
 class MealRecord(models.Model):
     """Modelo para registrar comidas"""
     MEAL_TYPES = [
@@ -155,6 +284,85 @@ class MealRecord(models.Model):
         ordering = ['-date', '-time']
 
 
+class AnalysisJob(models.Model):
+    """Trabajo de análisis de imagen procesado en segundo plano por los workers"""
+    STATUS_CHOICES = [
+        ('pending', 'Pendiente'),
+        ('running', 'En proceso'),
+        ('completed', 'Completado'),
+        ('failed', 'Fallido'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='analysis_jobs')
+    image = models.ForeignKey(FoodImage, on_delete=models.CASCADE, related_name='analysis_jobs')
+    meal = models.ForeignKey(MealRecord, on_delete=models.SET_NULL, null=True, blank=True, related_name='analysis_jobs')
+    analysis = models.ForeignKey(OpenAIAnalysis, on_delete=models.SET_NULL, null=True, blank=True, related_name='jobs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    result = models.JSONField(default=dict, blank=True, help_text="Resultado procesado para el cliente")
+    error = models.TextField(blank=True)
+    attempts = models.IntegerField(default=0)
+    worker_id = models.CharField(max_length=100, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def is_finished(self):
+        return self.status in ('completed', 'failed')
+
+    def __str__(self):
+        return f"Trabajo {self.id} - {self.get_status_display()}"
+
+    class Meta:
+        verbose_name = "Trabajo de Análisis"
+        verbose_name_plural = "Trabajos de Análisis"
+        ordering = ['created_at']
+        indexes = [models.Index(fields=['status', 'created_at'])]
+
+
+class ChunkedUpload(models.Model):
+    """Subida de imagen por partes (estilo tus) en curso; los bytes recibidos están en CHUNKED_UPLOAD_DIR"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chunked_uploads')
+    file_name = models.CharField(max_length=255)
+    length = models.PositiveIntegerField(help_text="Tamaño total anunciado por el cliente (Upload-Length)")
+    offset = models.PositiveIntegerField(default=0, help_text="Bytes recibidos (Upload-Offset)")
+    expires_at = models.DateTimeField(db_index=True, help_text="Se amplía con cada parte recibida")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def is_complete(self):
+        return self.offset >= self.length
+
+    def __str__(self):
+        return f"Subida {self.id} de {self.user.username} ({self.offset}/{self.length} bytes)"
+
+    class Meta:
+        verbose_name = "Subida por Partes"
+        verbose_name_plural = "Subidas por Partes"
+
+
+class DirectUpload(models.Model):
+    """Subida directa al almacenamiento con un POST prefirmado, pendiente de que el cliente la confirme"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='direct_uploads')
+    name = models.CharField(max_length=255, help_text="Ruta provisional en el almacenamiento (direct_uploads/)")
+    file_name = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100)
+    size = models.PositiveIntegerField(help_text="Tamaño anunciado por el cliente; el POST prefirmado no admite más")
+    expires_at = models.DateTimeField(db_index=True, help_text="Pasada esta fecha se borra si no se ha confirmado")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Subida directa {self.id} de {self.user.username} ({self.size} bytes)"
+
+    class Meta:
+        verbose_name = "Subida Directa"
+        verbose_name_plural = "Subidas Directas"
+
+
 class DrinkRecord(models.Model):
     """Modelo para registrar bebidas"""
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='drink_records')
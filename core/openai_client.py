@@ -0,0 +1,147 @@
+import asyncio
+import importlib.util
+import logging
+import os
+import threading
+import weakref
+from typing import Dict, Optional
+
+import httpx
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from openai import AsyncOpenAI, OpenAI
+
+from .openai_transport import TRANSPORT_MODES, AsyncCassetteClient, CassetteClient
+
+logger = logging.getLogger(__name__)
+
+# Un único cliente por proceso: se comparte entre peticiones e hilos
+_client_lock = threading.Lock()
+_client: Optional[OpenAI] = None
+_http_client: Optional[httpx.Client] = None
+_client_pid: Optional[int] = None
+_request_count = 0
+
+# Clientes asíncronos: uno por event loop (httpx.AsyncClient queda ligado a su loop)
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOpenAI]" = weakref.WeakKeyDictionary()
+
+
+def _http2_enabled() -> bool:
+    """HTTP/2 solo si está habilitado y el paquete h2 está instalado"""
+    return settings.OPENAI_HTTP2 and importlib.util.find_spec('h2') is not None
+
+
+def _count_request(request: httpx.Request):
+    global _request_count
+    _request_count += 1
+
+
+async def _acount_request(request: httpx.Request):
+    _count_request(request)
+
+
+def _pool_options() -> Dict:
+    """Límites y timeouts comunes a los clientes síncrono y asíncrono"""
+    return {
+        'limits': httpx.Limits(
+            max_connections=settings.OPENAI_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.OPENAI_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=settings.OPENAI_POOL_KEEPALIVE_EXPIRY,
+        ),
+        'timeout': httpx.Timeout(settings.OPENAI_READ_TIMEOUT, connect=settings.OPENAI_CONNECT_TIMEOUT),
+        'http2': _http2_enabled(),
+    }
+
+
+def _build_http_client() -> httpx.Client:
+    """Crea el cliente httpx con pool de conexiones keep-alive"""
+    return httpx.Client(event_hooks={'request': [_count_request]}, **_pool_options())
+
+
+def _transport_mode() -> str:
+    mode = settings.OPENAI_TRANSPORT_MODE
+    if mode not in TRANSPORT_MODES:
+        raise ImproperlyConfigured(f"OPENAI_TRANSPORT_MODE debe ser uno de {TRANSPORT_MODES}, no '{mode}'")
+    return mode
+
+
+def get_openai_client() -> OpenAI:
+    """
+    Retorna el cliente de OpenAI del proceso, creándolo en el primer uso.
+    Si el proceso se bifurcó (gunicorn --preload) se crea uno nuevo, ya que
+    las conexiones abiertas no pueden compartirse entre procesos.
+    """
+    global _client, _http_client, _client_pid
+
+    mode = _transport_mode()
+    if mode in ('replay', 'synthetic'):
+        return CassetteClient(mode)
+
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return CassetteClient(mode, _client) if mode == 'record' else _client
+
+    with _client_lock:
+        if _client is None or _client_pid != pid:
+            _http_client = _build_http_client()
+            _client = OpenAI(
+                api_key=settings.OPENAI_API_KEY,
+                http_client=_http_client,
+                max_retries=settings.OPENAI_MAX_RETRIES,
+            )
+            _client_pid = pid
+            logger.info(
+                "Cliente OpenAI creado para el proceso %s (http2=%s, max_connections=%s)",
+                pid, _http2_enabled(), settings.OPENAI_POOL_MAX_CONNECTIONS
+            )
+    return CassetteClient(mode, _client) if mode == 'record' else _client
+
+
+def get_async_openai_client() -> AsyncOpenAI:
+    """
+    Retorna el cliente AsyncOpenAI del event loop actual.
+    Con uvicorn hay un loop por worker, así que en la práctica es uno por proceso.
+    """
+    mode = _transport_mode()
+    if mode in ('replay', 'synthetic'):
+        return AsyncCassetteClient(mode)
+
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = AsyncOpenAI(
+            api_key=settings.OPENAI_API_KEY,
+            http_client=httpx.AsyncClient(event_hooks={'request': [_acount_request]}, **_pool_options()),
+            max_retries=settings.OPENAI_MAX_RETRIES,
+        )
+        _async_clients[loop] = client
+        logger.info("Cliente AsyncOpenAI creado para el proceso %s", os.getpid())
+    return AsyncCassetteClient(mode, client) if mode == 'record' else client
+
+
+def get_pool_stats() -> Dict:
+    """Estadísticas del pool de conexiones del proceso actual"""
+    stats = {
+        'pid': os.getpid(),
+        'initialized': _client is not None and _client_pid == os.getpid(),
+        'http2': _http2_enabled(),
+        'max_connections': settings.OPENAI_POOL_MAX_CONNECTIONS,
+        'max_keepalive_connections': settings.OPENAI_POOL_MAX_KEEPALIVE,
+        'requests': _request_count,
+        'async_clients': len(_async_clients),
+        'connections': 0,
+        'idle': 0,
+        'active': 0,
+    }
+    if not stats['initialized']:
+        return stats
+
+    try:
+        # httpx no expone el pool públicamente; se consulta el pool de httpcore
+        connections = list(_http_client._transport._pool.connections)
+        stats['connections'] = len(connections)
+        stats['idle'] = sum(1 for connection in connections if connection.is_idle())
+        stats['active'] = stats['connections'] - stats['idle']
+    except Exception as e:
+        logger.debug("No se pudieron leer las conexiones del pool: %s", e)
+    return stats
@@ -0,0 +1,348 @@
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+import random
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Dict, List
+
+from django.conf import settings
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+logger = logging.getLogger(__name__)
+
+TRANSPORT_MODES = ('live', 'record', 'replay', 'synthetic')
+
+# Parámetros que no cambian el contenido de la respuesta (una grabación sirve con y sin stream)
+STREAM_PARAMETERS = ('stream', 'stream_options')
+
+# Caracteres por fragmento al simular una respuesta en streaming
+STREAM_CHUNK_SIZE = 24
+
+# Alimentos para respuestas sintéticas: (nombre, kcal por 100 g, gramos mínimos, gramos máximos)
+SYNTHETIC_FOODS = [
+    ('arroz blanco', 130, 80, 250),
+    ('pechuga de pollo a la plancha', 165, 90, 220),
+    ('ensalada de lechuga y tomate', 20, 50, 200),
+    ('frijoles negros', 132, 80, 200),
+    ('pan integral', 247, 30, 90),
+    ('huevo frito', 196, 50, 120),
+    ('plátano', 89, 90, 150),
+    ('salmón al horno', 208, 100, 200),
+    ('pasta con tomate', 150, 120, 300),
+    ('yogur natural', 61, 100, 200),
+]
+
+
+class CassetteNotFound(LookupError):
+    """No hay grabación para la petición en modo replay"""
+
+
+def _strip_images(value):
+    """Sustituye los data URL de imagen por su hash para que la clave no dependa del base64"""
+    if isinstance(value, dict):
+        return {key: _strip_images(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_strip_images(item) for item in value]
+    if isinstance(value, str) and value.startswith('data:image/'):
+        return 'sha256:' + hashlib.sha256(value.encode('utf-8')).hexdigest()
+    return value
+
+
+def cassette_key(request_kwargs: Dict) -> str:
+    """Clave determinista de una petición (modelo, mensajes, herramientas, formato)"""
+    sanitized = _strip_images(copy.deepcopy(
+        {key: value for key, value in request_kwargs.items() if key not in STREAM_PARAMETERS}
+    ))
+    serialized = json.dumps(sanitized, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()[:24]
+
+
+def synthetic_completion(request_kwargs: Dict) -> ChatCompletion:
+    """Genera una respuesta válida y determinista (misma petición -> misma respuesta)"""
+    key = cassette_key(request_kwargs)
+    rng = random.Random(f"{settings.OPENAI_SYNTHETIC_SEED}:{key}")
+
+    foods = []
+    for name, kcal, min_grams, max_grams in rng.sample(SYNTHETIC_FOODS, rng.randint(1, 4)):
+        foods.append({
+            'name': name,
+            'estimated_grams': rng.randint(min_grams, max_grams),
+            'calories_per_100g': kcal,
+            'confidence': round(rng.uniform(0.55, 0.98), 2),
+        })
+    analysis = {
+        'foods': foods,
+        'total_calories': round(sum(food['estimated_grams'] * food['calories_per_100g'] / 100 for food in foods), 2),
+        'analysis_confidence': round(min(food['confidence'] for food in foods), 2),
+        'notes': 'Respuesta sintética',
+    }
+    arguments = json.dumps(analysis, ensure_ascii=False)
+
+    if request_kwargs.get('tools'):
+        message = {
+            'role': 'assistant',
+            'content': None,
+            'tool_calls': [{
+                'id': f'call_{key[:12]}',
+                'type': 'function',
+                'function': {'name': 'return_food_analysis', 'arguments': arguments},
+            }],
+        }
+        finish_reason = 'tool_calls'
+    else:
+        message = {'role': 'assistant', 'content': arguments}
+        finish_reason = 'stop'
+
+    completion_tokens = len(arguments) // 4
+    prompt_tokens = 1100 + rng.randint(0, 200)
+    return ChatCompletion.model_validate({
+        'id': f'chatcmpl-synthetic-{key}',
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': request_kwargs.get('model', 'gpt-5'),
+        'choices': [{'index': 0, 'finish_reason': finish_reason, 'message': message}],
+        'usage': {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+        },
+    })
+
+
+def completion_to_chunks(completion: ChatCompletion) -> List[ChatCompletionChunk]:
+    """Divide una respuesta completa en los fragmentos que enviaría la API con stream=True"""
+    base = {
+        'id': completion.id,
+        'object': 'chat.completion.chunk',
+        'created': completion.created,
+        'model': completion.model,
+    }
+    choice = completion.choices[0]
+    message = choice.message
+
+    if message.tool_calls:
+        tool_call = message.tool_calls[0]
+        arguments = tool_call.function.arguments
+        deltas = [{
+            'role': 'assistant',
+            'tool_calls': [{
+                'index': 0,
+                'id': tool_call.id,
+                'type': 'function',
+                'function': {'name': tool_call.function.name, 'arguments': ''},
+            }],
+        }]
+        deltas += [
+            {'tool_calls': [{'index': 0, 'function': {'arguments': arguments[start:start + STREAM_CHUNK_SIZE]}}]}
+            for start in range(0, len(arguments), STREAM_CHUNK_SIZE)
+        ]
+    else:
+        content = message.content or ''
+        deltas = [{'role': 'assistant', 'content': ''}]
+        deltas += [
+            {'content': content[start:start + STREAM_CHUNK_SIZE]}
+            for start in range(0, len(content), STREAM_CHUNK_SIZE)
+        ]
+
+    chunks = [
+        ChatCompletionChunk.model_validate({**base, 'choices': [{'index': 0, 'delta': delta, 'finish_reason': None}]})
+        for delta in deltas
+    ]
+    chunks.append(ChatCompletionChunk.model_validate(
+        {**base, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': choice.finish_reason}]}
+    ))
+    if completion.usage is not None:
+        chunks.append(ChatCompletionChunk.model_validate(
+            {**base, 'choices': [], 'usage': completion.usage.model_dump()}
+        ))
+    return chunks
+
+
+def chunks_to_completion(chunks: List[ChatCompletionChunk]) -> ChatCompletion:
+    """Reconstruye la respuesta completa a partir de los fragmentos de un stream (para grabarla)"""
+    content = ''
+    arguments = ''
+    tool_call_id = None
+    function_name = None
+    finish_reason = 'stop'
+    usage = None
+
+    for chunk in chunks:
+        if chunk.usage is not None:
+            usage = chunk.usage.model_dump()
+        if not chunk.choices:
+            continue
+        choice = chunk.choices[0]
+        finish_reason = choice.finish_reason or finish_reason
+        content += choice.delta.content or ''
+        for tool_call in choice.delta.tool_calls or []:
+            tool_call_id = tool_call.id or tool_call_id
+            if tool_call.function is not None:
+                function_name = tool_call.function.name or function_name
+                arguments += tool_call.function.arguments or ''
+
+    message = {'role': 'assistant', 'content': content or None}
+    if function_name:
+        message['tool_calls'] = [{
+            'id': tool_call_id or 'call_0',
+            'type': 'function',
+            'function': {'name': function_name, 'arguments': arguments},
+        }]
+    first = chunks[0]
+    return ChatCompletion.model_validate({
+        'id': first.id,
+        'object': 'chat.completion',
+        'created': first.created,
+        'model': first.model,
+        'choices': [{'index': 0, 'finish_reason': finish_reason, 'message': message}],
+        'usage': usage,
+    })
+
+
+class _ChunkStream:
+    """Stream simulado: reparte la latencia de la respuesta entre sus fragmentos"""
+
+    def __init__(self, chunks: List[ChatCompletionChunk], delay: float):
+        self.chunks = chunks
+        self.delay = delay / max(1, len(chunks))
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            if self.delay:
+                time.sleep(self.delay)
+            yield chunk
+
+    def close(self):
+        pass
+
+
+class _AsyncChunkStream(_ChunkStream):
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            yield chunk
+
+    async def close(self):
+        pass
+
+
+class _Cassette:
+    """Lectura y escritura de grabaciones en OPENAI_CASSETTE_DIR"""
+
+    def __init__(self):
+        self.directory = Path(settings.OPENAI_CASSETTE_DIR)
+
+    def path_for(self, key: str) -> Path:
+        return self.directory / f'{key}.json'
+
+    def save(self, key: str, request_kwargs: Dict, response: ChatCompletion, latency: float):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        record = {
+            'request': _strip_images(copy.deepcopy(request_kwargs)),
+            'response': response.model_dump(mode='json'),
+            'latency_ms': round(latency * 1000, 1),
+        }
+        self.path_for(key).write_text(json.dumps(record, ensure_ascii=False, indent=2), encoding='utf-8')
+        logger.debug("Grabación guardada: %s", key)
+
+    def load(self, key: str) -> ChatCompletion:
+        path = self.path_for(key)
+        if not path.exists():
+            raise CassetteNotFound(f'No hay grabación para la petición {key} en {self.directory}')
+        record = json.loads(path.read_text(encoding='utf-8'))
+        return ChatCompletion.model_validate(record['response'])
+
+
+def _replay_delay() -> float:
+    return max(0.0, settings.OPENAI_REPLAY_LATENCY + random.uniform(0, settings.OPENAI_REPLAY_LATENCY_JITTER))
+
+
+class CassetteClient:
+    """
+    Sustituto del cliente OpenAI para medir y probar el análisis sin red ni coste.
+    Expone la interfaz usada por OpenAIService: chat.completions.create(), with_options() y models.list().
+    - record: llama a la API real y guarda cada par petición/respuesta en disco
+    - replay: sirve las respuestas grabadas de forma determinista, con latencia configurable
+    - synthetic: genera respuestas válidas de 'return_food_analysis' sin grabaciones previas
+    """
+
+    def __init__(self, mode: str, inner=None):
+        self.mode = mode
+        self.inner = inner
+        self.cassette = _Cassette()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+        self.models = SimpleNamespace(list=self._list_models)
+
+    def with_options(self, **options):
+        if self.mode == 'record':
+            return CassetteClient(self.mode, self.inner.with_options(**options))
+        return self
+
+    def _list_models(self):
+        if self.mode == 'record':
+            return self.inner.models.list()
+        return SimpleNamespace(data=[SimpleNamespace(id='gpt-5')])
+
+    def _create(self, **request_kwargs) -> ChatCompletion:
+        key = cassette_key(request_kwargs)
+        stream = request_kwargs.get('stream', False)
+        if self.mode == 'record':
+            started = time.monotonic()
+            response = self.inner.chat.completions.create(**request_kwargs)
+            if stream:
+                # Se consume el stream completo para grabarlo y se devuelve re-fragmentado
+                chunks = list(response)
+                response = chunks_to_completion(chunks)
+                self.cassette.save(key, request_kwargs, response, time.monotonic() - started)
+                return _ChunkStream(chunks, 0.0)
+            self.cassette.save(key, request_kwargs, response, time.monotonic() - started)
+            return response
+
+        response = synthetic_completion(request_kwargs) if self.mode == 'synthetic' else self.cassette.load(key)
+        if stream:
+            return _ChunkStream(completion_to_chunks(response), _replay_delay())
+        time.sleep(_replay_delay())
+        return response
+
+
+class AsyncCassetteClient(CassetteClient):
+    """Versión asíncrona de CassetteClient para AsyncOpenAIService"""
+
+    def with_options(self, **options):
+        if self.mode == 'record':
+            return AsyncCassetteClient(self.mode, self.inner.with_options(**options))
+        return self
+
+    async def _list_models(self):
+        if self.mode == 'record':
+            return await self.inner.models.list()
+        return SimpleNamespace(data=[SimpleNamespace(id='gpt-5')])
+
+    async def _create(self, **request_kwargs) -> ChatCompletion:
+        key = cassette_key(request_kwargs)
+        stream = request_kwargs.get('stream', False)
+        if self.mode == 'record':
+            started = time.monotonic()
+            response = await self.inner.chat.completions.create(**request_kwargs)
+            if stream:
+                chunks = [chunk async for chunk in response]
+                response = chunks_to_completion(chunks)
+                await asyncio.to_thread(self.cassette.save, key, request_kwargs, response, time.monotonic() - started)
+                return _AsyncChunkStream(chunks, 0.0)
+            await asyncio.to_thread(self.cassette.save, key, request_kwargs, response, time.monotonic() - started)
+            return response
+
+        if self.mode == 'synthetic':
+            response = synthetic_completion(request_kwargs)
+        else:
+            response = await asyncio.to_thread(self.cassette.load, key)
+        if stream:
+            return _AsyncChunkStream(completion_to_chunks(response), _replay_delay())
+        await asyncio.sleep(_replay_delay())
+        return response
@@ -0,0 +1,117 @@
+import logging
+import math
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import RateLimitBucket, UserProfile
+from .resilience import AnalysisRateLimited
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_KEY = 'analysis:global'
+
+
+class BucketPolicy:
+    """Token bucket: hasta `burst` análisis seguidos, recargando `per_hour` tokens por hora"""
+
+    def __init__(self, key: str, burst: int, per_hour: float):
+        self.key = key
+        self.burst = burst
+        self.rate = per_hour / 3600
+
+    def refill(self, bucket: RateLimitBucket, now) -> float:
+        elapsed = max(0.0, (now - bucket.updated_at).total_seconds())
+        return min(float(self.burst), bucket.tokens + elapsed * self.rate)
+
+
+class Quota:
+    """Estado de un bucket tras la petición, para las cabeceras X-RateLimit-*"""
+
+    def __init__(self, policy: BucketPolicy, tokens: float):
+        self.key = policy.key
+        self.limit = policy.burst
+        self.remaining = max(0, math.floor(tokens))
+        # Segundos hasta tener un token (si no queda ninguno) y hasta llenar el bucket
+        self.retry_after = math.ceil((1 - tokens) / policy.rate) if tokens < 1 and policy.rate else 0
+        self.reset = math.ceil((policy.burst - tokens) / policy.rate) if policy.rate else 0
+
+    def headers(self) -> Dict[str, str]:
+        return {
+            'X-RateLimit-Limit': str(self.limit),
+            'X-RateLimit-Remaining': str(self.remaining),
+            'X-RateLimit-Reset': str(self.reset),
+        }
+
+
+def analysis_policies(user) -> List[BucketPolicy]:
+    """Bucket del usuario según su nivel (si tiene cuota) y bucket global"""
+    policies = []
+    tier = UserProfile.objects.filter(user=user).values_list('analysis_tier', flat=True).first() or 'free'
+    limits = settings.ANALYSIS_RATE_LIMIT_TIERS.get(tier, settings.ANALYSIS_RATE_LIMIT_TIERS['free'])
+    if limits is not None:
+        policies.append(BucketPolicy(f'analysis:user:{user.pk}', limits['burst'], limits['per_hour']))
+    global_limits = settings.ANALYSIS_GLOBAL_RATE_LIMIT
+    policies.append(BucketPolicy(GLOBAL_KEY, global_limits['burst'], global_limits['per_hour']))
+    return policies
+
+
+def _locked_buckets(keys: List[str]) -> Dict[str, RateLimitBucket]:
+    queryset = RateLimitBucket.objects.select_for_update().filter(key__in=keys).order_by('key')
+    return {bucket.key: bucket for bucket in queryset}
+
+
+def consume(policies: List[BucketPolicy]) -> List[Quota]:
+    """
+    Gasta un token de todos los buckets o de ninguno. Las filas se bloquean con
+    select_for_update en orden de clave, así dos workers no gastan el mismo token ni se
+    bloquean mutuamente. Lanza AnalysisRateLimited si algún bucket está vacío.
+    """
+    now = timezone.now()
+    keys = sorted(policy.key for policy in policies)
+    with transaction.atomic():
+        # Escribir primero toma el bloqueo de escritura también en SQLite (sin select_for_update):
+        # si no, dos transacciones que leen y luego escriben fallan con "database is locked"
+        RateLimitBucket.objects.filter(key__in=keys).update(tokens=F('tokens'))
+        buckets = _locked_buckets(keys)
+        missing = [policy for policy in policies if policy.key not in buckets]
+        if missing:
+            RateLimitBucket.objects.bulk_create(
+                [RateLimitBucket(key=policy.key, tokens=policy.burst, updated_at=now) for policy in missing],
+                ignore_conflicts=True
+            )
+            buckets = _locked_buckets(keys)
+
+        available = {policy.key: policy.refill(buckets[policy.key], now) for policy in policies}
+        allowed = all(tokens >= 1 for tokens in available.values())
+        for key, bucket in buckets.items():
+            bucket.tokens = available[key] - 1 if allowed else available[key]
+            bucket.updated_at = now
+        RateLimitBucket.objects.bulk_update(buckets.values(), ['tokens', 'updated_at'])
+
+    quotas = [Quota(policy, buckets[policy.key].tokens) for policy in policies]
+    if not allowed:
+        if available.get(GLOBAL_KEY, 1) < 1:
+            logger.warning("Cuota global de análisis agotada")
+        error = AnalysisRateLimited(retry_after=max(quota.retry_after for quota in quotas) or None)
+        error.quota = quotas[0]
+        raise error
+    return quotas
+
+
+def check_analysis_quota(user) -> Optional[Quota]:
+    """
+    Gasta un análisis de la cuota del usuario y de la global. Retorna la cuota que se informa
+    en las cabeceras (la del usuario, o la global si no tiene límite), o None si está desactivado.
+    Si la BD falla se deja pasar la petición.
+    """
+    if not settings.ANALYSIS_RATE_LIMITS_ENABLED:
+        return None
+    try:
+        return consume(analysis_policies(user))[0]
+    except DatabaseError as e:
+        logger.warning(f"Cuotas de análisis sin BD: {e}")
+        return None
@@ -0,0 +1,212 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .image_processing import render_renditions
+from .models import FoodImage, FoodImageRendition
+
+logger = logging.getLogger(__name__)
+
+# Formato de la versión -> formato de Pillow y extensión del archivo
+RENDITION_FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+RENDITION_EXTENSIONS = {'webp': '.webp', 'jpeg': '.jpg'}
+
+Rendered = List[Tuple[str, str, bytes, int, int]]
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def rendition_sides() -> Dict[str, int]:
+    """Lado máximo de cada versión, de menor a mayor"""
+    return {
+        'thumb': settings.IMAGE_RENDITION_THUMB_SIDE,
+        'medium': settings.IMAGE_RENDITION_MEDIUM_SIDE,
+        'analysis': settings.ANALYSIS_IMAGE_MAX_SIDE,
+    }
+
+
+def rendition_name(source_name: str, kind: str, image_format: str) -> str:
+    """
+    Junto a la original: food_images/ab/cd/<sha256>_jpg_thumb.webp. La extensión de la original
+    forma parte del nombre: dos fotos antiguas x.jpg y x.png no comparten versiones.
+    """
+    stem, extension = os.path.splitext(source_name)
+    if extension:
+        stem = f'{stem}_{extension[1:].lower()}'
+    return f'{stem}_{kind}{RENDITION_EXTENSIONS[image_format]}'
+
+
+def rendition_names(source_name: str) -> List[str]:
+    return [
+        rendition_name(source_name, kind, image_format)
+        for kind in rendition_sides() for image_format in RENDITION_FORMATS
+    ]
+
+
+def _rendition_executor() -> Optional[ProcessPoolExecutor]:
+    """
+    Pool de procesos compartido por el proceso web, creado al primer uso. Se arranca con
+    'spawn' para no heredar los hilos ni las conexiones a la base de datos del worker.
+    """
+    global _executor
+    if settings.IMAGE_RENDITION_WORKERS <= 0:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.IMAGE_RENDITION_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _executor
+
+
+def _discard_executor(executor: ProcessPoolExecutor):
+    """Si un proceso del pool muere, el pool queda inutilizable: se crea otro en el siguiente uso"""
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False)
+
+
+def _render_args(image_bytes: bytes):
+    return image_bytes, rendition_sides(), RENDITION_FORMATS, settings.IMAGE_RENDITION_QUALITY
+
+
+def _source_bytes(food_image: FoodImage) -> bytes:
+    """Bytes de la original; si acaba de subirse ya están en memoria (ver core/uploads.py)"""
+    upload = getattr(food_image, 'upload', None)
+    if upload is not None:
+        return upload.getvalue()
+    with food_image.image.storage.open(food_image.image.name, 'rb') as image_file:
+        return image_file.read()
+
+
+def _save_renditions(food_image: FoodImage, rendered: Rendered) -> List[FoodImageRendition]:
+    storage = food_image.image.storage
+    renditions = []
+    for kind, image_format, data, width, height in rendered:
+        # Con el almacenamiento por contenido no se reescribe si otra FoodImage ya la generó
+        name = storage.save(rendition_name(food_image.image.name, kind, image_format), ContentFile(data))
+        renditions.append(FoodImageRendition(
+            image=food_image, kind=kind, format=image_format, name=name,
+            width=width, height=height, size=len(data),
+        ))
+    FoodImageRendition.objects.bulk_create(renditions, ignore_conflicts=True)
+    return renditions
+
+
+def _copy_shared_renditions(food_image: FoodImage) -> List[FoodImageRendition]:
+    """Si otra FoodImage con el mismo blob ya tiene todas las versiones, se reutilizan sus archivos"""
+    if not food_image.blob_id:
+        return []
+    shared = {}
+    for rendition in FoodImageRendition.objects.filter(image__blob_id=food_image.blob_id).exclude(image=food_image):
+        shared.setdefault((rendition.kind, rendition.format), rendition)
+    if len(shared) < len(rendition_sides()) * len(RENDITION_FORMATS):
+        return []
+    renditions = [
+        FoodImageRendition(
+            image=food_image, kind=source.kind, format=source.format, name=source.name,
+            width=source.width, height=source.height, size=source.size,
+        )
+        for source in shared.values()
+    ]
+    FoodImageRendition.objects.bulk_create(renditions, ignore_conflicts=True)
+    return renditions
+
+
+def generate_renditions(food_image: FoodImage) -> List[FoodImageRendition]:
+    """Genera las versiones que falten de una imagen y espera a que estén guardadas"""
+    renditions = _copy_shared_renditions(food_image)
+    if renditions:
+        return renditions
+    args = _render_args(_source_bytes(food_image))
+    executor = _rendition_executor()
+    rendered = None
+    if executor is not None:
+        try:
+            rendered = executor.submit(render_renditions, *args).result()
+        except BrokenProcessPool:
+            logger.warning("El pool de versiones reducidas se ha roto; se generan en este proceso")
+            _discard_executor(executor)
+    if rendered is None:
+        rendered = render_renditions(*args)
+    return _save_renditions(food_image, rendered)
+
+
+def _store_rendered(food_image_id: int, executor: ProcessPoolExecutor, future: Future):
+    """Callback del pool (hilo de gestión del executor): guarda el resultado si la imagen sigue existiendo"""
+    try:
+        rendered = future.result()
+    except BrokenProcessPool:
+        _discard_executor(executor)
+        logger.warning(f"No se generaron las versiones de la imagen {food_image_id}: el pool se ha roto")
+        return
+    except Exception as e:
+        logger.warning(f"No se generaron las versiones de la imagen {food_image_id}: {e}")
+        return
+    try:
+        food_image = FoodImage.objects.filter(id=food_image_id).first()
+        if food_image is not None:
+            _save_renditions(food_image, rendered)
+            logger.debug(f"Versiones reducidas de la imagen {food_image_id} guardadas")
+    except Exception as e:
+        logger.warning(f"No se pudieron guardar las versiones de la imagen {food_image_id}: {e}")
+    finally:
+        # Este hilo no pasa por el ciclo de peticiones de Django
+        connections.close_all()
+
+
+def schedule_renditions(food_image: FoodImage):
+    """
+    Encola la generación en el pool de procesos sin esperar al resultado. Los bytes se leen
+    ahora, mientras la subida sigue en memoria; sin pool se generan en el momento. Si falla,
+    la imagen se sigue mostrando y las versiones se generan al pedirlas (ver food_image_rendition).
+    """
+    try:
+        if _copy_shared_renditions(food_image):
+            return
+        args = _render_args(_source_bytes(food_image))
+        executor = _rendition_executor()
+        if executor is None:
+            _save_renditions(food_image, render_renditions(*args))
+            return
+        try:
+            future = executor.submit(render_renditions, *args)
+        except BrokenProcessPool:
+            _discard_executor(executor)
+            raise
+        future.add_done_callback(partial(_store_rendered, food_image.id, executor))
+    except Exception as e:
+        logger.warning(f"No se pudieron generar las versiones de la imagen {food_image.id}: {e}")
+
+
+def delete_renditions(food_image: FoodImage):
+    """Borra las versiones de una imagen y sus archivos si ninguna otra fila los usa"""
+    renditions = list(food_image.renditions.all())
+    FoodImageRendition.objects.filter(id__in=[rendition.id for rendition in renditions]).delete()
+    storage = food_image.image.storage
+    for rendition in renditions:
+        if not FoodImageRendition.objects.filter(name=rendition.name).exists():
+            storage.delete(rendition.name)
+
+
+@receiver(post_save, sender=FoodImage)
+def _food_image_saved(sender, instance, created, raw=False, **kwargs):
+    """Las versiones de las fotos nuevas se generan tras el commit, fuera de la petición"""
+    if raw or not created or not instance.image or not settings.IMAGE_RENDITIONS_ENABLED:
+        return
+    transaction.on_commit(lambda: schedule_renditions(instance))
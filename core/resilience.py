@@ -0,0 +1,565 @@
+import asyncio
+import logging
+import random
+import time
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import openai
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Errores del proveedor que justifican reintentar (timeouts, red, 429 y 5xx)
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,  # incluye APITimeoutError
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+# Hilos para las peticiones "hedged"; la petición perdedora termina sola en segundo plano
+_hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='openai-hedge')
+
+
+class AnalysisError(Exception):
+    """Error de análisis con código y status HTTP para el cliente"""
+    code = 'analysis_error'
+    status = 500
+    default_message = 'Error al analizar la imagen'
+
+    def __init__(self, message: Optional[str] = None, retry_after: Optional[float] = None):
+        self.message = message or self.default_message
+        self.retry_after = retry_after
+        super().__init__(self.message)
+
+
+class AnalysisTimeout(AnalysisError):
+    code = 'analysis_timeout'
+    status = 504
+    default_message = 'El análisis superó el tiempo máximo permitido'
+
+
+class ProviderUnavailable(AnalysisError):
+    code = 'provider_unavailable'
+    status = 503
+    default_message = 'El servicio de análisis no está disponible temporalmente'
+
+
+class ProviderError(AnalysisError):
+    code = 'provider_error'
+    status = 502
+    default_message = 'El servicio de análisis devolvió un error'
+
+
+class InvalidAnalysisResponse(AnalysisError):
+    code = 'invalid_response'
+    status = 502
+    default_message = 'El servicio de análisis devolvió una respuesta no válida'
+
+
+class ImageRejected(AnalysisError):
+    code = 'image_rejected'
+    status = 422
+    default_message = 'La imagen no es apta para el análisis'
+
+
+class ImageTooLarge(AnalysisError):
+    code = 'image_too_large'
+    status = 413
+    default_message = 'La imagen supera el tamaño máximo permitido'
+
+
+class UnsupportedImageType(AnalysisError):
+    code = 'unsupported_image_type'
+    status = 415
+    default_message = 'Solo se permiten imágenes JPEG, PNG o WEBP'
+
+
+class UploadOffsetMismatch(AnalysisError):
+    code = 'upload_offset_mismatch'
+    status = 409
+    default_message = 'El desplazamiento no coincide con los bytes recibidos; consulta Upload-Offset y reanuda desde ahí'
+
+
+class UploadNotReceived(AnalysisError):
+    code = 'upload_not_received'
+    status = 409
+    default_message = 'La imagen todavía no está en el almacenamiento; súbela antes de confirmar'
+
+
+class AnalysisOverloaded(AnalysisError):
+    code = 'analysis_overloaded'
+    status = 429
+    default_message = 'Hay demasiados análisis en curso, inténtalo en unos segundos'
+
+
+class AnalysisRateLimited(AnalysisError):
+    code = 'rate_limited'
+    status = 429
+    default_message = 'Has alcanzado el límite de análisis, inténtalo más tarde'
+
+
+class Deadline:
+    """Presupuesto de tiempo de una petición de análisis"""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker compartido entre procesos a través de la caché de Django.
+    Tras `failure_threshold` fallos dentro de `failure_window` segundos se abre y rechaza
+    llamadas durante `recovery_timeout` segundos; después deja pasar una única llamada de
+    prueba (semiabierto) y se cierra si tiene éxito.
+    Si la caché no está disponible, el breaker deja pasar todas las llamadas.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.failure_threshold = settings.CIRCUIT_BREAKER_FAILURE_THRESHOLD
+        self.failure_window = settings.CIRCUIT_BREAKER_FAILURE_WINDOW
+        self.recovery_timeout = settings.CIRCUIT_BREAKER_RECOVERY_TIMEOUT
+        self._failures_key = f'circuit:{name}:failures'
+        self._opened_key = f'circuit:{name}:opened_at'
+        self._probe_key = f'circuit:{name}:probe'
+
+    def state(self) -> str:
+        try:
+            opened_at = cache.get(self._opened_key)
+        except Exception as e:
+            logger.warning(f"Circuit breaker {self.name} sin caché: {e}")
+            return 'closed'
+        if opened_at is None:
+            return 'closed'
+        if time.time() - opened_at >= self.recovery_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow_request(self) -> bool:
+        state = self.state()
+        if state == 'closed':
+            return True
+        if state == 'half_open':
+            # Solo un proceso obtiene la llamada de prueba
+            try:
+                return cache.add(self._probe_key, 1, timeout=self.recovery_timeout)
+            except Exception:
+                return True
+        return False
+
+    def retry_after(self) -> float:
+        try:
+            opened_at = cache.get(self._opened_key)
+        except Exception:
+            return 0.0
+        if opened_at is None:
+            return 0.0
+        return max(1.0, self.recovery_timeout - (time.time() - opened_at))
+
+    def record_success(self):
+        try:
+            if cache.get(self._opened_key) is not None or cache.get(self._failures_key):
+                cache.delete_many([self._failures_key, self._opened_key, self._probe_key])
+                logger.info(f"Circuit breaker {self.name} cerrado")
+        except Exception as e:
+            logger.warning(f"Circuit breaker {self.name} sin caché: {e}")
+
+    def record_failure(self):
+        try:
+            cache.add(self._failures_key, 0, timeout=self.failure_window)
+            failures = cache.incr(self._failures_key)
+            if failures >= self.failure_threshold or self.state() == 'half_open':
+                cache.set(self._opened_key, time.time(), timeout=None)
+                cache.delete(self._probe_key)
+                logger.warning(f"Circuit breaker {self.name} abierto tras {failures} fallos")
+        except Exception as e:
+            logger.warning(f"Circuit breaker {self.name} sin caché: {e}")
+
+
+class Bulkhead:
+    """
+    Límite de llamadas simultáneas compartido entre workers a través de la caché de Django.
+    Cada plaza es una clave reservada con cache.add que caduca a los `lease_seconds`, de modo
+    que la plaza de un worker que muere se libera sola. Sin plaza libre, hasta `queue_size`
+    peticiones esperan un máximo de `queue_timeout` segundos; el resto se rechaza al instante
+    con AnalysisOverloaded (429). Si la caché no está disponible, deja pasar todas las llamadas.
+    """
+
+    # Las estadísticas se cuentan por minuto; con el backend de BD cada incr renueva la clave
+    # con el timeout por defecto (300 s), así que la ventana no debe superar 5 minutos
+    STATS_WINDOW_MINUTES = 5
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, name: str, max_in_flight: int, queue_size: int, queue_timeout: float,
+                 lease_seconds: float, retry_after: float, enabled: bool = True):
+        self.name = name
+        self.enabled = enabled
+        self.max_in_flight = max_in_flight
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.lease_seconds = lease_seconds
+        self.retry_after = retry_after
+
+    def _slot_keys(self, kind: str, count: int):
+        return [f'bulkhead:{self.name}:{kind}:{index}' for index in range(count)]
+
+    def _take(self, kind: str, count: int, timeout: float) -> Optional[Tuple[str, str]]:
+        """Reserva una clave libre empezando en una posición aleatoria (menos colisiones entre workers)"""
+        keys = self._slot_keys(kind, count)
+        token = uuid.uuid4().hex
+        offset = random.randrange(count) if count else 0
+        for index in range(count):
+            key = keys[(offset + index) % count]
+            # El backend de BD devuelve False también si la escritura choca con otra (SQLite
+            # bloqueado): si la plaza sigue libre se reintenta antes de darla por ocupada
+            for _ in range(3):
+                if cache.add(key, token, timeout=timeout):
+                    return key, token
+                if cache.get(key) is not None:
+                    break
+                time.sleep(random.uniform(0.005, 0.02))
+        return None
+
+    def _give_back(self, lease: Optional[Tuple[str, str]]):
+        """Libera la clave solo si sigue siendo nuestra (pudo caducar y reservarla otro)"""
+        if not lease:
+            return
+        key, token = lease
+        try:
+            if cache.get(key) == token:
+                cache.delete(key)
+        except Exception as e:
+            logger.warning(f"Bulkhead {self.name} sin caché: {e}")
+
+    def _count(self, event: str):
+        key = f'bulkhead:{self.name}:{event}:{int(time.time() // 60)}'
+        try:
+            cache.add(key, 0, timeout=(self.STATS_WINDOW_MINUTES + 1) * 60)
+            cache.incr(key)
+        except Exception:
+            pass
+
+    def _reject(self, reason: str) -> AnalysisOverloaded:
+        self._count('rejected')
+        logger.warning(f"Bulkhead {self.name} saturado ({reason}): petición rechazada")
+        return AnalysisOverloaded(retry_after=self.retry_after)
+
+    def _try_acquire(self) -> Optional[Tuple[str, str]]:
+        return self._take('slot', self.max_in_flight, self.lease_seconds)
+
+    def acquire(self) -> Optional[Tuple[str, str]]:
+        """Reserva una plaza esperando en la cola si hace falta; retorna el lease para release()"""
+        if not self.enabled:
+            return None
+        try:
+            lease = self._try_acquire()
+            if lease:
+                self._count('admitted')
+                return lease
+            ticket = self._take('queue', self.queue_size, self.queue_timeout + 1)
+        except Exception as e:
+            logger.warning(f"Bulkhead {self.name} sin caché: {e}")
+            return None
+        if ticket is None:
+            raise self._reject('cola llena')
+
+        try:
+            waited_until = time.monotonic() + self.queue_timeout
+            while time.monotonic() < waited_until:
+                time.sleep(self.POLL_INTERVAL * random.uniform(0.5, 1.5))
+                lease = self._try_acquire()
+                if lease:
+                    self._count('admitted')
+                    self._count('queued')
+                    return lease
+        except Exception as e:
+            logger.warning(f"Bulkhead {self.name} sin caché: {e}")
+            return None
+        finally:
+            self._give_back(ticket)
+        raise self._reject('espera agotada')
+
+    async def aacquire(self) -> Optional[Tuple[str, str]]:
+        """Versión asíncrona de acquire: la espera no bloquea el event loop"""
+        if not self.enabled:
+            return None
+        try:
+            lease = await sync_to_async(self._try_acquire)()
+            if lease:
+                await sync_to_async(self._count)('admitted')
+                return lease
+            ticket = await sync_to_async(self._take)('queue', self.queue_size, self.queue_timeout + 1)
+        except Exception as e:
+            logger.warning(f"Bulkhead {self.name} sin caché: {e}")
+            return None
+        if ticket is None:
+            raise await sync_to_async(self._reject)('cola llena')
+
+        try:
+            waited_until = time.monotonic() + self.queue_timeout
+            while time.monotonic() < waited_until:
+                await asyncio.sleep(self.POLL_INTERVAL * random.uniform(0.5, 1.5))
+                lease = await sync_to_async(self._try_acquire)()
+                if lease:
+                    await sync_to_async(self._count)('admitted')
+                    await sync_to_async(self._count)('queued')
+                    return lease
+        except Exception as e:
+            logger.warning(f"Bulkhead {self.name} sin caché: {e}")
+            return None
+        finally:
+            await sync_to_async(self._give_back)(ticket)
+        raise await sync_to_async(self._reject)('espera agotada')
+
+    def release(self, lease: Optional[Tuple[str, str]]):
+        self._give_back(lease)
+
+    @contextmanager
+    def admit(self):
+        """Ejecuta el bloque con una plaza reservada"""
+        lease = self.acquire()
+        try:
+            yield
+        finally:
+            self.release(lease)
+
+    @asynccontextmanager
+    async def aadmit(self):
+        lease = await self.aacquire()
+        try:
+            yield
+        finally:
+            await sync_to_async(self.release)(lease)
+
+    def status(self) -> Dict:
+        """Ocupación actual y peticiones admitidas, encoladas y rechazadas en los últimos minutos"""
+        try:
+            in_flight = len(cache.get_many(self._slot_keys('slot', self.max_in_flight)))
+            waiting = len(cache.get_many(self._slot_keys('queue', self.queue_size)))
+            minute = int(time.time() // 60)
+            counters = {}
+            for event in ('admitted', 'queued', 'rejected'):
+                keys = [f'bulkhead:{self.name}:{event}:{minute - offset}' for offset in range(self.STATS_WINDOW_MINUTES)]
+                counters[event] = sum(cache.get_many(keys).values())
+        except Exception as e:
+            logger.warning(f"Bulkhead {self.name} sin caché: {e}")
+            return {}
+        offered = counters['admitted'] + counters['rejected']
+        return {
+            'max_in_flight': self.max_in_flight,
+            'queue_size': self.queue_size,
+            'in_flight': in_flight,
+            'waiting': waiting,
+            'window_minutes': self.STATS_WINDOW_MINUTES,
+            **counters,
+            'rejection_rate': counters['rejected'] / offered if offered else 0.0,
+        }
+
+
+def analysis_bulkhead() -> Bulkhead:
+    """Bulkhead de las llamadas de análisis con la configuración de settings"""
+    return Bulkhead(
+        'analysis',
+        max_in_flight=settings.ANALYSIS_MAX_IN_FLIGHT,
+        queue_size=settings.ANALYSIS_QUEUE_SIZE,
+        queue_timeout=settings.ANALYSIS_QUEUE_TIMEOUT,
+        lease_seconds=settings.ANALYSIS_DEADLINE_SECONDS + settings.ANALYSIS_SLOT_LEASE_MARGIN,
+        retry_after=settings.ANALYSIS_OVERLOAD_RETRY_AFTER,
+        enabled=settings.ANALYSIS_BULKHEAD_ENABLED,
+    )
+
+
+def stream_error(error: Exception) -> AnalysisError:
+    """Error de análisis para un fallo del proveedor a mitad de un stream (ya no se puede reintentar)"""
+    if isinstance(error, openai.APITimeoutError):
+        return AnalysisTimeout()
+    return ProviderError()
+
+
+def _backoff_delay(attempt: int) -> float:
+    """Backoff exponencial con jitter completo"""
+    ceiling = min(settings.ANALYSIS_RETRY_MAX_DELAY, settings.ANALYSIS_RETRY_BASE_DELAY * (2 ** attempt))
+    return random.uniform(0, ceiling)
+
+
+def _close_result(future: Future):
+    """Callback: cierra el resultado de una petición descartada (libera su conexión httpx)"""
+    if future.cancelled() or future.exception() is not None:
+        return
+    close = getattr(future.result(), 'close', None)
+    if close is not None:
+        try:
+            close()
+        except Exception as e:
+            logger.debug(f"No se pudo cerrar la respuesta descartada: {e}")
+
+
+def _discard(futures: List[Future]):
+    """
+    Las peticiones de un hilo no se pueden interrumpir: las que no empezaron se cancelan y
+    las demás se cierran en cuanto terminen
+    """
+    for future in futures:
+        if not future.cancel():
+            future.add_done_callback(_close_result)
+
+
+def _hedged_call(func: Callable[[float], Any], timeout: float, hedge_after: float) -> Any:
+    """
+    Lanza la llamada y, si no terminó tras `hedge_after` segundos, lanza una segunda idéntica.
+    Retorna el primer resultado correcto; el de la otra se cierra al llegar.
+    """
+    started = time.monotonic()
+    futures = [_hedge_executor.submit(func, timeout)]
+    done, _ = wait(futures, timeout=min(hedge_after, timeout))
+    if not done:
+        logger.info("Petición lenta: lanzando petición hedged tras %.1fs", hedge_after)
+        futures.append(_hedge_executor.submit(func, max(0.1, timeout - (time.monotonic() - started))))
+
+    pending = set(futures)
+    last_error = None
+    try:
+        while pending:
+            remaining = timeout - (time.monotonic() - started)
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+                _discard([other for other in futures if other is not future])
+                return result
+    except BaseException:
+        _discard(futures)
+        raise
+    _discard(futures)
+    if last_error is not None:
+        raise last_error
+    raise openai.APITimeoutError(request=None)
+
+
+def call_with_retries(func: Callable[[float], Any], deadline: Deadline, breaker: CircuitBreaker,
+                      hedge: bool = True) -> Any:
+    """
+    Ejecuta `func(timeout)` con reintentos acotados, backoff con jitter y dentro del
+    presupuesto `deadline`. Cada intento recibe como timeout el tiempo restante.
+    Sin `hedge` no se lanzan peticiones duplicadas (los streams no se duplican: ver _call_provider).
+    """
+    max_attempts = max(1, settings.ANALYSIS_MAX_ATTEMPTS)
+    hedge_after = settings.ANALYSIS_HEDGE_AFTER_SECONDS if hedge else 0
+    last_error = None
+
+    for attempt in range(max_attempts):
+        if not breaker.allow_request():
+            raise ProviderUnavailable(retry_after=breaker.retry_after())
+        timeout = deadline.remaining()
+        if timeout <= 0:
+            raise AnalysisTimeout()
+
+        try:
+            if hedge_after and hedge_after < timeout:
+                result = _hedged_call(func, timeout, hedge_after)
+            else:
+                result = func(timeout)
+            breaker.record_success()
+            return result
+
+        except RETRYABLE_ERRORS as e:
+            breaker.record_failure()
+            last_error = e
+            logger.warning(f"Intento {attempt + 1}/{max_attempts} fallido ({type(e).__name__}): {e}")
+            delay = _backoff_delay(attempt)
+            if attempt + 1 >= max_attempts or delay >= deadline.remaining():
+                break
+            time.sleep(delay)
+
+        except openai.APIStatusError as e:
+            # 4xx: reintentar no ayuda y no indica que el proveedor esté caído
+            raise ProviderError(f'{ProviderError.default_message} ({e.status_code})')
+
+    if deadline.expired() or isinstance(last_error, openai.APITimeoutError):
+        raise AnalysisTimeout()
+    raise ProviderError()
+
+
+async def acall_with_retries(func: Callable[[float], Any], deadline: Deadline, breaker: CircuitBreaker,
+                             hedge: bool = True) -> Any:
+    """Versión asíncrona de call_with_retries; `func(timeout)` debe ser una corrutina"""
+    max_attempts = max(1, settings.ANALYSIS_MAX_ATTEMPTS)
+    hedge_after = settings.ANALYSIS_HEDGE_AFTER_SECONDS if hedge else 0
+    last_error = None
+
+    for attempt in range(max_attempts):
+        if not await sync_to_async(breaker.allow_request)():
+            raise ProviderUnavailable(retry_after=await sync_to_async(breaker.retry_after)())
+        timeout = deadline.remaining()
+        if timeout <= 0:
+            raise AnalysisTimeout()
+
+        try:
+            if hedge_after and hedge_after < timeout:
+                result = await _ahedged_call(func, timeout, hedge_after)
+            else:
+                result = await func(timeout)
+            await sync_to_async(breaker.record_success)()
+            return result
+
+        except RETRYABLE_ERRORS as e:
+            await sync_to_async(breaker.record_failure)()
+            last_error = e
+            logger.warning(f"Intento {attempt + 1}/{max_attempts} fallido ({type(e).__name__}): {e}")
+            delay = _backoff_delay(attempt)
+            if attempt + 1 >= max_attempts or delay >= deadline.remaining():
+                break
+            await asyncio.sleep(delay)
+
+        except openai.APIStatusError as e:
+            raise ProviderError(f'{ProviderError.default_message} ({e.status_code})')
+
+    if deadline.expired() or isinstance(last_error, openai.APITimeoutError):
+        raise AnalysisTimeout()
+    raise ProviderError()
+
+
+async def _ahedged_call(func: Callable[[float], Any], timeout: float, hedge_after: float) -> Any:
+    """Versión asíncrona de _hedged_call; cancela la petición perdedora"""
+    started = time.monotonic()
+    tasks = [asyncio.ensure_future(func(timeout))]
+    done, _ = await asyncio.wait(tasks, timeout=min(hedge_after, timeout))
+    if not done:
+        logger.info("Petición lenta: lanzando petición hedged tras %.1fs", hedge_after)
+        tasks.append(asyncio.ensure_future(func(max(0.1, timeout - (time.monotonic() - started)))))
+
+    pending = set(tasks)
+    last_error = None
+    try:
+        while pending:
+            remaining = timeout - (time.monotonic() - started)
+            if remaining <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                last_error = task.exception()
+    finally:
+        for task in pending:
+            task.cancel()
+    if last_error is not None:
+        raise last_error
+    raise openai.APITimeoutError(request=None)
@@ -0,0 +1,55 @@
+from typing import Dict, Iterator, Tuple
+
+from botocore.exceptions import ClientError
+from storages.backends.s3 import S3Storage
+from storages.utils import clean_name
+
+
+class ContentAddressedS3Storage(S3Storage):
+    """
+    ContentAddressedStorage sobre S3 o un servicio compatible (MinIO en local, con
+    AWS_S3_ENDPOINT_URL). El nombre sale del hash del contenido, así que un objeto que ya
+    existe no se vuelve a subir. La configuración son los AWS_* de settings.py.
+    """
+    file_overwrite = True
+    default_acl = None
+
+    def _key(self, name: str) -> str:
+        return self._normalize_name(clean_name(name))
+
+    def exists(self, name: str) -> bool:
+        # Siempre con HEAD: con file_overwrite algunas versiones de S3Storage responden False sin consultar
+        try:
+            self.connection.meta.client.head_object(Bucket=self.bucket_name, Key=self._key(name))
+        except ClientError as e:
+            if e.response.get('ResponseMetadata', {}).get('HTTPStatusCode') == 404:
+                return False
+            raise
+        return True
+
+    def _save(self, name, content):
+        if self.exists(name):
+            return clean_name(name)
+        return super()._save(name, content)
+
+    def iter_files(self, prefix: str) -> Iterator[Tuple[str, int, float]]:
+        """(nombre, bytes, mtime) de cada objeto bajo `prefix`, listados por páginas de 1000"""
+        location = clean_name(self.location).strip('/')
+        paginator = self.connection.meta.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=self._key(prefix) + '/'):
+            for item in page.get('Contents', []):
+                name = item['Key'][len(location) + 1:] if location else item['Key']
+                yield name, item['Size'], item['LastModified'].timestamp()
+
+    def presigned_post(self, name: str, content_type: str, max_bytes: int, expires_in: int) -> Dict:
+        """POST prefirmado: el cliente sube el objeto directamente, con el tipo y el tamaño máximo fijados"""
+        return self.connection.meta.client.generate_presigned_post(
+            Bucket=self.bucket_name,
+            Key=self._key(name),
+            Fields={'Content-Type': content_type},
+            Conditions=[
+                {'Content-Type': content_type},
+                ['content-length-range', 1, max_bytes],
+            ],
+            ExpiresIn=expires_in,
+        )
@@ -1,46 +1,39 @@
 import base64
+import hashlib
 import json
 import logging
-import os
-from typing import Dict, List, Optional, Tuple
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+import openai
 from django.conf import settings
+from django.db import connections, transaction
 from django.core.files.base import ContentFile
-from openai import OpenAI
+from django.db.models.fields.files import FieldFile
+from .analysis_cache import AnalysisCache
+from .analysis_metrics import AnalysisMetrics, estimate_image_tokens
+from .categorizer import get_categorizer
+from .image_processing import image_dimensions, prepare_image_for_analysis
+from .image_screening import screen_image
+from .json_repair import parse_food_analysis
+from .meal_matching import find_repeat_meal, hamming_distance
+from .model_routing import ModelTier, TierRouter, full_tier, get_model_tiers, get_tier
+from .openai_client import get_openai_client
+from .single_flight import analysis_single_flight
+from .resilience import (
+    AnalysisError, AnalysisTimeout, CircuitBreaker, Deadline, ImageRejected, InvalidAnalysisResponse,
+    call_with_retries, stream_error
+)
 from .models import FoodImage, OpenAIAnalysis, Food, FoodCategory
+from .streaming import FoodItemStreamParser
+from .text import normalize_food_name
+from .uploads import AnalysisUploadedFile
 
 logger = logging.getLogger(__name__)
 
 
-class OpenAIService:
-    """Servicio para interactuar con la API de OpenAI"""
-    
-    def __init__(self):
-        self.client = OpenAI(api_key=settings.OPENAI_API_KEY)
-    
-    def encode_image_to_base64(self, image_path: str) -> str:
-        """Codifica una imagen a base64"""
-        try:
-            with open(image_path, "rb") as image_file:
-                return base64.b64encode(image_file.read()).decode('utf-8')
-        except Exception as e:
-            logger.error(f"Error codificando imagen: {e}")
-            raise
-    
-    def analyze_food_image(self, image_path: str) -> Dict:
-        """
-        Analiza una imagen de comida usando GPT-5 (visión)
-        Retorna un diccionario con los alimentos identificados y sus calorías
-        """
-        try:
-            # Codificar imagen
-            try:
-                file_size = os.path.getsize(image_path)
-            except Exception:
-                file_size = None
-            base64_image = self.encode_image_to_base64(image_path)
-            
-            # Prompt para análisis de alimentos
-            prompt = """
+# Prompt para análisis de alimentos
+ANALYSIS_PROMPT = """
             Analiza esta imagen de comida y proporciona la siguiente información EXACTAMENTE en este esquema:
             {
                 "foods": [
@@ -63,127 +56,258 @@ class OpenAIService:
             - No devuelvas 0 salvo que sea claramente vacío
             """
 
-            # Logs de depuración (prompt y metadatos de imagen, sin base64)
-            logger.debug("GPT-5 vision request -> model=gpt-5, image_path=%s, image_size_bytes=%s", image_path, file_size)
-            logger.debug("GPT-5 prompt sent:\n%s", prompt.strip())
-            
-            # Definir herramienta (function calling) para forzar salida estructurada
-            tools = [
-                {
-                    "type": "function",
-                    "function": {
-                        "name": "return_food_analysis",
-                        "description": "Devuelve el análisis de alimentos conforme al esquema requerido.",
-                        "parameters": {
+# Prompt corto para los niveles rápidos del enrutado de modelos (ver core/model_routing.py)
+ANALYSIS_PROMPT_COMPACT = """
+            Identifica los alimentos visibles y llama a 'return_food_analysis'.
+            Gramos realistas (1-1000), kcal/100g estándar (0-900), total_calories = suma(grams*kcal/100).
+            Confianzas entre 0 y 1: baja analysis_confidence si la foto es ambigua o hay alimentos ocultos.
+            """
+
+# Definir herramienta (function calling) para forzar salida estructurada
+ANALYSIS_TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "return_food_analysis",
+            "description": "Devuelve el análisis de alimentos conforme al esquema requerido.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "foods": {
+                        "type": "array",
+                        "items": {
                             "type": "object",
                             "properties": {
-                                "foods": {
-                                    "type": "array",
-                                    "items": {
-                                        "type": "object",
-                                        "properties": {
-                                            "name": {"type": "string"},
-                                            "estimated_grams": {"type": "number"},
-                                            "calories_per_100g": {"type": "number"},
-                                            "confidence": {"type": "number"}
-                                        },
-                                        "required": ["name", "estimated_grams", "calories_per_100g", "confidence"]
-                                    }
-                                },
-                                "total_calories": {"type": "number"},
-                                "analysis_confidence": {"type": "number"},
-                                "notes": {"type": "string"}
+                                "name": {"type": "string"},
+                                "estimated_grams": {"type": "number"},
+                                "calories_per_100g": {"type": "number"},
+                                "confidence": {"type": "number"}
                             },
-                            "required": ["foods", "total_calories", "analysis_confidence"]
+                            "required": ["name", "estimated_grams", "calories_per_100g", "confidence"]
                         }
-                    }
-                }
-            ]
-            
-            # Llamada a la API (chat + tool calling)
-            response = self.client.chat.completions.create(
-                model="gpt-5",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "Responde llamando a la función 'return_food_analysis' con argumentos JSON válidos y completos. No incluyas texto adicional."
                     },
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {
-                                "type": "image_url",
-                                "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
-                            }
-                        ]
-                    }
-                ],
-                tools=tools,
-                tool_choice={"type": "function", "function": {"name": "return_food_analysis"}}
+                    "total_calories": {"type": "number"},
+                    "analysis_confidence": {"type": "number"},
+                    "notes": {"type": "string"}
+                },
+                "required": ["foods", "total_calories", "analysis_confidence"]
+            }
+        }
+    }
+]
+
+# Versión del prompt/esquema: cambia automáticamente si se edita cualquiera de los dos
+PROMPT_VERSION = hashlib.sha256(
+    (ANALYSIS_PROMPT + ANALYSIS_PROMPT_COMPACT + json.dumps(ANALYSIS_TOOLS, sort_keys=True)).encode('utf-8')
+).hexdigest()[:16]
+
+
+def analysis_version() -> str:
+    """
+    Versión de los análisis para la caché y el single-flight: PROMPT_VERSION más los niveles de
+    modelo en uso (modelo, detalle de imagen y prompt). Cambiar ANALYSIS_MODEL_TIERS o
+    ANALYSIS_ROUTING_ENABLED no sirve análisis hechos con otra configuración.
+    """
+    tiers = [(tier.model, tier.detail, tier.compact_prompt) for tier in get_model_tiers()]
+    return hashlib.sha256(f"{PROMPT_VERSION}:{json.dumps(tiers)}".encode('utf-8')).hexdigest()[:16]
+
+
+# Ruta local o FoodImage.image: las imágenes guardadas pueden estar en S3 y no tener ruta
+ImageSource = Union[str, FieldFile]
+
+
+def _read_file(image: ImageSource) -> bytes:
+    """Bytes de una ruta local o de un archivo guardado en el almacenamiento de FoodImage (local o S3)"""
+    if isinstance(image, FieldFile):
+        # storage.open() abre un archivo nuevo: el FieldFile se puede leer desde varios hilos
+        with image.storage.open(image.name, 'rb') as image_file:
+            return image_file.read()
+    with open(image, "rb") as image_file:
+        return image_file.read()
+
+
+def merge_analyses(analyses: List[Tuple[int, Dict]]) -> Dict:
+    """
+    Combina los análisis de varias fotos de una misma comida.
+    Un alimento que aparece en varias fotos (p. ej. el mismo plato desde dos ángulos)
+    se cuenta una sola vez: se conserva la estimación con mayor confianza y se
+    registran todas las fotos en las que aparece en 'sources'.
+    """
+    merged: Dict[str, Dict] = {}
+    confidences = []
+    notes = []
+
+    for index, analysis_data in analyses:
+        confidences.append(analysis_data.get('analysis_confidence', 0.0))
+        if analysis_data.get('notes'):
+            notes.append(f"Foto {index + 1}: {analysis_data['notes']}")
+
+        for food in analysis_data.get('foods', []):
+            key = normalize_food_name(food.get('name', ''))
+            current = merged.get(key)
+            if current is None:
+                merged[key] = {**food, 'sources': [index]}
+                continue
+            if index not in current['sources']:
+                current['sources'].append(index)
+            if food.get('confidence', 0) > current.get('confidence', 0):
+                current.update({k: v for k, v in food.items() if k != 'sources'})
+
+    foods = list(merged.values())
+    return {
+        'foods': foods,
+        'total_calories': round(sum(
+            (food.get('estimated_grams', 0) * food.get('calories_per_100g', 0)) / 100 for food in foods
+        ), 2),
+        'analysis_confidence': round(sum(confidences) / len(confidences), 2) if confidences else 0.0,
+        'notes': ' | '.join(notes),
+    }
+
+
+class OpenAIService:
+    """Servicio para interactuar con la API de OpenAI"""
+    
+    def __init__(self):
+        self.client = get_openai_client()
+        self.cache = AnalysisCache(analysis_version())
+        self.breaker = CircuitBreaker('openai')
+        self.single_flight = analysis_single_flight()
+    
+    def encode_image_to_base64(self, image_path: str) -> Tuple[str, str]:
+        """Prepara una imagen y la codifica a base64. Retorna (base64, mime_type)"""
+        try:
+            with open(image_path, "rb") as image_file:
+                return self._encode_image_bytes(image_file.read())
+        except Exception as e:
+            logger.error(f"Error codificando imagen: {e}")
+            raise
+    
+    def _encode_image_bytes(self, image_bytes: bytes, metrics: Optional[AnalysisMetrics] = None,
+                            upload: Optional[AnalysisUploadedFile] = None) -> Tuple[str, str]:
+        """Reduce y recomprime la imagen antes de codificarla a base64 (de una subida se usa su versión reducida)"""
+        processed_bytes, mime_type = upload.rendition if upload is not None else prepare_image_for_analysis(image_bytes)
+        base64_image = base64.b64encode(processed_bytes).decode('utf-8')
+        if metrics is not None:
+            metrics.payload_bytes = len(base64_image)
+            metrics.image_size = image_dimensions(processed_bytes)
+            metrics.image_tokens = estimate_image_tokens(*metrics.image_size)
+        return base64_image, mime_type
+    
+    def analyze_food_image(self, image_path: ImageSource) -> Dict:
+        """
+        Analiza una imagen de comida usando GPT-5 (visión)
+        Retorna un diccionario con los alimentos identificados y sus calorías.
+        Consulta primero la caché por contenido para no repetir la llamada a la API.
+        """
+        analysis_data, _ = self.analyze_food_image_with_metrics(image_path)
+        return analysis_data
+    
+    def analyze_food_image_with_metrics(self, image_path: ImageSource, user_id: Optional[int] = None,
+                                        upload: Optional[AnalysisUploadedFile] = None,
+                                        use_cache: bool = True) -> Tuple[Dict, AnalysisMetrics]:
+        """
+        Igual que analyze_food_image, pero retorna también tokens, latencias y reintentos.
+        Si la misma imagen del mismo usuario ya se está analizando, espera a ese análisis
+        en lugar de repetir la llamada (ver core/single_flight.py). Con `upload` (la subida
+        que acaba de recibir la vista) no se relee el archivo ni se recalculan hash y versión reducida.
+        Sin `use_cache` no se consulta la caché, pero el resultado nuevo sí la actualiza.
+        """
+        metrics = AnalysisMetrics()
+        try:
+            with metrics.stage('read'):
+                image_bytes = upload.getvalue() if upload is not None else _read_file(image_path)
+        except Exception as e:
+            logger.error(f"Error leyendo imagen: {e}")
+            raise
+        
+        with metrics.stage('cache'):
+            content_hash = self._content_hash(image_bytes, upload)
+            cached = self.cache.get(content_hash) if use_cache else None
+        if cached is not None:
+            logger.info("Análisis servido desde caché (hash=%s)", content_hash[:12])
+            metrics.cache_hit = True
+            return cached, metrics
+        
+        def analyze():
+            self._screen_image(image_bytes, metrics)
+            analysis_data = self._request_analysis(image_bytes, image_path, metrics, upload)
+            if self._is_cacheable(analysis_data):
+                with metrics.stage('cache'):
+                    self.cache.set(content_hash, analysis_data)
+            return analysis_data
+        
+        analysis_data, metrics.coalesced = self.single_flight.run(self._flight_key(content_hash, user_id), analyze)
+        if metrics.coalesced:
+            logger.info("Análisis compartido con una petición idéntica en curso (hash=%s)", content_hash[:12])
+        return analysis_data, metrics
+    
+    @staticmethod
+    def _content_hash(image_bytes: bytes, upload: Optional[AnalysisUploadedFile] = None) -> str:
+        """Hash del contenido de la imagen; la subida de la vista ya lo trae calculado"""
+        return upload.content_hash if upload is not None else hashlib.sha256(image_bytes).hexdigest()
+    
+    def _flight_key(self, content_hash: str, user_id: Optional[int]) -> str:
+        """Clave del single-flight: versión del análisis (la de la caché), usuario y contenido de la imagen"""
+        return f"{self.cache.prompt_version}:{user_id or '-'}:{content_hash}"
+    
+    def _screen_image(self, image_bytes: bytes, metrics: AnalysisMetrics):
+        """Cribado local: rechaza fotos ilegibles, negras, lisas, borrosas o diminutas sin gastar una llamada"""
+        if not settings.IMAGE_SCREENING_ENABLED:
+            return
+        with metrics.stage('screen'):
+            result = screen_image(image_bytes)
+        if result.rejected:
+            codes = ', '.join(code for code, _ in result.rejections)
+            logger.info(f"Imagen rechazada en el cribado ({codes}): {result.measurements}")
+            raise ImageRejected(result.message)
+        metrics.screening_warnings = [message for _, message in result.warnings]
+    
+    def _is_cacheable(self, analysis_data: Optional[Dict]) -> bool:
+        """Solo se cachean análisis válidos y completos (no truncados) con al menos un alimento"""
+        return (
+            isinstance(analysis_data, dict)
+            and bool(analysis_data.get('foods'))
+            and not analysis_data.get('truncated')
+            and all(key in analysis_data for key in ('total_calories', 'analysis_confidence'))
+        )
+    
+    def _request_analysis(self, image_bytes: bytes, image_path: ImageSource, metrics: Optional[AnalysisMetrics] = None,
+                          upload: Optional[AnalysisUploadedFile] = None) -> Dict:
+        """
+        Envía la imagen a los niveles de modelo configurados, del más rápido al completo
+        (ver core/model_routing.py), y extrae el análisis estructurado
+        """
+        metrics = metrics or AnalysisMetrics()
+        try:
+            with metrics.stage('encode'):
+                base64_image, mime_type = self._encode_image_bytes(image_bytes, metrics, upload)
+            image_url = f"data:{mime_type};base64,{base64_image}"
+
+            # Logs de depuración (prompt y metadatos de imagen, sin base64)
+            tiers = get_model_tiers()
+            logger.debug(
+                "Vision request -> tiers=%s, image_path=%s, image_size_bytes=%s, payload_bytes=%s, mime=%s",
+                tiers, image_path, len(image_bytes), len(base64_image), mime_type
             )
             
-            # Extraer y loguear la respuesta cruda
-            message = response.choices[0].message
-            raw_content = message.content or ""
-            logger.debug("GPT-5 raw message.content (first 500 chars): %s", (raw_content[:500] + '...') if len(raw_content) > 500 else raw_content)
-            tool_calls = getattr(message, "tool_calls", None) or []
-            if tool_calls:
-                try:
-                    tool_args = tool_calls[0].function.arguments
-                    logger.debug("GPT-5 tool_call name=%s args_snippet=%s", tool_calls[0].function.name, (tool_args[:500] + '...') if len(tool_args) > 500 else tool_args)
-                except Exception:
-                    logger.debug("GPT-5 tool_call present but arguments could not be logged")
+            # Todo el análisis (niveles, reintentos y fallback incluidos) comparte un presupuesto de tiempo
+            deadline = Deadline(settings.ANALYSIS_DEADLINE_SECONDS)
             
-            # Extraer argumentos de la tool call
-            analysis_data = None
-            try:
-                if tool_calls:
-                    tool_args = tool_calls[0].function.arguments
-                    analysis_data = json.loads(tool_args)
-            except Exception as e:
-                logger.debug("JSON load error from tool_call arguments: %s", e)
-                analysis_data = None
-            
-            if not analysis_data:
-                # Fallback: intentar parsear desde content
-                response_text = raw_content
-                logger.debug("Fallback to content parsing (first 500 chars): %s", (response_text[:500] + '...') if len(response_text) > 500 else response_text)
+            # Llamadas a la API (chat + tool calling), escalando de nivel si el resultado no basta
+            router = TierRouter(tiers, deadline, metrics)
+            for tier in router:
                 try:
-                    analysis_data = self._parse_openai_response(response_text)
-                except Exception:
-                    analysis_data = None
+                    router.record(tier, self._analyze_with_tier(image_url, tier, deadline, metrics))
+                except AnalysisError as e:
+                    router.failed(tier, e)
+            analysis_data = router.result
             
-            if not analysis_data:
+            if self._needs_fallback(analysis_data, deadline, metrics):
                 # Retry sin tools, forzando JSON con response_format
                 logger.debug("Retrying with response_format=json_object and no tools")
-                retry = self.client.chat.completions.create(
-                    model="gpt-5",
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": "Devuelve exclusivamente un objeto JSON válido conforme al esquema indicado. No agregues texto fuera del JSON."
-                        },
-                        {
-                            "role": "user",
-                            "content": [
-                                {"type": "text", "text": prompt},
-                                {
-                                    "type": "image_url",
-                                    "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
-                                }
-                            ]
-                        }
-                    ],
-                    response_format={"type": "json_object"},
-                    max_completion_tokens=800
-                )
-                retry_text = retry.choices[0].message.content or ""
-                logger.debug("Retry raw content (first 500 chars): %s", (retry_text[:500] + '...') if len(retry_text) > 500 else retry_text)
-                try:
-                    analysis_data = json.loads(retry_text)
-                except Exception:
-                    analysis_data = self._parse_openai_response(retry_text)
+                retry = self._call_provider(self._json_retry_request(image_url), deadline, metrics)
+                with metrics.stage('parse'):
+                    analysis_data = self._extract_retry_analysis(retry)
             
             return analysis_data
             
@@ -191,52 +315,282 @@ class OpenAIService:
             logger.error(f"Error analizando imagen con OpenAI: {e}")
             raise
     
-    def _parse_openai_response(self, response_text: str) -> Dict:
-        """Parsea la respuesta de OpenAI y la convierte en un diccionario estructurado"""
+    @staticmethod
+    def _needs_fallback(analysis_data: Optional[Dict], deadline: Deadline, metrics: AnalysisMetrics) -> bool:
+        """
+        Si ningún nivel dio un análisis válido hay que reintentar con response_format=json_object
+        (y con el modelo completo). El fallback solo se intenta si queda presupuesto suficiente.
+        """
+        if analysis_data:
+            return False
+        if deadline.remaining() < settings.ANALYSIS_FALLBACK_MIN_SECONDS:
+            raise InvalidAnalysisResponse()
+        metrics.fallback_used = True
+        metrics.routing_tier = full_tier().name
+        return True
+    
+    def _analyze_with_tier(self, image_url: str, tier: ModelTier, deadline: Deadline,
+                           metrics: AnalysisMetrics) -> Optional[Dict]:
+        """Llamada principal con el modelo, el detalle de imagen y el prompt de un nivel"""
+        started = time.perf_counter()
         try:
-            # Buscar JSON en la respuesta
-            start_idx = response_text.find('{')
-            end_idx = response_text.rfind('}') + 1
-            
-            if start_idx == -1 or end_idx == 0:
-                raise ValueError("No se encontró JSON válido en la respuesta")
-            
-            json_str = response_text[start_idx:end_idx]
-            parsed_data = json.loads(json_str)
-            
-            # Validar estructura mínima esperada
-            required_keys = ['foods', 'total_calories', 'analysis_confidence']
-            for key in required_keys:
-                if key not in parsed_data:
-                    raise ValueError(f"Falta clave requerida: {key}")
-            
-            return parsed_data
-            
-        except json.JSONDecodeError as e:
-            logger.error(f"Error parseando JSON de OpenAI: {e}")
-            # Retornar estructura por defecto
-            return {
-                'foods': [],
-                'total_calories': 0,
-                'analysis_confidence': 0.0,
-                'notes': 'Error parseando respuesta de OpenAI'
-            }
-        except Exception as e:
-            logger.error(f"Error procesando respuesta de OpenAI: {e}")
-            raise
+            response = self._call_provider(self._tool_call_request(image_url, tier), deadline, metrics)
+            with metrics.stage('parse'):
+                return self._extract_analysis(response, metrics)
+        finally:
+            metrics.record_tier(tier.name, (time.perf_counter() - started) * 1000)
+    
+    def stream_food_analysis(self, image_path: ImageSource, user_id: Optional[int] = None,
+                             upload: Optional[AnalysisUploadedFile] = None) -> Iterator[Tuple[str, Any]]:
+        """
+        Analiza una imagen con la respuesta en streaming.
+        Emite ('item', alimento) en cuanto cada alimento de la tool call está completo
+        y al final ('done', (analysis_data, metrics)). Si la misma imagen ya se está
+        analizando, espera a ese análisis y emite sus alimentos de una vez.
+        """
+        metrics = AnalysisMetrics()
+        with metrics.stage('read'):
+            image_bytes = upload.getvalue() if upload is not None else _read_file(image_path)
+        
+        with metrics.stage('cache'):
+            content_hash = self._content_hash(image_bytes, upload)
+            cached = self.cache.get(content_hash)
+        if cached is not None:
+            metrics.cache_hit = True
+            yield from self._replay_events(cached, metrics)
+            return
+        
+        shared, flight = self.single_flight.join(self._flight_key(content_hash, user_id))
+        if flight is None:
+            metrics.coalesced = True
+            yield from self._replay_events(shared, metrics)
+            return
+        with flight:
+            analysis_data = yield from self._stream_uncached(image_bytes, metrics, upload)
+            if self._is_cacheable(analysis_data):
+                with metrics.stage('cache'):
+                    self.cache.set(content_hash, analysis_data)
+            flight.publish(analysis_data)
+        yield 'done', (analysis_data, metrics)
+    
+    @staticmethod
+    def _replay_events(analysis_data: Dict, metrics: AnalysisMetrics) -> List[Tuple[str, Any]]:
+        """Eventos de un análisis ya hecho (caché o petición idéntica): sus alimentos de una vez y 'done'"""
+        events = [('item', food) for food in analysis_data.get('foods', [])]
+        events.append(('done', (analysis_data, metrics)))
+        return events
+    
+    def _stream_uncached(self, image_bytes: bytes, metrics: AnalysisMetrics,
+                         upload: Optional[AnalysisUploadedFile] = None) -> Iterator[Tuple[str, Any]]:
+        """Cribado y llamadas en streaming por niveles; emite los alimentos y retorna el análisis"""
+        self._screen_image(image_bytes, metrics)
+        with metrics.stage('encode'):
+            base64_image, mime_type = self._encode_image_bytes(image_bytes, metrics, upload)
+        image_url = f"data:{mime_type};base64,{base64_image}"
+        deadline = Deadline(settings.ANALYSIS_DEADLINE_SECONDS)
+        
+        router = TierRouter(get_model_tiers(), deadline, metrics)
+        for tier in router:
+            if self._is_escalation(router, tier):
+                yield 'reset', {'tier': tier.name}
+            try:
+                tier_data = yield from self._stream_tier(image_url, tier, deadline, metrics)
+            except AnalysisError as e:
+                router.failed(tier, e)
+            else:
+                router.record(tier, tier_data)
+        analysis_data = router.result
+        
+        if self._needs_fallback(analysis_data, deadline, metrics):
+            logger.debug("Streamed tool call was not valid JSON, retrying with response_format=json_object")
+            retry = self._call_provider(self._json_retry_request(image_url), deadline, metrics)
+            with metrics.stage('parse'):
+                analysis_data = self._extract_retry_analysis(retry)
+        return analysis_data
+    
+    @staticmethod
+    def _is_escalation(router: TierRouter, tier: ModelTier) -> bool:
+        """Al escalar de nivel el cliente descarta los alimentos emitidos por el nivel anterior"""
+        return tier is not router.tiers[0]
+    
+    def _stream_tier(self, image_url: str, tier: ModelTier, deadline: Deadline,
+                     metrics: AnalysisMetrics) -> Iterator[Tuple[str, Any]]:
+        """Tool call en streaming de un nivel: emite ('item', alimento) y retorna el análisis parseado"""
+        # Los reintentos solo cubren la apertura del stream; a mitad de respuesta ya no se reintenta
+        started = time.perf_counter()
+        try:
+            stream = self._call_provider(self._stream_request(image_url, tier), deadline, metrics)
+            parser = FoodItemStreamParser()
+            try:
+                with metrics.stage('api'):
+                    for chunk in stream:
+                        for food in parser.feed(self._chunk_text(chunk, metrics)):
+                            yield 'item', food
+                        # El timeout de httpx es por lectura; el presupuesto total se comprueba aquí
+                        if deadline.expired():
+                            raise AnalysisTimeout()
+            except openai.APIError as e:
+                self.breaker.record_failure()
+                logger.error(f"Error en el stream de OpenAI: {e}")
+                raise stream_error(e)
+            finally:
+                stream.close()
+        finally:
+            metrics.record_tier(tier.name, (time.perf_counter() - started) * 1000)
+        
+        with metrics.stage('parse'):
+            return self._parse_streamed_analysis(parser.text, metrics)
+    
+    def _stream_request(self, image_url: str, tier: ModelTier) -> Dict:
+        """Argumentos de la tool call en streaming de un nivel; el último chunk trae el uso de tokens"""
+        return {
+            **self._tool_call_request(image_url, tier),
+            'stream': True,
+            'stream_options': {'include_usage': True},
+        }
+    
+    def _chunk_text(self, chunk, metrics: AnalysisMetrics) -> str:
+        """Fragmento de argumentos (o de contenido) de un chunk del stream; registra el uso final"""
+        if chunk.usage is not None:
+            metrics.record_response(chunk)
+        if not chunk.choices:
+            return ''
+        delta = chunk.choices[0].delta
+        if delta.tool_calls:
+            function = delta.tool_calls[0].function
+            return (function.arguments or '') if function is not None else ''
+        return delta.content or ''
+    
+    def _parse_streamed_analysis(self, text: str, metrics: Optional[AnalysisMetrics] = None) -> Optional[Dict]:
+        """Análisis a partir del texto completo recibido por el stream"""
+        return self._parse_analysis_text(text, metrics)
+    
+    def _call_provider(self, request_kwargs: Dict, deadline: Deadline, metrics: Optional[AnalysisMetrics] = None):
+        """Llama a la API con timeout por intento, reintentos acotados y circuit breaker"""
+        metrics = metrics or AnalysisMetrics()
+        
+        def attempt(timeout: float):
+            metrics.requests += 1
+            client = self.client.with_options(timeout=timeout, max_retries=0)
+            return client.chat.completions.create(**request_kwargs)
+        
+        with metrics.stage('api'):
+            # Un stream duplicado retendría su conexión hasta el final: los streams no se duplican
+            response = call_with_retries(attempt, deadline, self.breaker, hedge=not request_kwargs.get('stream'))
+        metrics.record_response(response)
+        return response
+    
+    def _tool_call_request(self, image_url: str, tier: Optional[ModelTier] = None) -> Dict:
+        """Argumentos de la llamada principal (chat + tool calling); por defecto con el modelo completo"""
+        tier = tier or full_tier()
+        image = {"url": image_url}
+        if tier.detail != 'auto':
+            image["detail"] = tier.detail
+        return {
+            'model': tier.model,
+            'messages': [
+                {
+                    "role": "system",
+                    "content": "Responde llamando a la función 'return_food_analysis' con argumentos JSON válidos y completos. No incluyas texto adicional."
+                },
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": ANALYSIS_PROMPT_COMPACT if tier.compact_prompt else ANALYSIS_PROMPT},
+                        {
+                            "type": "image_url",
+                            "image_url": image
+                        }
+                    ]
+                }
+            ],
+            'tools': ANALYSIS_TOOLS,
+            'tool_choice': {"type": "function", "function": {"name": "return_food_analysis"}}
+        }
+    
+    def _json_retry_request(self, image_url: str) -> Dict:
+        """Argumentos del reintento sin tools, forzando JSON con response_format"""
+        return {
+            'model': full_tier().model,
+            'messages': [
+                {
+                    "role": "system",
+                    "content": "Devuelve exclusivamente un objeto JSON válido conforme al esquema indicado. No agregues texto fuera del JSON."
+                },
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": ANALYSIS_PROMPT},
+                        {
+                            "type": "image_url",
+                            "image_url": {"url": image_url}
+                        }
+                    ]
+                }
+            ],
+            'response_format': {"type": "json_object"},
+            'max_completion_tokens': 800
+        }
+    
+    def _extract_analysis(self, response, metrics: Optional[AnalysisMetrics] = None) -> Optional[Dict]:
+        """Extrae el análisis de la tool call o, en su defecto, del contenido del mensaje"""
+        # Extraer y loguear la respuesta cruda
+        message = response.choices[0].message
+        raw_content = message.content or ""
+        logger.debug("GPT-5 raw message.content (first 500 chars): %s", (raw_content[:500] + '...') if len(raw_content) > 500 else raw_content)
+        tool_calls = getattr(message, "tool_calls", None) or []
+        if tool_calls:
+            try:
+                tool_args = tool_calls[0].function.arguments
+                logger.debug("GPT-5 tool_call name=%s args_snippet=%s", tool_calls[0].function.name, (tool_args[:500] + '...') if len(tool_args) > 500 else tool_args)
+            except Exception:
+                logger.debug("GPT-5 tool_call present but arguments could not be logged")
+        
+        # Extraer argumentos de la tool call y, si no sirven, el contenido del mensaje
+        analysis_data = None
+        if tool_calls:
+            analysis_data = self._parse_analysis_text(tool_calls[0].function.arguments or "", metrics)
+        
+        if not analysis_data:
+            logger.debug("Fallback to content parsing (first 500 chars): %s", (raw_content[:500] + '...') if len(raw_content) > 500 else raw_content)
+            analysis_data = self._parse_analysis_text(raw_content, metrics)
+        
+        return analysis_data
+    
+    def _extract_retry_analysis(self, retry) -> Dict:
+        """Extrae el análisis de la respuesta del reintento con response_format=json_object"""
+        retry_text = retry.choices[0].message.content or ""
+        logger.debug("Retry raw content (first 500 chars): %s", (retry_text[:500] + '...') if len(retry_text) > 500 else retry_text)
+        analysis_data, _ = parse_food_analysis(retry_text)
+        if analysis_data is None:
+            logger.error("La respuesta del reintento tampoco contiene un análisis válido")
+            raise InvalidAnalysisResponse()
+        return analysis_data
+    
+    def _parse_analysis_text(self, text: str, metrics: Optional[AnalysisMetrics] = None) -> Optional[Dict]:
+        """
+        Parsea y valida el JSON del análisis. Si está mal formado (comas de más, respuesta
+        truncada, números como texto...) se repara localmente en vez de pagar el reintento.
+        """
+        analysis_data, repaired = parse_food_analysis(text)
+        if repaired:
+            logger.info("JSON del análisis reparado localmente; se evita la llamada de fallback")
+            if metrics is not None:
+                metrics.json_repaired = True
+        return analysis_data
     
-    def save_analysis_to_database(self, food_image: FoodImage, analysis_data: Dict) -> OpenAIAnalysis:
-        """Guarda el análisis de OpenAI en la base de datos"""
+    def save_analysis_to_database(self, food_image: FoodImage, analysis_data: Dict,
+                                  metrics: Optional[AnalysisMetrics] = None) -> OpenAIAnalysis:
+        """Guarda el análisis de OpenAI en la base de datos, con sus métricas si se proporcionan"""
         try:
             # Crear registro de análisis
-            analysis = OpenAIAnalysis.objects.create(
-                image=food_image,
-                prompt_sent=analysis_data.get('prompt', ''),
-                response_received=json.dumps(analysis_data),
-                identified_foods=analysis_data.get('foods', []),
-                calculated_calories=analysis_data.get('total_calories', 0),
-                confidence_score=analysis_data.get('analysis_confidence', 0.0)
-            )
+            if metrics is None:
+                analysis = OpenAIAnalysis.objects.create(**self._analysis_fields(food_image, analysis_data))
+            else:
+                with metrics.stage('db'):
+                    analysis = OpenAIAnalysis.objects.create(**self._analysis_fields(food_image, analysis_data, metrics))
+                # El tiempo de BD solo se conoce tras el INSERT: se completa con un UPDATE de dos columnas
+                OpenAIAnalysis.objects.filter(pk=analysis.pk).update(**self._timing_fields(analysis, metrics))
             
             logger.info(f"Análisis guardado para imagen {food_image.id}")
             return analysis
@@ -245,6 +599,31 @@ class OpenAIService:
             logger.error(f"Error guardando análisis en BD: {e}")
             raise
     
+    def _analysis_fields(self, food_image: FoodImage, analysis_data: Dict,
+                         metrics: Optional[AnalysisMetrics] = None) -> Dict:
+        """Campos del registro OpenAIAnalysis a partir del análisis"""
+        tier = get_tier(metrics.routing_tier) if metrics is not None else None
+        prompt = ANALYSIS_PROMPT_COMPACT if tier is not None and tier.compact_prompt else ANALYSIS_PROMPT
+        fields = {
+            'image': food_image,
+            'prompt_sent': prompt.strip(),
+            'response_received': json.dumps(analysis_data),
+            'identified_foods': analysis_data.get('foods', []),
+            'calculated_calories': analysis_data.get('total_calories', 0),
+            'confidence_score': analysis_data.get('analysis_confidence', 0.0)
+        }
+        if metrics is not None:
+            fields.update(metrics.model_fields())
+        return fields
+    
+    @staticmethod
+    def _timing_fields(analysis: OpenAIAnalysis, metrics: AnalysisMetrics) -> Dict:
+        """Tiempos finales (con el de BD) que se asignan al análisis recién creado y se guardan con un UPDATE"""
+        fields = {'stage_timings': dict(metrics.stage_timings), 'total_latency_ms': metrics.total_latency_ms}
+        for name, value in fields.items():
+            setattr(analysis, name, value)
+        return fields
+    
     def get_food_suggestions(self, food_name: str) -> List[Dict]:
         """Obtiene sugerencias de alimentos basadas en el nombre"""
         try:
@@ -293,10 +672,12 @@ class FoodAnalysisService:
         """
         try:
             # Analizar imagen con OpenAI
-            analysis_data = self.openai_service.analyze_food_image(food_image.image.path)
+            analysis_data, metrics = self.openai_service.analyze_food_image_with_metrics(
+                food_image.image, food_image.user_id, getattr(food_image, 'upload', None)
+            )
             
             # Guardar análisis en BD
-            analysis = self.openai_service.save_analysis_to_database(food_image, analysis_data)
+            analysis = self.openai_service.save_analysis_to_database(food_image, analysis_data, metrics)
             
             # Procesar datos para la UI
             processed_data = self._process_analysis_for_ui(analysis_data)
@@ -307,6 +688,240 @@ class FoodAnalysisService:
             logger.error(f"Error en análisis completo: {e}")
             raise
     
+    def analyze_many_and_save(self, food_images: List[FoodImage]) -> Tuple[List[OpenAIAnalysis], Dict]:
+        """
+        Analiza varias fotos de una misma comida en paralelo (con límite de concurrencia)
+        y combina los resultados. El tiempo total se aproxima al de la foto más lenta.
+        Retorna los análisis guardados y los datos procesados combinados.
+        """
+        # Las fotos repetidas del lote (ráfagas, la misma foto dos veces) no se analizan ni se suman
+        duplicates = self._duplicate_frames(food_images)
+        max_workers = max(1, min(len(food_images), settings.MULTI_IMAGE_MAX_PARALLEL))
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='meal-images') as executor:
+            futures = [
+                None if index in duplicates else executor.submit(self._analyze_in_thread, food_image)
+                for index, food_image in enumerate(food_images)
+            ]
+            outcomes = []
+            for future in futures:
+                if future is None:
+                    outcomes.append((None, None))
+                    continue
+                try:
+                    outcomes.append((future.result(), None))
+                except Exception as e:
+                    outcomes.append((None, e))
+
+        # Guardar en el hilo de la petición
+        successful = self._batch_successes(food_images, duplicates, outcomes)
+        saved = {
+            index: self.openai_service.save_analysis_to_database(food_images[index], analysis_data, metrics)
+            for index, analysis_data, metrics in successful
+        }
+        analyses = list(saved.values())
+
+        # La comida se guarda con la foto del primer análisis: las demás quedan enlazadas a ella
+        self._extra_images(food_images, analyses[0]).update(primary_image_id=analyses[0].image_id)
+
+        return analyses, self._batch_result(food_images, duplicates, outcomes, saved)
+    
+    @staticmethod
+    def _batch_successes(food_images: List[FoodImage], duplicates: Dict[int, int],
+                         outcomes: List[Tuple[Optional[Tuple[Dict, AnalysisMetrics]], Optional[BaseException]]]
+                         ) -> List[Tuple[int, Dict, AnalysisMetrics]]:
+        """
+        Fotos del lote analizadas con éxito: (posición, análisis, métricas). `outcomes` tiene un
+        (resultado, error) por foto. Si ninguna se pudo analizar se lanza el error de la primera.
+        """
+        successful = []
+        for index, (result, error) in enumerate(outcomes):
+            if index in duplicates:
+                continue
+            if error is not None:
+                logger.error(f"Error analizando foto {index + 1} de la comida: {error}")
+            else:
+                successful.append((index, *result))
+        if not successful:
+            # Si todas fallaron por el proveedor (timeout, breaker abierto...) se propaga ese error
+            if isinstance(outcomes[0][1], AnalysisError):
+                raise outcomes[0][1]
+            raise ValueError('No se pudo analizar ninguna de las imágenes')
+        return successful
+    
+    def _batch_result(self, food_images: List[FoodImage], duplicates: Dict[int, int],
+                      outcomes: List[Tuple[Optional[Tuple[Dict, AnalysisMetrics]], Optional[BaseException]]],
+                      saved: Dict[int, OpenAIAnalysis]) -> Dict:
+        """Resultado combinado del lote, con el origen de cada alimento y el estado de cada foto"""
+        successful = []
+        provenance = []
+        for index, (food_image, (result, error)) in enumerate(zip(food_images, outcomes)):
+            entry = {'index': index, 'image_id': food_image.id, 'original_name': food_image.original_name}
+            if index in duplicates:
+                entry['duplicate_of'] = duplicates[index]
+            elif error is not None:
+                entry['error'] = str(error)
+            else:
+                analysis_data, _ = result
+                successful.append((index, analysis_data))
+                entry.update({
+                    'analysis_id': saved[index].id,
+                    'food_count': len(analysis_data.get('foods', [])),
+                    'total_calories': analysis_data.get('total_calories', 0),
+                })
+            provenance.append(entry)
+
+        merged = merge_analyses(successful)
+        processed_data = self._process_analysis_for_ui(merged)
+        for processed_food, merged_food in zip(processed_data['foods'], merged['foods']):
+            processed_food['sources'] = merged_food['sources']
+        processed_data['images'] = provenance
+        return processed_data
+    
+    @staticmethod
+    def _extra_images(food_images: List[FoodImage], primary: OpenAIAnalysis):
+        """Fotos del lote distintas de la principal (la del análisis que se asocia a la comida)"""
+        return FoodImage.objects.filter(id__in=[
+            food_image.id for food_image in food_images if food_image.id != primary.image_id
+        ])
+    
+    def suggest_repeat_meal(self, food_image: FoodImage) -> Optional[Tuple[OpenAIAnalysis, Dict]]:
+        """
+        Si la foto se parece a una comida anterior del usuario, copia aquel análisis para esta
+        imagen sin llamar a la API. Retorna el análisis guardado y el resultado con el formato
+        de la API mejorada más 'repeat_of', o None si no hay ninguna comida parecida.
+        """
+        metrics = AnalysisMetrics()
+        with metrics.stage('cache'):
+            match = find_repeat_meal(food_image)
+        if match is None:
+            return None
+        previous, distance = match
+        metrics.cache_hit = True
+        analysis_data = json.loads(previous.response_received)
+        with metrics.stage('db'):
+            analysis = OpenAIAnalysis.objects.create(
+                **self.openai_service._analysis_fields(food_image, analysis_data, metrics),
+                repeated_from=previous
+            )
+        logger.info(f"Imagen {food_image.id} parecida al análisis {previous.id} (distancia {distance}): se sugiere repetir la comida")
+        result = self._stream_result(analysis, self._process_analysis_for_ui(analysis_data))
+        result['repeat_of'] = self._repeat_info(previous, distance)
+        return analysis, result
+    
+    @staticmethod
+    def _repeat_info(previous: OpenAIAnalysis, distance: int) -> Dict:
+        return {
+            'analysis_id': previous.id,
+            'created_at': previous.created_at.isoformat(),
+            'distance': distance,
+        }
+    
+    @staticmethod
+    def _duplicate_frames(food_images: List[FoodImage]) -> Dict[int, int]:
+        """Posición de cada foto repetida del lote -> posición de la primera foto igual (hash perceptual)"""
+        duplicates = {}
+        originals = []
+        for index, food_image in enumerate(food_images):
+            if not food_image.perceptual_hash:
+                continue
+            value = int(food_image.perceptual_hash, 16)
+            for original_index, original_value in originals:
+                if hamming_distance(value, original_value) <= settings.IMAGE_SCREEN_DUPLICATE_DISTANCE:
+                    duplicates[index] = original_index
+                    break
+            else:
+                originals.append((index, value))
+        return duplicates
+    
+    def stream_analyze_and_save(self, food_image: FoodImage, suggest_repeat: bool = False) -> Iterator[Tuple[str, Dict]]:
+        """
+        Versión en streaming de analyze_and_save.
+        Emite ('item', item) por cada alimento en cuanto llega y ('done', resultado) tras guardar,
+        con el mismo formato que la API de análisis mejorada. Si el análisis escala a otro
+        nivel de modelo se emite ('reset', {'tier': nivel}) y los alimentos previos se descartan.
+        Con suggest_repeat, una comida repetida se resuelve sin llamar a la API.
+        """
+        if suggest_repeat:
+            suggestion = self.suggest_repeat_meal(food_image)
+            if suggestion is not None:
+                yield from self._suggestion_events(suggestion)
+                return
+        
+        for event, payload in self.openai_service.stream_food_analysis(
+            food_image.image, food_image.user_id, getattr(food_image, 'upload', None)
+        ):
+            if event == 'item':
+                yield 'item', self._stream_item(payload)
+                continue
+            if event == 'reset':
+                yield 'reset', payload
+                continue
+            analysis_data, metrics = payload
+            analysis = self.openai_service.save_analysis_to_database(food_image, analysis_data, metrics)
+            yield 'done', self._stream_result(analysis, self._process_analysis_for_ui(analysis_data))
+    
+    def reanalyze(self, analysis: OpenAIAnalysis) -> Tuple[OpenAIAnalysis, Dict]:
+        """
+        Sustituye un análisis (p. ej. una comida repetida sugerida) por un análisis completo de la
+        misma imagen. Se analiza primero y sin caché (que devolvería el mismo resultado); las filas
+        se cambian después en una transacción, así que si el análisis falla se conserva el anterior.
+        """
+        food_image = analysis.image
+        analysis_data, metrics = self.openai_service.analyze_food_image_with_metrics(
+            food_image.image, food_image.user_id, use_cache=False
+        )
+        with transaction.atomic():
+            analysis.delete()
+            new_analysis = self.openai_service.save_analysis_to_database(food_image, analysis_data, metrics)
+        return new_analysis, self._process_analysis_for_ui(analysis_data)
+    
+    @staticmethod
+    def _suggestion_events(suggestion: Tuple[OpenAIAnalysis, Dict]) -> List[Tuple[str, Dict]]:
+        """Eventos de una comida repetida: sus alimentos de una vez y el resultado final"""
+        _, result = suggestion
+        return [('item', item) for item in result['items']] + [('done', result)]
+    
+    def _stream_item(self, food: Dict) -> Dict:
+        """Evento de un alimento recibido por el stream, con el formato de los items del resultado"""
+        return self.format_items(self._process_analysis_for_ui({'foods': [food]}))[0]
+    
+    def _stream_result(self, analysis: OpenAIAnalysis, processed_data: Dict) -> Dict:
+        """Evento final del análisis en streaming"""
+        return {
+            'success': True,
+            'analysis_id': analysis.id,
+            'items': self.format_items(processed_data),
+            'total_calories': processed_data.get('total_calories', 0),
+            'analysis_confidence': processed_data.get('analysis_confidence', 0.5),
+            'warnings': analysis.screening_warnings
+        }
+    
+    def _analyze_in_thread(self, food_image: FoodImage) -> Tuple[Dict, AnalysisMetrics]:
+        """Analiza una imagen desde un hilo del pool, cerrando su conexión a BD al terminar"""
+        try:
+            return self.openai_service.analyze_food_image_with_metrics(
+                food_image.image, food_image.user_id, getattr(food_image, 'upload', None)
+            )
+        finally:
+            connections.close_all()
+    
+    @staticmethod
+    def format_items(processed_data: Dict) -> List[Dict]:
+        """Formatea los alimentos procesados como items editables para el cliente"""
+        items = []
+        for food_data in processed_data.get('foods', []):
+            items.append({
+                'type': 'food',
+                'name': food_data.get('name', 'Alimento desconocido'),
+                'quantity': food_data.get('quantity', food_data.get('estimated_grams', 0)),
+                'unit': 'g',
+                'calories': food_data.get('calories', 0),
+                'confidence': food_data.get('confidence', 0.5)
+            })
+            if 'sources' in food_data:
+                items[-1]['sources'] = food_data['sources']
+        return items
+    
     def _process_analysis_for_ui(self, analysis_data: Dict) -> Dict:
         """Procesa los datos del análisis para la interfaz de usuario"""
         try:
@@ -337,10 +952,10 @@ class FoodAnalysisService:
             
             total_grams = sum(food.get('estimated_grams', 0) for food in foods)
             
-            # Agrupar por categorías
+            # Agrupar por categorías (un solo recorrido para todos los nombres)
             categories = {}
-            for food in foods:
-                category = self._categorize_food(food.get('name', ''))
+            food_categories = get_categorizer().categorize_many([food.get('name', '') for food in foods])
+            for food, category in zip(foods, food_categories):
                 if category not in categories:
                     categories[category] = []
                 categories[category].append(food)
@@ -368,23 +983,5 @@ class FoodAnalysisService:
             }
     
     def _categorize_food(self, food_name: str) -> str:
-        """Categoriza un alimento basándose en su nombre"""
-        food_name_lower = food_name.lower()
-        
-        # Mapeo de categorías
-        category_mapping = {
-            'frutas': ['manzana', 'plátano', 'naranja', 'fresa', 'uva', 'pera', 'piña', 'mango'],
-            'verduras': ['lechuga', 'tomate', 'zanahoria', 'brócoli', 'espinaca', 'cebolla', 'pimiento'],
-            'carnes': ['pollo', 'res', 'cerdo', 'pavo', 'cordero', 'ternera'],
-            'pescados': ['salmón', 'atún', 'bacalao', 'trucha', 'merluza'],
-            'lácteos': ['leche', 'queso', 'yogur', 'mantequilla', 'crema'],
-            'cereales': ['arroz', 'pasta', 'pan', 'avena', 'trigo', 'maíz'],
-            'legumbres': ['frijol', 'lenteja', 'garbanzo', 'haba', 'guisante'],
-            'frutos secos': ['almendra', 'nuez', 'cacahuete', 'avellana', 'pistacho'],
-        }
-        
-        for category, keywords in category_mapping.items():
-            if any(keyword in food_name_lower for keyword in keywords):
-                return category
-        
-        return 'otros' 
\ No newline at end of file
+        """Categoriza un alimento basándose en su nombre (palabras clave de FoodCategoryKeyword)"""
+        return get_categorizer().categorize(food_name)
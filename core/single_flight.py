@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from .resilience import AnalysisTimeout
+
+logger = logging.getLogger(__name__)
+
+# Vuelos en curso de este proceso: los hilos esperan al líder con un Event, sin consultar la caché
+_flights_lock = threading.Lock()
+_flights: Dict[str, '_LocalFlight'] = {}
+
+
+class _LocalFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[Dict] = None
+
+
+class Flight:
+    """
+    Liderazgo de un análisis en curso. El líder publica el resultado con publish();
+    al salir del bloque `with` sin publicarlo (error o stream cortado) se libera el
+    turno y el siguiente en espera pasa a ser líder.
+    """
+
+    def __init__(self, group: 'SingleFlight', key: str, local: _LocalFlight, token: Optional[str]):
+        self.group = group
+        self.key = key
+        self.local = local
+        self.token = token
+        self.published = False
+
+    def publish(self, result: Dict):
+        if self.group.enabled:
+            try:
+                cache.set(self.group.result_key(self.key), result, timeout=self.group.result_ttl)
+            except Exception as e:
+                logger.warning(f"Single-flight sin caché: {e}")
+        self.local.result = result
+        self.published = True
+        self._finish()
+
+    def _finish(self):
+        # El resultado se guarda antes de soltar el lock: quien vea el lock libre ya encuentra el resultado
+        if self.token is not None:
+            try:
+                if cache.get(self.group.lock_key(self.key)) == self.token:
+                    cache.delete(self.group.lock_key(self.key))
+            except Exception as e:
+                logger.warning(f"Single-flight sin caché: {e}")
+        with _flights_lock:
+            if _flights.get(self.key) is self.local:
+                del _flights[self.key]
+        self.local.done.set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if not self.published:
+            self._finish()
+        return False
+
+    async def apublish(self, result: Dict):
+        await sync_to_async(self.publish)(result)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        if not self.published:
+            await sync_to_async(self._finish)()
+        return False
+
+
+class SingleFlight:
+    """
+    Deduplicación de análisis idénticos en curso, entre hilos y entre procesos.
+    El primero en pedir una clave la lidera (lock en la caché de Django, con caducidad para
+    que un worker caído no la retenga); los demás esperan y reciben su resultado, que además
+    se conserva `result_ttl` segundos para absorber los reintentos que llegan justo después.
+    Si la caché no está disponible, cada petición hace su propio análisis.
+    """
+
+    POLL_INTERVAL = 0.2
+
+    def __init__(self, namespace: str, lease_seconds: float, result_ttl: float, enabled: bool = True):
+        self.namespace = namespace
+        self.lease_seconds = lease_seconds
+        self.result_ttl = result_ttl
+        self.enabled = enabled
+
+    def lock_key(self, key: str) -> str:
+        return f'singleflight:{self.namespace}:lock:{key}'
+
+    def result_key(self, key: str) -> str:
+        return f'singleflight:{self.namespace}:result:{key}'
+
+    def _try_lead(self, key: str) -> Tuple[Optional[Dict], Optional[Flight], Optional[_LocalFlight]]:
+        """Un paso de join(): (resultado reciente, None, None), (None, vuelo propio, None) o (None, None, vuelo local ajeno)"""
+        with _flights_lock:
+            local = _flights.get(key)
+            if local is not None:
+                return None, None, local
+            try:
+                shared = cache.get(self.result_key(key))
+                if shared is not None:
+                    return shared, None, None
+                token = uuid.uuid4().hex
+                if not cache.add(self.lock_key(key), token, timeout=self.lease_seconds):
+                    return None, None, None
+            except Exception as e:
+                logger.warning(f"Single-flight sin caché: {e}")
+                token = None
+            local = _flights[key] = _LocalFlight()
+            return None, Flight(self, key, local, token), None
+
+    def _remote_result(self, key: str) -> Tuple[Optional[Dict], bool]:
+        """(resultado publicado, el líder de otro proceso sigue en curso)"""
+        try:
+            shared = cache.get(self.result_key(key))
+            if shared is not None:
+                return shared, False
+            return None, cache.get(self.lock_key(key)) is not None
+        except Exception:
+            return None, False
+
+    def join(self, key: str) -> Tuple[Optional[Dict], Optional[Flight]]:
+        """
+        Retorna (resultado, None) si otra petición ya analizó o está analizando la misma clave,
+        o (None, vuelo) si esta petición pasa a liderar: debe usarlo en un bloque `with` y
+        llamar a publish() con el resultado.
+        """
+        if not self.enabled:
+            return None, Flight(self, key, _LocalFlight(), None)
+        give_up_at = time.monotonic() + self.lease_seconds
+        while True:
+            shared, flight, local = self._try_lead(key)
+            if shared is not None or flight is not None:
+                return shared, flight
+            if local is not None:
+                local.done.wait(max(0.0, give_up_at - time.monotonic()))
+                if local.result is not None:
+                    return local.result, None
+            else:
+                shared, running = self._remote_result(key)
+                if shared is not None:
+                    return shared, None
+                if running:
+                    time.sleep(self.POLL_INTERVAL)
+            if time.monotonic() >= give_up_at:
+                raise AnalysisTimeout()
+
+    async def ajoin(self, key: str) -> Tuple[Optional[Dict], Optional[Flight]]:
+        """Versión asíncrona de join: la espera no bloquea el event loop"""
+        if not self.enabled:
+            return None, Flight(self, key, _LocalFlight(), None)
+        give_up_at = time.monotonic() + self.lease_seconds
+        while True:
+            shared, flight, local = await sync_to_async(self._try_lead)(key)
+            if shared is not None or flight is not None:
+                return shared, flight
+            if local is not None:
+                while not local.done.is_set() and time.monotonic() < give_up_at:
+                    await asyncio.sleep(self.POLL_INTERVAL)
+                if local.result is not None:
+                    return local.result, None
+            else:
+                shared, running = await sync_to_async(self._remote_result)(key)
+                if shared is not None:
+                    return shared, None
+                if running:
+                    await asyncio.sleep(self.POLL_INTERVAL)
+            if time.monotonic() >= give_up_at:
+                raise AnalysisTimeout()
+
+    def run(self, key: str, func: Callable[[], Dict]) -> Tuple[Any, bool]:
+        """Ejecuta func() una sola vez por clave en curso. Retorna (resultado, compartido)"""
+        shared, flight = self.join(key)
+        if flight is None:
+            return shared, True
+        with flight:
+            result = func()
+            flight.publish(result)
+        return result, False
+
+
+def analysis_single_flight() -> SingleFlight:
+    """Single-flight de los análisis con la configuración de settings"""
+    return SingleFlight(
+        'analysis',
+        lease_seconds=settings.ANALYSIS_DEADLINE_SECONDS + settings.ANALYSIS_SLOT_LEASE_MARGIN,
+        result_ttl=settings.SINGLE_FLIGHT_RESULT_TTL,
+        enabled=settings.SINGLE_FLIGHT_ENABLED,
+    )
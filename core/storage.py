@@ -0,0 +1,130 @@
+import hashlib
+import os
+import tempfile
+import time
+from typing import Dict, Iterator, Tuple
+
+from django.conf import settings
+from django.core import signing
+from django.core.files.storage import FileSystemStorage
+from django.urls import reverse
+from django.utils.deconstruct import deconstructible
+
+# Carpeta de los archivos direccionados por contenido dentro de MEDIA_ROOT
+BLOB_PREFIX = 'food_images'
+
+EXTENSION_ALIASES = {'.jpeg': '.jpg', '.jpe': '.jpg'}
+
+# Firma de los POST prefirmados del almacenamiento local (ver api_local_direct_upload)
+LOCAL_UPLOAD_SALT = 'core.storage.local_upload'
+
+
+def file_sha256(file) -> str:
+    """SHA-256 en hexadecimal de un File de Django, leído por bloques"""
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def blob_name(content_hash: str, original_name: str = '') -> str:
+    """Ruta derivada del hash: food_images/ab/cd/abcd...ef.jpg"""
+    extension = os.path.splitext(original_name)[1].lower()
+    extension = EXTENSION_ALIASES.get(extension, extension)
+    return f'{BLOB_PREFIX}/{content_hash[:2]}/{content_hash[2:4]}/{content_hash}{extension}'
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Almacenamiento de archivos cuyo nombre sale del hash de su contenido (ver blob_name):
+    si el nombre ya existe tiene exactamente esos bytes, así que no se vuelve a escribir ni
+    se le añade sufijo. Las escrituras van a un temporal que se renombra, para que nadie lea
+    un archivo a medias. Los archivos anteriores, con nombre por fecha, se siguen leyendo igual.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        if self.exists(name):
+            # Reutilizarlo lo marca como reciente: collect_media_garbage no borra archivos recientes
+            os.utime(self.path(name))
+            return name
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        if self.directory_permissions_mode is not None:
+            os.chmod(directory, self.directory_permissions_mode)
+        descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        try:
+            with os.fdopen(descriptor, 'wb') as temp_file:
+                for chunk in content.chunks():
+                    temp_file.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(temp_path, self.file_permissions_mode)
+            os.replace(temp_path, full_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return name
+
+    def iter_files(self, prefix: str) -> Iterator[Tuple[str, int, float]]:
+        """
+        (nombre, bytes, mtime) de cada archivo bajo `prefix`. Recorre el disco con os.scandir sin
+        construir listados: solo se guarda la pila de carpetas pendientes.
+        """
+        pending = [self.path(prefix)]
+        while pending:
+            directory = pending.pop()
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            stat = entry.stat(follow_symlinks=False)
+                            name = os.path.relpath(entry.path, self.location).replace(os.sep, '/')
+                            yield name, stat.st_size, stat.st_mtime
+            except FileNotFoundError:
+                continue
+
+    def presigned_post(self, name: str, content_type: str, max_bytes: int, expires_in: int) -> Dict:
+        """
+        Equivalente local del POST prefirmado de S3, para desarrollo y pruebas: mismo formato
+        de respuesta, pero el formulario va a api_local_direct_upload con los datos firmados.
+        """
+        grant = {
+            'name': name,
+            'content_type': content_type,
+            'max_bytes': max_bytes,
+            'expires': int(time.time()) + expires_in,
+        }
+        return {
+            'url': reverse('core:api_local_direct_upload'),
+            'fields': {
+                'key': name,
+                'Content-Type': content_type,
+                'policy': signing.dumps(grant, salt=LOCAL_UPLOAD_SALT),
+            },
+        }
+
+
+_food_image_storage = None
+
+
+def food_image_storage():
+    """
+    Almacenamiento de FoodImage.image según FOOD_IMAGE_STORAGE: disco local o S3 (callable
+    para que las migraciones no dependan de la configuración)
+    """
+    global _food_image_storage
+    if _food_image_storage is None:
+        if settings.FOOD_IMAGE_STORAGE == 's3':
+            # Solo se importa con S3: django-storages y boto3 no hacen falta en local
+            from .s3_storage import ContentAddressedS3Storage
+            _food_image_storage = ContentAddressedS3Storage()
+        else:
+            _food_image_storage = ContentAddressedStorage()
+    return _food_image_storage
@@ -0,0 +1,101 @@
+import json
+import logging
+from typing import Dict, List, Optional
+
+from .json_repair import coerce_food_item
+
+logger = logging.getLogger(__name__)
+
+
+def sse_event(event: str, data: Dict) -> str:
+    """Formatea un evento Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class FoodItemStreamParser:
+    """
+    Parser incremental de los argumentos JSON de 'return_food_analysis'.
+    Recibe los fragmentos tal como llegan del stream y retorna cada objeto del
+    array "foods" en cuanto se cierra, sin esperar al resto de la respuesta.
+    Cada fragmento se recorre una sola vez: del texto ya recorrido solo se conserva
+    lo que aún hace falta (el alimento o la clave sin cerrar).
+    """
+
+    def __init__(self):
+        self._chunks: List[str] = []
+        self._tail = ''
+        self._tail_start = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._string_start = 0
+        self._last_key: Optional[str] = None
+        self._in_foods = False
+        self._item_start: Optional[int] = None
+
+    @property
+    def text(self) -> str:
+        """Texto completo recibido hasta ahora"""
+        if len(self._chunks) > 1:
+            self._chunks = [''.join(self._chunks)]
+        return self._chunks[0] if self._chunks else ''
+
+    def feed(self, chunk: str) -> List[Dict]:
+        """Añade un fragmento y retorna los alimentos completados con él"""
+        self._chunks.append(chunk)
+        completed = []
+        # Posiciones absolutas en el texto completo; text[0] es la posición _tail_start
+        text = self._tail + chunk
+        offset = self._tail_start
+
+        for position in range(offset + len(self._tail), offset + len(text)):
+            char = text[position - offset]
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        # En el objeto raíz las cadenas son claves o valores simples
+                        self._last_key = text[self._string_start + 1 - offset:position - offset]
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = position
+            elif char in '{[':
+                self._depth += 1
+                if char == '[' and self._depth == 2 and self._last_key == 'foods':
+                    self._in_foods = True
+                elif char == '{' and self._depth == 3 and self._in_foods:
+                    self._item_start = position
+            elif char in '}]':
+                if char == '}' and self._depth == 3 and self._item_start is not None:
+                    item = self._load_item(text[self._item_start - offset:position + 1 - offset])
+                    if item is not None:
+                        completed.append(item)
+                    self._item_start = None
+                elif char == ']' and self._depth == 2:
+                    self._in_foods = False
+                self._depth -= 1
+
+        if self._item_start is not None:
+            keep_from = self._item_start
+        elif self._in_string and self._depth == 1:
+            keep_from = self._string_start
+        else:
+            keep_from = offset + len(text)
+        self._tail = text[keep_from - offset:]
+        self._tail_start = keep_from
+        return completed
+
+    def _load_item(self, item_text: str) -> Optional[Dict]:
+        try:
+            item = json.loads(item_text)
+        except ValueError as e:
+            logger.debug("Alimento incompleto en el stream: %s", e)
+            return None
+        return coerce_food_item(item)
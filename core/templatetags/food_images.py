@@ -0,0 +1,51 @@
+from django import template
+from django.conf import settings
+from django.forms.utils import flatatt
+from django.urls import reverse
+from django.utils.html import format_html
+
+from core.renditions import rendition_sides
+
+register = template.Library()
+
+
+def _srcset(food_image, renditions, image_format: str) -> str:
+    """
+    Candidatos de una foto en un formato. Las versiones que aún no existen apuntan a
+    food_image_rendition, que las genera al pedirlas, con su lado máximo como ancho.
+    """
+    candidates = []
+    for kind, side in rendition_sides().items():
+        rendition = renditions.get((kind, image_format))
+        if rendition is not None:
+            candidates.append(f'{food_image.image.storage.url(rendition.name)} {rendition.width}w')
+        else:
+            url = reverse('core:food_image_rendition', args=[food_image.id, kind, image_format])
+            candidates.append(f'{url} {side}w')
+    return ', '.join(candidates)
+
+
+@register.simple_tag
+def food_picture(food_image, sizes='100vw', **attrs):
+    """
+    <picture> con WebP y JPEG en varios tamaños para que el navegador descargue la versión
+    más pequeña que le sirva según `sizes`. Los demás argumentos son atributos del <img>.
+    Uso: {% food_picture meal.image sizes="64px" class="rounded" alt="Comida" %}
+    """
+    attrs.setdefault('loading', 'lazy')
+    attrs.setdefault('decoding', 'async')
+    if not settings.IMAGE_RENDITIONS_ENABLED:
+        return format_html('<img src="{}"{}>', food_image.image.url, flatatt(attrs))
+
+    # renditions.all() aprovecha prefetch_related('image__renditions') en los listados
+    renditions = {(rendition.kind, rendition.format): rendition for rendition in food_image.renditions.all()}
+    fallback = renditions.get(('medium', 'jpeg'))
+    src = (
+        food_image.image.storage.url(fallback.name) if fallback is not None
+        else reverse('core:food_image_rendition', args=[food_image.id, 'medium', 'jpeg'])
+    )
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}"><img src="{}" srcset="{}" sizes="{}"{}></picture>',
+        _srcset(food_image, renditions, 'webp'), sizes,
+        src, _srcset(food_image, renditions, 'jpeg'), sizes, flatatt(attrs),
+    )
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+
+from core.services import analysis_version
+
+
+class AnalysisVersionTests(SimpleTestCase):
+    def tiers_with(self, **changes):
+        return [*settings.ANALYSIS_MODEL_TIERS[:-1], {**settings.ANALYSIS_MODEL_TIERS[-1], **changes}]
+
+    def test_changes_with_tier_config(self):
+        current = analysis_version()
+        for changes in ({'model': 'otro-modelo'}, {'detail': 'low'}, {'compact_prompt': True}):
+            with self.subTest(changes=changes), override_settings(ANALYSIS_MODEL_TIERS=self.tiers_with(**changes)):
+                self.assertNotEqual(analysis_version(), current)
+        with override_settings(ANALYSIS_ROUTING_ENABLED=not settings.ANALYSIS_ROUTING_ENABLED):
+            self.assertNotEqual(analysis_version(), current)
+
+    def test_tier_name_does_not_matter(self):
+        current = analysis_version()
+        with override_settings(ANALYSIS_MODEL_TIERS=self.tiers_with(name='completo')):
+            self.assertEqual(analysis_version(), current)
@@ -0,0 +1,63 @@
+from importlib import import_module
+
+from django.test import SimpleTestCase
+
+from core.categorizer import DEFAULT_CATEGORY, FoodCategorizer, KeywordAutomaton
+
+CATEGORY_KEYWORDS = import_module('core.migrations.0007_seed_food_category_keywords').CATEGORY_KEYWORDS
+
+
+def seeded_categorizer() -> FoodCategorizer:
+    """Las palabras clave y prioridades que crea la migración 0007"""
+    return FoodCategorizer(
+        (keyword, name.lower(), (position + 1) * 10)
+        for position, (name, _, _, keywords) in enumerate(CATEGORY_KEYWORDS)
+        for keyword in keywords
+    )
+
+
+def legacy_categorize(food_name: str) -> str:
+    """El antiguo FoodAnalysisService._categorize_food: gana la primera categoría con alguna coincidencia"""
+    for name, _, _, keywords in CATEGORY_KEYWORDS:
+        if any(keyword in food_name.lower() for keyword in keywords):
+            return name.lower()
+    return DEFAULT_CATEGORY
+
+
+class KeywordAutomatonTests(SimpleTestCase):
+    def test_finds_overlapping_keywords_in_one_pass(self):
+        automaton = KeywordAutomaton([('he', 'a', 1), ('she', 'b', 1), ('hers', 'c', 1)])
+        matches = sorted((start, length, category) for start, length, category, _ in automaton.matches('ushers'))
+        self.assertEqual(matches, [(1, 3, 'b'), (2, 2, 'a'), (2, 4, 'c')])
+
+    def test_keywords_are_normalized(self):
+        automaton = KeywordAutomaton([('Salmón', 'pescados', 1), ('', 'vacía', 1)])
+        self.assertEqual(automaton.size, 1)
+        self.assertEqual([match[2] for match in automaton.matches('salmon')], ['pescados'])
+
+
+class FoodCategorizerTests(SimpleTestCase):
+    def setUp(self):
+        self.categorizer = seeded_categorizer()
+
+    def test_keywords_only_match_at_word_start(self):
+        self.assertEqual(self.categorizer.categorize('Fresas con nata'), 'frutas')
+        # 'res' dentro de 'fresco' no es carne
+        self.assertEqual(self.categorizer.categorize('queso fresco'), 'lácteos')
+        self.assertEqual(self.categorizer.categorize('zumo'), DEFAULT_CATEGORY)
+
+    def test_priority_follows_the_old_category_order(self):
+        for food_name in ['arroz con pollo', 'pan con queso', 'yogur con almendras', 'ensalada de atún y tomate',
+                          'pasta con salmón', 'lentejas con arroz', 'Plátano', 'Brócoli al vapor']:
+            with self.subTest(food_name=food_name):
+                self.assertEqual(self.categorizer.categorize(food_name), legacy_categorize(food_name))
+
+    def test_longest_keyword_wins_within_a_priority(self):
+        categorizer = FoodCategorizer([('pan', 'cereales', 10), ('panceta', 'carnes', 10)])
+        self.assertEqual(categorizer.categorize('panceta ahumada'), 'carnes')
+
+    def test_batch_keeps_names_apart(self):
+        self.assertEqual(
+            self.categorizer.categorize_many(['uva', '', 'pollo asado', 'agua']),
+            ['frutas', DEFAULT_CATEGORY, 'carnes', DEFAULT_CATEGORY],
+        )
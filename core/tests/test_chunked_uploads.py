@@ -0,0 +1,106 @@
+import io
+import shutil
+import tempfile
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from core.chunked_uploads import append_chunk, create_upload, finalize_upload, part_path
+from core.models import ChunkedUpload
+from core.resilience import ImageTooLarge, UploadOffsetMismatch
+
+
+def jpeg_bytes() -> bytes:
+    buffer = io.BytesIO()
+    Image.effect_noise((64, 64), 40).convert('RGB').save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+class ChunkedUploadTests(TestCase):
+    def setUp(self):
+        upload_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, upload_dir, ignore_errors=True)
+        settings_override = override_settings(CHUNKED_UPLOAD_DIR=upload_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create_user('subidas', password='x')
+        self.client.force_login(self.user)
+        self.data = jpeg_bytes()
+        self.half = len(self.data) // 2
+
+    def patch(self, upload, offset, data):
+        return self.client.generic(
+            'PATCH', reverse('core:api_chunked_upload', args=[upload.id]), data,
+            content_type='application/offset+octet-stream', HTTP_UPLOAD_OFFSET=str(offset),
+        )
+
+    def head(self, upload):
+        return self.client.head(reverse('core:api_chunked_upload', args=[upload.id]))
+
+    def test_resume_after_interruption(self):
+        upload = create_upload(self.user, len(self.data), 'comida.jpg')
+        self.assertEqual(self.patch(upload, 0, self.data[:self.half]).status_code, 204)
+
+        # La conexión se corta: el cliente pregunta cuántos bytes llegaron y sigue desde ahí
+        response = self.head(upload)
+        self.assertEqual(response['Upload-Offset'], str(self.half))
+        response = self.patch(upload, self.half, self.data[self.half:])
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response['Upload-Offset'], str(len(self.data)))
+
+        image_file = finalize_upload(ChunkedUpload.objects.get(id=upload.id))
+        self.assertEqual(image_file.content_type, 'image/jpeg')
+        self.assertFalse(ChunkedUpload.objects.filter(id=upload.id).exists())
+        self.assertFalse(part_path(upload).exists())
+
+    def test_patch_with_wrong_offset_is_rejected(self):
+        upload = create_upload(self.user, len(self.data), 'comida.jpg')
+        self.patch(upload, 0, self.data[:self.half])
+
+        # Una parte repetida (el cliente no vio la respuesta) o adelantada no se escribe
+        for offset in (0, self.half + 10):
+            with self.subTest(offset=offset):
+                response = self.patch(upload, offset, self.data[self.half:])
+                self.assertEqual(response.status_code, 409)
+                self.assertEqual(response['Upload-Offset'], str(self.half))
+        self.assertEqual(part_path(upload).read_bytes(), self.data[:self.half])
+
+    def test_stale_upload_object_cannot_write(self):
+        upload = create_upload(self.user, len(self.data), 'comida.jpg')
+        stale = ChunkedUpload.objects.get(id=upload.id)
+        append_chunk(upload, 0, self.data[:self.half])
+        # Otro PATCH que leyó la fila antes: con la fila bloqueada ve que el offset ya avanzó
+        with self.assertRaises(UploadOffsetMismatch):
+            append_chunk(stale, 0, self.data[:10])
+        self.assertEqual(part_path(upload).read_bytes(), self.data[:self.half])
+        self.assertEqual(ChunkedUpload.objects.get(id=upload.id).offset, self.half)
+
+    def test_chunk_larger_than_announced_length(self):
+        upload = create_upload(self.user, self.half, 'comida.jpg')
+        with self.assertRaises(ImageTooLarge):
+            append_chunk(upload, 0, self.data)
+
+    def test_not_an_image_is_rejected_on_first_chunk(self):
+        upload = create_upload(self.user, 100, 'comida.jpg')
+        self.assertEqual(self.patch(upload, 0, b'%PDF-1.4 no es una foto').status_code, 415)
+        self.assertFalse(ChunkedUpload.objects.filter(id=upload.id).exists())
+
+    def test_finalize_incomplete_upload_keeps_it(self):
+        upload = create_upload(self.user, len(self.data), 'comida.jpg')
+        append_chunk(upload, 0, self.data[:self.half])
+        with self.assertRaises(UploadOffsetMismatch):
+            finalize_upload(upload)
+        self.assertTrue(part_path(upload).exists())
+
+    def test_rejected_upload_does_not_spend_quota(self):
+        corrupt = self.data[:32] + bytes(len(self.data) - 32)
+        upload = create_upload(self.user, len(corrupt), 'comida.jpg')
+        append_chunk(upload, 0, corrupt)
+        with mock.patch('core.views.check_analysis_quota') as check_quota:
+            response = self.client.post(reverse('core:api_finalize_upload', args=[upload.id]))
+        self.assertEqual(response.json()['error_code'], 'image_rejected')
+        check_quota.assert_not_called()
+        self.assertFalse(ChunkedUpload.objects.filter(id=upload.id).exists())
@@ -0,0 +1,96 @@
+from django.test import SimpleTestCase, TestCase
+
+from core.food_matching import FoodIndex, invalidate_food_index, reconcile_food, same_food_words
+from core.models import Food, FoodCategory
+
+# Variantes con otras calorías que superan FOOD_MATCH_THRESHOLD frente al alimento base
+VARIANT_PAIRS = [
+    ('mayonesa light', 'mayonesa'),
+    ('yogur natural light', 'yogur natural'),
+    ('pan de queso frito', 'pan de queso'),
+    ('arroz con pollo y papas', 'arroz con pollo'),
+]
+SAME_FOOD_PAIRS = [
+    ('Arroz Blanco', 'arroz blanco'),
+    ('tomates', 'tomate'),
+    ('arros blanco', 'arroz blanco'),
+    ('pollo con arroz', 'arroz con pollo'),
+]
+
+
+class SameFoodWordsTests(SimpleTestCase):
+    def test_variants_are_different_foods(self):
+        for name, candidate in VARIANT_PAIRS:
+            with self.subTest(name=name):
+                self.assertFalse(same_food_words(name, candidate))
+                self.assertFalse(same_food_words(candidate, name))
+
+    def test_case_plurals_typos_and_word_order(self):
+        for name, candidate in SAME_FOOD_PAIRS:
+            with self.subTest(name=name):
+                self.assertTrue(same_food_words(name, candidate))
+
+    def test_short_words_must_match_exactly(self):
+        self.assertFalse(same_food_words('pan', 'papa'))
+
+
+class FoodIndexTests(SimpleTestCase):
+    def test_search_and_with_food(self):
+        index = FoodIndex([(1, 'arroz blanco'), (2, 'pollo asado')], dimensions=256)
+        self.assertEqual(index.search('Arroz  Blanco', k=1), [(1, 'arroz blanco', 1.0)])
+        extended = index.with_food(3, 'manzana verde')
+        self.assertEqual(len(index), 2)
+        self.assertEqual(extended.search('manzanas verdes', k=1)[0][:2], (3, 'manzana verde'))
+        self.assertEqual([food_id for food_id, _, _ in extended.search('pollo', k=3)][0], 2)
+
+    def test_with_food_grows_in_place_without_changing_older_versions(self):
+        versions = [FoodIndex([(1, 'arroz blanco')], dimensions=256)]
+        for food_id in range(2, 40):
+            versions.append(versions[-1].with_food(food_id, f'alimento {food_id}'))
+        latest = versions[-1]
+        self.assertEqual(len(latest), 39)
+        self.assertEqual(latest.search('alimento 39', k=1)[0][:2], (39, 'alimento 39'))
+        # Las versiones anteriores siguen viendo solo sus alimentos
+        self.assertEqual(len(versions[5]), 6)
+        self.assertEqual(versions[5].columns.shape, (256, 6))
+        self.assertNotIn(39, [food_id for food_id, _, _ in versions[5].search('alimento 39', k=6)])
+        self.assertLess(versions[5].search('alimento 39', k=1)[0][2], 1.0)
+
+    def test_with_food_on_an_older_version_does_not_overwrite_newer_ones(self):
+        # Tras el primer with_food las matrices tienen sitio: las dos ramas apuntan a la misma columna
+        index = FoodIndex([(1, 'arroz blanco')], dimensions=256).with_food(2, 'pan integral')
+        first = index.with_food(3, 'pollo asado')
+        second = index.with_food(4, 'manzana verde')
+        self.assertEqual(first.search('pollo asado', k=1)[0][:2], (3, 'pollo asado'))
+        self.assertEqual(second.search('manzana verde', k=1)[0][:2], (4, 'manzana verde'))
+        self.assertEqual(first.search('pollo asados', k=1)[0][:2], (3, 'pollo asado'))
+        self.assertEqual(list(first.ids), [1, 2, 3])
+        self.assertEqual(list(second.ids), [1, 2, 4])
+
+    def test_empty_index(self):
+        self.assertEqual(FoodIndex([], dimensions=64).search('arroz'), [])
+
+
+class ReconcileFoodTests(TestCase):
+    def setUp(self):
+        invalidate_food_index()
+        self.addCleanup(invalidate_food_index)
+        self.category = FoodCategory.objects.create(name='Pruebas')
+
+    def test_variant_guard(self):
+        for name, base in VARIANT_PAIRS:
+            with self.subTest(name=name):
+                base_food = Food.objects.create(name=base, category=self.category, calories_per_100g=100)
+                food, created, score = reconcile_food(name, 150)
+                self.assertTrue(created)
+                self.assertNotEqual(food, base_food)
+                self.assertGreaterEqual(score, 0.75)
+                # Una vez creada, la variante se reconcilia consigo misma
+                self.assertEqual(reconcile_food(name, 150)[:2], (food, False))
+
+    def test_same_food_is_reused(self):
+        food = Food.objects.create(name='arroz blanco', category=self.category, calories_per_100g=130)
+        for name in ('Arroz Blanco', 'arroz blancos'):
+            with self.subTest(name=name):
+                self.assertEqual(reconcile_food(name, 999)[:2], (food, False))
+        self.assertEqual(Food.objects.count(), 1)
@@ -0,0 +1,78 @@
+import json
+
+from django.test import SimpleTestCase
+
+from core.json_repair import coerce_food_analysis, parse_food_analysis, repair_json
+from core.model_routing import escalation_reason
+
+FOOD = {'name': 'arroz', 'estimated_grams': 150, 'calories_per_100g': 130, 'confidence': 0.9}
+
+
+class RepairJsonTests(SimpleTestCase):
+    def test_trailing_commas_single_quotes_and_bare_keys(self):
+        text = "Respuesta: {foods: [{'name': 'arroz', 'estimated_grams': 150,},], notes: None,}"
+        self.assertEqual(repair_json(text), {'foods': [{'name': 'arroz', 'estimated_grams': 150}], 'notes': None})
+
+    def test_truncated_response_drops_the_unfinished_value(self):
+        # "15" puede ser un "150" cortado: no se conserva
+        text = '{"foods": [{"name": "arroz", "estimated_grams": 15'
+        self.assertEqual(repair_json(text), {'foods': [{'name': 'arroz'}]})
+
+    def test_text_without_object_or_array(self):
+        self.assertIsNone(repair_json('no hay JSON aquí'))
+        self.assertIsNone(repair_json(''))
+
+
+class CoerceFoodAnalysisTests(SimpleTestCase):
+    def test_numbers_as_text_and_percent_confidence(self):
+        analysis = coerce_food_analysis({'foods': [
+            {'name': ' pan ', 'estimated_grams': '80 g', 'calories_per_100g': '265,5', 'confidence': '85%'},
+        ]})
+        self.assertEqual(analysis['foods'], [
+            {'name': 'pan', 'estimated_grams': 80, 'calories_per_100g': 265.5, 'confidence': 0.85},
+        ])
+        self.assertEqual(analysis['total_calories'], 212.4)
+        self.assertEqual(analysis['analysis_confidence'], 0.85)
+
+    def test_items_without_required_fields_are_dropped(self):
+        analysis = coerce_food_analysis([FOOD, {'name': 'sin gramos', 'calories_per_100g': 100}, 'texto'])
+        self.assertEqual([food['name'] for food in analysis['foods']], ['arroz'])
+
+    def test_non_finite_numbers_are_dropped(self):
+        analysis = coerce_food_analysis({
+            'foods': [FOOD, {'name': 'infinito', 'estimated_grams': float('inf'), 'calories_per_100g': 100}],
+            'total_calories': float('nan'),
+        })
+        self.assertEqual([food['name'] for food in analysis['foods']], ['arroz'])
+        self.assertEqual(analysis['total_calories'], 195.0)
+
+    def test_without_foods_list(self):
+        self.assertIsNone(coerce_food_analysis({'total_calories': 100}))
+
+
+class ParseFoodAnalysisTests(SimpleTestCase):
+    def test_valid_json_is_not_marked_as_repaired(self):
+        analysis, repaired = parse_food_analysis(json.dumps({'foods': [FOOD], 'analysis_confidence': 0.9}))
+        self.assertFalse(repaired)
+        self.assertNotIn('truncated', analysis)
+
+    def test_overflowing_exponent_does_not_reach_the_totals(self):
+        analysis, _ = parse_food_analysis('{"foods": [%s], "total_calories": 1e400}' % json.dumps(FOOD))
+        self.assertEqual(analysis['total_calories'], 195.0)
+
+    def test_invalid_but_complete_json_is_repaired(self):
+        analysis, repaired = parse_food_analysis('{"foods": [%s,], "analysis_confidence": 0.9,}' % json.dumps(FOOD))
+        self.assertTrue(repaired)
+        self.assertNotIn('truncated', analysis)
+
+    def test_truncated_json_is_marked_as_not_final(self):
+        text = '{"foods": [%s, {"name": "pollo", "estimated' % json.dumps(FOOD)
+        analysis, repaired = parse_food_analysis(text)
+        self.assertTrue(repaired)
+        self.assertTrue(analysis['truncated'])
+        self.assertEqual([food['name'] for food in analysis['foods']], ['arroz'])
+        # Un resultado truncado se escala al siguiente nivel de modelo
+        self.assertEqual(escalation_reason(analysis), 'truncated')
+
+    def test_unrecoverable_text(self):
+        self.assertEqual(parse_food_analysis('lo siento, no puedo ayudar'), (None, False))
@@ -0,0 +1,54 @@
+import random
+
+from django.test import SimpleTestCase
+
+from core.meal_matching import BKTree, hamming_distance
+
+
+class BKTreeTests(SimpleTestCase):
+    def setUp(self):
+        rng = random.Random(42)
+        self.hashes = [rng.getrandbits(64) for _ in range(300)]
+        self.tree = BKTree()
+        for item, value in enumerate(self.hashes):
+            self.tree.add(value, item)
+
+    def brute_force(self, value, max_distance):
+        return sorted(
+            (hamming_distance(value, other), item)
+            for item, other in enumerate(self.hashes)
+            if hamming_distance(value, other) <= max_distance
+        )
+
+    def test_radius_search_matches_brute_force(self):
+        for value in self.hashes[:20] + [0, 2 ** 64 - 1]:
+            for max_distance in (0, 5, 24):
+                with self.subTest(value=value, max_distance=max_distance):
+                    self.assertEqual(sorted(self.tree.search(value, max_distance)), self.brute_force(value, max_distance))
+
+    def test_results_are_sorted_by_distance(self):
+        near = self.hashes[0] ^ 0b111
+        self.tree.add(near, 'cerca')
+        results = self.tree.search(self.hashes[0], 30)
+        self.assertEqual(results[:2], [(0, 0), (3, 'cerca')])
+        self.assertEqual([distance for distance, _ in results], sorted(distance for distance, _ in results))
+
+    def test_same_hash_keeps_every_item(self):
+        self.tree.add(self.hashes[1], 'repetida')
+        self.assertEqual(sorted(map(str, (item for _, item in self.tree.search(self.hashes[1], 0)))), ['1', 'repetida'])
+        self.assertEqual(self.tree.size, 301)
+
+    def test_remove(self):
+        self.assertTrue(self.tree.remove(self.hashes[0], 0))
+        self.assertFalse(self.tree.remove(self.hashes[0], 0))
+        self.assertFalse(self.tree.remove(self.hashes[1] ^ 1, 1))
+        self.assertEqual(self.tree.size, 299)
+        self.assertNotIn((0, 0), self.tree.search(self.hashes[0], 0))
+        # El nodo vacío de la raíz sigue dando paso a sus hijos
+        self.assertEqual(sorted(self.tree.search(self.hashes[5], 10)), [
+            result for result in self.brute_force(self.hashes[5], 10) if result[1] != 0
+        ])
+
+    def test_empty_tree(self):
+        self.assertEqual(BKTree().search(123, 64), [])
+        self.assertFalse(BKTree().remove(123, 1))
@@ -0,0 +1,84 @@
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from core.analysis_metrics import AnalysisMetrics
+from core.async_services import AsyncFoodAnalysisService
+from core.models import FoodImage, OpenAIAnalysis
+from core.resilience import AnalysisTimeout
+from core.services import FoodAnalysisService
+
+RICE = {'name': 'Arroz blanco', 'estimated_grams': 150, 'calories_per_100g': 130, 'confidence': 0.6}
+CHICKEN = {'name': 'Pollo a la plancha', 'estimated_grams': 120, 'calories_per_100g': 165, 'confidence': 0.8}
+
+ANALYSES = {
+    'frente.jpg': {'foods': [RICE, CHICKEN], 'total_calories': 393, 'analysis_confidence': 0.8},
+    'lado.jpg': {'foods': [{**RICE, 'confidence': 0.9}], 'total_calories': 195, 'analysis_confidence': 0.7},
+}
+
+
+def fake_analysis(image_path, user_id=None, upload=None):
+    name = str(image_path)
+    if name not in ANALYSES:
+        raise AnalysisTimeout()
+    return ANALYSES[name], AnalysisMetrics()
+
+
+async def afake_analysis(image_path, user_id=None, upload=None):
+    return fake_analysis(image_path, user_id, upload)
+
+
+class AnalyzeManyTests(TestCase):
+    """El servicio síncrono y el asíncrono comparten la combinación del lote: mismo resultado"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('lotes', password='x')
+
+    def food_images(self, *names):
+        return [
+            FoodImage.objects.create(user=self.user, image=name, original_name=name, file_size=1, mime_type='image/jpeg')
+            for name in names
+        ]
+
+    def analyze_sync(self, food_images):
+        service = FoodAnalysisService()
+        with mock.patch.object(service.openai_service, 'analyze_food_image_with_metrics', side_effect=fake_analysis):
+            return service.analyze_many_and_save(food_images)
+
+    def analyze_async(self, food_images):
+        async def analyze():
+            # El cliente asíncrono se crea por event loop: el servicio se crea dentro
+            service = AsyncFoodAnalysisService()
+            with mock.patch.object(service.openai_service, 'analyze_food_image_with_metrics', side_effect=afake_analysis):
+                return await service.analyze_many_and_save(food_images)
+        return async_to_sync(analyze)()
+
+    def test_sync_and_async_results_match(self):
+        results = []
+        for analyze in (self.analyze_sync, self.analyze_async):
+            food_images = self.food_images('frente.jpg', 'lado.jpg', 'borrosa.jpg')
+            analyses, processed_data = analyze(food_images)
+            self.assertEqual([analysis.image_id for analysis in analyses], [food_images[0].id, food_images[1].id])
+            self.assertEqual(
+                FoodImage.objects.get(id=food_images[1].id).primary_image_id, food_images[0].id
+            )
+            for entry in processed_data['images']:
+                entry.pop('image_id')
+                entry.pop('analysis_id', None)
+            results.append(processed_data)
+
+        sync_result, async_result = results
+        self.assertEqual(sync_result, async_result)
+        # El arroz aparece en las dos fotos: se cuenta una vez, con la estimación más segura
+        self.assertEqual([food['sources'] for food in sync_result['foods']], [[0, 1], [0]])
+        self.assertEqual(sync_result['foods'][0]['confidence'], 0.9)
+        self.assertIn('error', sync_result['images'][2])
+
+    def test_all_failed_raises_provider_error(self):
+        for analyze in (self.analyze_sync, self.analyze_async):
+            with self.subTest(analyze=analyze.__name__):
+                with self.assertRaises(AnalysisTimeout):
+                    analyze(self.food_images('borrosa.jpg', 'oscura.jpg'))
+        self.assertFalse(OpenAIAnalysis.objects.exists())
@@ -0,0 +1,67 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from core.models import RateLimitBucket
+from core.rate_limits import BucketPolicy, Quota, consume
+from core.resilience import AnalysisRateLimited
+
+
+class BucketPolicyTests(TestCase):
+    def test_refill_is_proportional_to_elapsed_time_and_capped_at_burst(self):
+        policy = BucketPolicy('prueba', burst=5, per_hour=60)
+        now = timezone.now()
+        bucket = RateLimitBucket(key='prueba', tokens=1, updated_at=now - timedelta(minutes=2))
+        self.assertAlmostEqual(policy.refill(bucket, now), 3)
+        bucket.updated_at = now - timedelta(hours=1)
+        self.assertEqual(policy.refill(bucket, now), 5)
+        # Un reloj que va hacia atrás no quita tokens
+        bucket.updated_at = now + timedelta(minutes=1)
+        self.assertEqual(policy.refill(bucket, now), 1)
+
+    def test_quota_headers_and_retry_after(self):
+        quota = Quota(BucketPolicy('prueba', burst=5, per_hour=60), tokens=0.5)
+        self.assertEqual(quota.retry_after, 30)
+        self.assertEqual(quota.headers(), {'X-RateLimit-Limit': '5', 'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': '270'})
+
+
+class ConsumeTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        patcher = mock.patch('core.rate_limits.timezone.now', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = BucketPolicy('usuario', burst=2, per_hour=60)
+        self.total = BucketPolicy('global', burst=10, per_hour=600)
+
+    def tokens(self, key):
+        return RateLimitBucket.objects.get(key=key).tokens
+
+    def test_burst_then_denial(self):
+        self.assertEqual(consume([self.user, self.total])[0].remaining, 1)
+        self.assertEqual(consume([self.user, self.total])[0].remaining, 0)
+        with self.assertRaises(AnalysisRateLimited) as denied:
+            consume([self.user, self.total])
+        self.assertEqual(denied.exception.retry_after, 60)
+        self.assertEqual(denied.exception.quota.key, 'usuario')
+        # Denegado en un bucket: no se gasta en ninguno
+        self.assertEqual(self.tokens('usuario'), 0)
+        self.assertEqual(self.tokens('global'), 8)
+
+    def test_tokens_come_back_over_time(self):
+        consume([self.user])
+        consume([self.user])
+        self.now += timedelta(seconds=59)
+        with self.assertRaises(AnalysisRateLimited):
+            consume([self.user])
+        self.now += timedelta(seconds=1)
+        self.assertEqual(consume([self.user])[0].remaining, 0)
+
+    def test_global_bucket_limits_every_user(self):
+        total = BucketPolicy('global', burst=1, per_hour=1)
+        consume([BucketPolicy('usuario:1', burst=5, per_hour=60), total])
+        with self.assertRaises(AnalysisRateLimited):
+            consume([BucketPolicy('usuario:2', burst=5, per_hour=60), total])
+        self.assertEqual(self.tokens('usuario:2'), 5)
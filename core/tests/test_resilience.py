@@ -0,0 +1,42 @@
+import threading
+import time
+
+from django.test import SimpleTestCase
+
+from core.resilience import _hedged_call
+
+
+class FakeStream:
+    def __init__(self, name):
+        self.name = name
+        self.closed = threading.Event()
+
+    def close(self):
+        self.closed.set()
+
+
+class HedgedCallTests(SimpleTestCase):
+    def test_losing_response_is_closed_when_it_arrives(self):
+        responses = [FakeStream('lenta'), FakeStream('rápida')]
+        calls = []
+
+        def call(timeout):
+            position = len(calls)
+            calls.append(timeout)
+            time.sleep(0.3 if position == 0 else 0.01)
+            return responses[position]
+
+        result = _hedged_call(call, timeout=5, hedge_after=0.05)
+        self.assertIs(result, responses[1])
+        self.assertTrue(responses[0].closed.wait(2))
+        self.assertFalse(responses[1].closed.is_set())
+
+    def test_fast_response_is_not_duplicated(self):
+        calls = []
+
+        def call(timeout):
+            calls.append(timeout)
+            return 'ok'
+
+        self.assertEqual(_hedged_call(call, timeout=5, hedge_after=1), 'ok')
+        self.assertEqual(len(calls), 1)
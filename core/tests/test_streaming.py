@@ -0,0 +1,56 @@
+import json
+
+from django.test import SimpleTestCase
+
+from core.streaming import FoodItemStreamParser, sse_event
+
+FOODS = [
+    {'name': 'arroz "blanco"', 'estimated_grams': 150, 'calories_per_100g': 130, 'confidence': 0.9},
+    {'name': 'pollo {asado}', 'estimated_grams': 120, 'calories_per_100g': 165, 'confidence': 0.8},
+]
+ARGUMENTS = json.dumps({'notes': 'foods: [{}]', 'foods': FOODS, 'total_calories': 393, 'analysis_confidence': 0.85})
+
+
+def feed_in_chunks(text, size):
+    parser = FoodItemStreamParser()
+    emitted = []
+    for start in range(0, len(text), size):
+        emitted.append(parser.feed(text[start:start + size]))
+    return parser, emitted
+
+
+class FoodItemStreamParserTests(SimpleTestCase):
+    def test_items_are_the_same_for_any_chunk_size(self):
+        for size in (1, 2, 7, 64, len(ARGUMENTS)):
+            with self.subTest(size=size):
+                parser, emitted = feed_in_chunks(ARGUMENTS, size)
+                self.assertEqual([item for items in emitted for item in items], FOODS)
+                self.assertEqual(parser.text, ARGUMENTS)
+
+    def test_each_item_is_emitted_when_it_closes(self):
+        first_end = ARGUMENTS.index('}', ARGUMENTS.index('"foods"')) + 1
+        parser = FoodItemStreamParser()
+        self.assertEqual(parser.feed(ARGUMENTS[:first_end - 1]), [])
+        self.assertEqual(parser.feed(ARGUMENTS[first_end - 1:first_end]), FOODS[:1])
+        self.assertEqual(parser.feed(ARGUMENTS[first_end:]), FOODS[1:])
+
+    def test_long_response_fed_char_by_char(self):
+        foods = [{**FOODS[0], 'name': f'alimento {index}'} for index in range(2000)]
+        arguments = json.dumps({'foods': foods, 'total_calories': 0, 'analysis_confidence': 0.5})
+        parser, emitted = feed_in_chunks(arguments, 1)
+        self.assertEqual([item for items in emitted for item in items], foods)
+        self.assertEqual(parser.text, arguments)
+
+    def test_invalid_items_are_skipped(self):
+        parser = FoodItemStreamParser()
+        items = parser.feed('{"foods": [{"name": "sin calorías", "estimated_grams": 10}, %s]}' % json.dumps(FOODS[0]))
+        self.assertEqual(items, FOODS[:1])
+
+    def test_objects_outside_foods_are_ignored(self):
+        parser = FoodItemStreamParser()
+        self.assertEqual(parser.feed('{"extra": [%s], "foods": []}' % json.dumps(FOODS[0])), [])
+
+
+class SseEventTests(SimpleTestCase):
+    def test_format(self):
+        self.assertEqual(sse_event('item', {'name': 'piña'}), 'event: item\ndata: {"name": "piña"}\n\n')
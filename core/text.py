@@ -0,0 +1,8 @@
+import unicodedata
+
+
+def normalize_food_name(name: str) -> str:
+    """Normaliza un nombre de alimento: minúsculas, sin acentos ni espacios repetidos"""
+    decomposed = unicodedata.normalize('NFKD', name or '')
+    without_accents = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(without_accents.lower().split())
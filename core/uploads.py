@@ -0,0 +1,167 @@
+import hashlib
+import io
+import logging
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings
+from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile, StopFutureHandlers
+from PIL import ImageFile
+
+from .image_processing import detect_mime_type, prepare_image_for_analysis
+from .resilience import AnalysisError, ImageRejected, ImageTooLarge, UnsupportedImageType
+
+logger = logging.getLogger(__name__)
+
+ALLOWED_MIME_TYPES = ('image/jpeg', 'image/png', 'image/webp')
+
+# Bytes que se esperan como mucho hasta que Pillow reconoce la cabecera (EXIF incluido)
+HEADER_MAX_BYTES = 512 * 1024
+
+
+class AnalysisUploadedFile(InMemoryUploadedFile):
+    """
+    Imagen recibida por AnalysisImageUploadHandler: trae ya el SHA-256, el tipo real y las
+    dimensiones, así que ni el almacenamiento ni el servicio de análisis vuelven a leerla entera.
+    """
+
+    def __init__(self, file, field_name, name, content_type, size, charset,
+                 content_hash: str, dimensions: Tuple[int, int]):
+        super().__init__(file, field_name, name, content_type, size, charset)
+        self.content_hash = content_hash
+        self.dimensions = dimensions
+        self._rendition: Optional[Tuple[bytes, str]] = None
+
+    def getvalue(self) -> bytes:
+        return self.file.getvalue()
+
+    @property
+    def rendition(self) -> Tuple[bytes, str]:
+        """Versión reducida y recomprimida para el modelo (prepare_image_for_analysis), calculada una vez"""
+        if self._rendition is None:
+            self._rendition = prepare_image_for_analysis(self.getvalue())
+        return self._rendition
+
+
+class AnalysisImageUploadHandler(FileUploadHandler):
+    """
+    Procesa las imágenes de las vistas de análisis en una sola pasada mientras llegan:
+    SHA-256 incremental, tipo real por la firma (no el Content-Type del cliente), límite de
+    tamaño y de dimensiones en cuanto se conocen, y sin archivos temporales. Una imagen
+    rechazada se descarta sin seguir guardando sus bytes y el motivo queda en
+    request.upload_errors (ver upload_rejection).
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.error: Optional[AnalysisError] = None
+        if request is not None:
+            request.upload_errors = {}
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        self.buffer = io.BytesIO()
+        self.digest = hashlib.sha256()
+        self.sniffed_type = None
+        self.parser = ImageFile.Parser()
+        self.dimensions = None
+        if content_length and content_length > settings.ANALYSIS_UPLOAD_MAX_BYTES:
+            self._reject(ImageTooLarge())
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > settings.ANALYSIS_UPLOAD_MAX_BYTES:
+            self._reject(ImageTooLarge())
+        self.buffer.write(raw_data)
+        self.digest.update(raw_data)
+        if self.sniffed_type is None and self.buffer.tell() >= 12:
+            self.sniffed_type = detect_mime_type(self.buffer.getbuffer()[:12].tobytes())
+            if self.sniffed_type not in ALLOWED_MIME_TYPES:
+                self._reject(UnsupportedImageType())
+        if self.parser is not None:
+            self._read_header(raw_data)
+        return None
+
+    def _read_header(self, raw_data: bytes):
+        """Alimenta el parser de Pillow solo hasta tener la cabecera, y comprueba las dimensiones"""
+        try:
+            self.parser.feed(raw_data)
+        except Exception:
+            self._reject(ImageRejected('No se pudo leer la imagen'))
+        if self.parser.image is None:
+            if self.buffer.tell() > HEADER_MAX_BYTES:
+                self._reject(ImageRejected('No se pudo leer la imagen'))
+            return
+        self.dimensions = self.parser.image.size
+        self.parser = None
+        width, height = self.dimensions
+        if width * height > settings.ANALYSIS_UPLOAD_MAX_PIXELS:
+            self._reject(ImageTooLarge(
+                f'La imagen tiene {width}x{height} píxeles; el máximo son '
+                f'{settings.ANALYSIS_UPLOAD_MAX_PIXELS / 1_000_000:.0f} megapíxeles'
+            ))
+
+    def file_complete(self, file_size):
+        if self.sniffed_type not in ALLOWED_MIME_TYPES:
+            self._record(UnsupportedImageType())
+            return None
+        if self.dimensions is None:
+            self._record(ImageRejected('No se pudo leer la imagen'))
+            return None
+        self.buffer.seek(0)
+        return AnalysisUploadedFile(
+            file=self.buffer,
+            field_name=self.field_name,
+            name=self.file_name,
+            content_type=self.sniffed_type,
+            size=file_size,
+            charset=self.charset,
+            content_hash=self.digest.hexdigest(),
+            dimensions=self.dimensions,
+        )
+
+    def _record(self, error: AnalysisError):
+        logger.info(f"Imagen '{self.file_name}' rechazada al subirla ({error.code}): {error.message}")
+        self.error = error
+        if self.request is not None:
+            self.request.upload_errors[self.field_name] = error
+
+    def _reject(self, error: AnalysisError):
+        """Descarta el archivo: MultiPartParser consume el resto sin pasarlo al manejador"""
+        self._record(error)
+        self.buffer = None
+        self.parser = None
+        raise SkipFile()
+
+
+def analysis_image_from_file(file, file_name: str) -> AnalysisUploadedFile:
+    """Pasa un archivo ya recibido (p. ej. una subida por partes) por las mismas comprobaciones que una subida normal"""
+    handler = AnalysisImageUploadHandler()
+    received = 0
+    try:
+        try:
+            handler.new_file('image', file_name, 'application/octet-stream', file.size)
+        except StopFutureHandlers:
+            pass
+        for chunk in file.chunks():
+            handler.receive_data_chunk(chunk, received)
+            received += len(chunk)
+    except SkipFile:
+        raise handler.error
+    image = handler.file_complete(received)
+    if image is None:
+        raise handler.error
+    return image
+
+
+def analysis_upload(view):
+    """Marca una vista para que AnalysisUploadMiddleware procese sus imágenes con AnalysisImageUploadHandler"""
+    view.analysis_upload = True
+    return view
+
+
+def upload_rejection(request) -> Optional[AnalysisError]:
+    """Procesa el formulario si hace falta y retorna el primer rechazo de una imagen subida"""
+    request.FILES
+    errors: Dict[str, AnalysisError] = getattr(request, 'upload_errors', {})
+    return next(iter(errors.values()), None)
@@ -1,8 +1,25 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
 app_name = 'core'
 
+# Con ASGI (uvicorn) las vistas de análisis se sirven en su versión asíncrona
+if settings.ANALYSIS_ASYNC_VIEWS:
+    meal_analysis_view = views.meal_analysis_async
+    analyze_image_view = views.api_analyze_image_async
+    analyze_image_enhanced_view = views.api_analyze_image_enhanced_async
+    analyze_meal_images_view = views.api_analyze_meal_images_async
+    analyze_image_stream_view = views.api_analyze_image_stream_async
+    analysis_job_events_view = views.api_analysis_job_events_async
+else:
+    meal_analysis_view = views.meal_analysis
+    analyze_image_view = views.api_analyze_image
+    analyze_image_enhanced_view = views.api_analyze_image_enhanced
+    analyze_meal_images_view = views.api_analyze_meal_images
+    analyze_image_stream_view = views.api_analyze_image_stream
+    analysis_job_events_view = views.api_analysis_job_events
+
 urlpatterns = [
     # Vistas principales
     path('', views.index, name='index'),
@@ -11,9 +28,10 @@ urlpatterns = [
     # Gestión de comidas
     path('add-meal/', views.add_meal, name='add_meal'),
     path('add-meal-enhanced/', views.add_meal_enhanced, name='add_meal_enhanced'),
-    path('meal/<int:meal_id>/analysis/', views.meal_analysis, name='meal_analysis'),
+    path('meal/<int:meal_id>/analysis/', meal_analysis_view, name='meal_analysis'),
     path('meal/<int:meal_id>/', views.meal_detail, name='meal_detail'),
     path('meal-history/', views.meal_history, name='meal_history'),
+    path('images/<int:image_id>/<str:kind>.<str:image_format>', views.food_image_rendition, name='food_image_rendition'),
     
     # Quick meal capture
     path('quick/', views.quick_meal_capture, name='quick_meal_capture'),
@@ -28,8 +46,20 @@ urlpatterns = [
     path('statistics/', views.statistics, name='statistics'),
     
     # APIs
-    path('api/analyze-image/', views.api_analyze_image, name='api_analyze_image'),
-    path('api/analyze-image-enhanced/', views.api_analyze_image_enhanced, name='api_analyze_image_enhanced'),
+    path('api/analyze-image/', analyze_image_view, name='api_analyze_image'),
+    path('api/analyze-image-enhanced/', analyze_image_enhanced_view, name='api_analyze_image_enhanced'),
+    path('api/analyze-image-stream/', analyze_image_stream_view, name='api_analyze_image_stream'),
+    path('api/analyze-meal-images/', analyze_meal_images_view, name='api_analyze_meal_images'),
+    path('api/analysis/<int:analysis_id>/reanalyze/', views.api_reanalyze, name='api_reanalyze'),
+    path('api/analysis-jobs/', views.api_submit_analysis_job, name='api_submit_analysis_job'),
+    path('api/uploads/', views.api_create_upload, name='api_create_upload'),
+    path('api/uploads/<uuid:upload_id>/', views.api_chunked_upload, name='api_chunked_upload'),
+    path('api/uploads/<uuid:upload_id>/finalize/', views.api_finalize_upload, name='api_finalize_upload'),
+    path('api/direct-uploads/', views.api_create_direct_upload, name='api_create_direct_upload'),
+    path('api/direct-uploads/<uuid:upload_id>/complete/', views.api_complete_direct_upload, name='api_complete_direct_upload'),
+    path('api/direct-uploads/local/', views.api_local_direct_upload, name='api_local_direct_upload'),
+    path('api/analysis-jobs/<int:job_id>/', views.api_analysis_job_status, name='api_analysis_job_status'),
+    path('api/analysis-jobs/<int:job_id>/events/', analysis_job_events_view, name='api_analysis_job_events'),
     path('api/save-meal/', views.api_save_meal, name='api_save_meal'),
     path('api/food-suggestions/', views.api_food_suggestions, name='api_food_suggestions'),
     path('api/quick-save-meal/', views.api_quick_save_meal, name='api_quick_save_meal'),
@@ -1,24 +1,178 @@
+import asyncio
 import json
 import logging
-from django.shortcuts import render, redirect, get_object_or_404
+import math
+import time
+from functools import partial, wraps
+from django.conf import settings
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse, HttpResponse
+from django.core import signing
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse, Http404
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.core.paginator import Paginator
 from django.db.models import Sum, Q, Count
+from django.urls import reverse
 from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date
 from datetime import datetime, timedelta
 from .models import (
     UserProfile, MealRecord, DrinkRecord, FoodImage, 
-    OpenAIAnalysis, Food, Drink, UserSettings, ActivityLog, DrinkCategory, FoodCategory, MealDetail
+    OpenAIAnalysis, Food, Drink, UserSettings, ActivityLog, DrinkCategory, FoodCategory, MealDetail,
+    AnalysisJob
 )
+from asgiref.sync import iscoroutinefunction, sync_to_async
 from .services import FoodAnalysisService
+from .async_services import AsyncFoodAnalysisService
+from .jobs import enqueue_analysis, job_payload
+from .food_matching import reconcile_food
+from .rate_limits import check_analysis_quota
+from .resilience import (
+    AnalysisError, AnalysisOverloaded, AnalysisRateLimited, UploadOffsetMismatch, analysis_bulkhead
+)
+from .streaming import sse_event
+from .chunked_uploads import (
+    TUS_VERSION, append_chunk, create_upload, delete_upload, get_active_upload, read_upload,
+    parse_upload_metadata
+)
+from .uploads import analysis_upload, upload_rejection
+from .direct_uploads import complete_direct_upload, create_direct_upload, get_active_direct_upload
+from .storage import LOCAL_UPLOAD_SALT, food_image_storage
+from .renditions import RENDITION_FORMATS, generate_renditions, rendition_sides
 
 logger = logging.getLogger(__name__)
 
 
+def _analysis_error_response(error: AnalysisError) -> JsonResponse:
+    """Respuesta JSON con código de error y Retry-After para fallos del análisis"""
+    response = JsonResponse({
+        'success': False,
+        'error': error.message,
+        'error_code': error.code
+    }, status=error.status)
+    if error.retry_after:
+        response['Retry-After'] = str(int(math.ceil(error.retry_after)))
+    return response
+
+
+def _release_after_stream(response, bulkhead, lease):
+    """En las respuestas en streaming la plaza se libera al terminar (o cortarse) el stream"""
+    content = response.streaming_content
+    if response.is_async:
+        async def released():
+            try:
+                async for chunk in content:
+                    yield chunk
+            finally:
+                await sync_to_async(bulkhead.release)(lease)
+    else:
+        def released():
+            try:
+                yield from content
+            finally:
+                bulkhead.release(lease)
+    response.streaming_content = released()
+
+
+def _with_quota_headers(response, quota):
+    """Añade las cabeceras X-RateLimit-* de la cuota de análisis del usuario"""
+    if quota is not None:
+        for header, value in quota.headers().items():
+            response[header] = value
+    return response
+
+
+def _analysis_admission(view=None, *, charge_quota: bool = True):
+    """
+    Control de admisión de las vistas de análisis: reserva plaza en el bulkhead compartido
+    entre workers (ver core/resilience.py), procesa la subida (ver core/uploads.py) y solo
+    entonces gasta un token de la cuota del usuario y de la global (ver core/rate_limits.py),
+    así un 429 por saturación o una imagen rechazada (413/415) no consumen cuota. Sin plaza
+    o sin cuota responde al momento 429 con Retry-After, sin ocupar el worker esperando al
+    proveedor. Las respuestas que pasan la cuota llevan las cabeceras X-RateLimit-*.
+    Con charge_quota=False la vista gasta la cuota ella misma cuando sabe que hay una
+    imagen válida que analizar (ver api_finalize_upload).
+    """
+    if view is None:
+        return partial(_analysis_admission, charge_quota=charge_quota)
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def _wrapped_async(request, *args, **kwargs):
+            bulkhead = analysis_bulkhead()
+            try:
+                lease = await bulkhead.aacquire()
+            except AnalysisOverloaded as e:
+                return _analysis_error_response(e)
+            try:
+                rejection = await sync_to_async(upload_rejection)(request)
+                if rejection is not None:
+                    await sync_to_async(bulkhead.release)(lease)
+                    return _analysis_error_response(rejection)
+                try:
+                    quota = await sync_to_async(check_analysis_quota)(await request.auser()) if charge_quota else None
+                except AnalysisRateLimited as e:
+                    await sync_to_async(bulkhead.release)(lease)
+                    return _with_quota_headers(_analysis_error_response(e), e.quota)
+                response = await view(request, *args, **kwargs)
+            except BaseException:
+                await sync_to_async(bulkhead.release)(lease)
+                raise
+            if response.streaming:
+                _release_after_stream(response, bulkhead, lease)
+            else:
+                await sync_to_async(bulkhead.release)(lease)
+            return _with_quota_headers(response, quota)
+        return analysis_upload(_wrapped_async)
+
+    @wraps(view)
+    def _wrapped(request, *args, **kwargs):
+        bulkhead = analysis_bulkhead()
+        try:
+            lease = bulkhead.acquire()
+        except AnalysisOverloaded as e:
+            return _analysis_error_response(e)
+        try:
+            rejection = upload_rejection(request)
+            if rejection is not None:
+                bulkhead.release(lease)
+                return _analysis_error_response(rejection)
+            try:
+                quota = check_analysis_quota(request.user) if charge_quota else None
+            except AnalysisRateLimited as e:
+                bulkhead.release(lease)
+                return _with_quota_headers(_analysis_error_response(e), e.quota)
+            response = view(request, *args, **kwargs)
+        except BaseException:
+            bulkhead.release(lease)
+            raise
+        if response.streaming:
+            _release_after_stream(response, bulkhead, lease)
+        else:
+            bulkhead.release(lease)
+        return _with_quota_headers(response, quota)
+    return analysis_upload(_wrapped)
+
+
+def _suggest_repeat(request) -> bool:
+    """Se busca una comida repetida salvo que el cliente pida el análisis completo (full_analysis=1)"""
+    return settings.REPEAT_MEAL_SUGGESTIONS and request.POST.get('full_analysis') != '1'
+
+
+# Espera del cliente SSE antes de reconectarse cuando el servidor cierra la conexión
+JOB_EVENTS_RETRY_MS = 3000
+
+
+def _event_stream_response(events) -> StreamingHttpResponse:
+    """Respuesta SSE sin caché ni buffering del proxy"""
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 def index(request):
     """Vista principal - redirige al dashboard si está autenticado"""
     if request.user.is_authenticated:
@@ -137,15 +291,28 @@ def add_meal_enhanced(request):
 
 
 @login_required
+@analysis_upload
 def meal_analysis(request, meal_id):
     """Vista para analizar una comida con imagen"""
     meal = get_object_or_404(MealRecord, id=meal_id, user=request.user)
     
     if request.method == 'POST':
+        rejection = upload_rejection(request)
+        if rejection is not None:
+            messages.error(request, rejection.message)
+            return render(request, 'core/meal_analysis.html', {'meal': meal})
+        
         # Procesar subida de imagen
         if 'food_image' in request.FILES:
             image_file = request.FILES['food_image']
             
+            # Tanto el análisis directo como el encolado gastan cuota
+            try:
+                check_analysis_quota(request.user)
+            except AnalysisRateLimited as e:
+                messages.error(request, e.message)
+                return render(request, 'core/meal_analysis.html', {'meal': meal})
+            
             # Crear registro de imagen
             food_image = FoodImage.objects.create(
                 user=request.user,
@@ -155,10 +322,17 @@ def meal_analysis(request, meal_id):
                 mime_type=image_file.content_type
             )
             
+            if settings.ANALYSIS_JOBS_ENABLED:
+                # Delegar el análisis a los workers y volver de inmediato
+                enqueue_analysis(food_image, meal=meal)
+                messages.info(request, 'Imagen recibida. El análisis se está procesando.')
+                return redirect('core:meal_detail', meal_id=meal.id)
+            
             try:
-                # Analizar imagen con OpenAI
+                # Analizar imagen con OpenAI (sin plaza en el bulkhead falla con AnalysisOverloaded)
                 analysis_service = FoodAnalysisService()
-                analysis, processed_data = analysis_service.analyze_and_save(food_image)
+                with analysis_bulkhead().admit():
+                    analysis, processed_data = analysis_service.analyze_and_save(food_image)
                 
                 # Actualizar comida con los resultados
                 meal.image = food_image
@@ -179,6 +353,10 @@ def meal_analysis(request, meal_id):
                 messages.success(request, 'Análisis completado exitosamente')
                 return redirect('core:meal_detail', meal_id=meal.id)
                 
+            except AnalysisError as e:
+                logger.error(f"Error en análisis de comida ({e.code}): {e.message}")
+                messages.error(request, f'{e.message}. Inténtalo de nuevo.')
+                food_image.delete()
             except Exception as e:
                 logger.error(f"Error en análisis de comida: {e}")
                 messages.error(request, 'Error al analizar la imagen. Inténtalo de nuevo.')
@@ -197,14 +375,40 @@ def meal_detail(request, meal_id):
     if meal.image:
         analysis = getattr(meal.image, 'analysis', None)
     
+    # Trabajo de análisis en curso (modo asíncrono)
+    pending_job = meal.analysis_jobs.filter(status__in=['pending', 'running']).order_by('-created_at').first()
+    
     context = {
         'meal': meal,
         'analysis': analysis,
+        'pending_job': pending_job,
     }
     
     return render(request, 'core/meal_detail.html', context)
 
 
+@login_required
+@require_http_methods(["GET"])
+def food_image_rendition(request, image_id, kind, image_format):
+    """
+    Redirige a una versión reducida de la foto. Las imágenes anteriores a las versiones
+    reducidas no tienen ninguna: se generan aquí la primera vez que se piden.
+    """
+    if kind not in rendition_sides() or image_format not in RENDITION_FORMATS:
+        raise Http404
+    food_image = get_object_or_404(FoodImage, id=image_id, user=request.user)
+    rendition = food_image.renditions.filter(kind=kind, format=image_format).first()
+    if rendition is None:
+        renditions = generate_renditions(food_image)
+        rendition = next((r for r in renditions if (r.kind, r.format) == (kind, image_format)), None)
+    if rendition is None:
+        # Pillow no pudo leer la original: se sirve tal cual
+        return redirect(food_image.image.url)
+    response = redirect(food_image.image.storage.url(rendition.name))
+    patch_cache_control(response, private=True, max_age=24 * 3600)
+    return response
+
+
 @login_required
 def add_drink(request):
     """Vista para agregar una nueva bebida"""
@@ -269,7 +473,7 @@ def meal_history(request):
     
     # Ordenar y paginar
     meals = meals.order_by('-date', '-time')
-    paginator = Paginator(meals, 20)
+    paginator = Paginator(meals.select_related('image').prefetch_related('image__renditions'), 20)
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
     
@@ -484,6 +688,7 @@ def quick_meal_summary(request, analysis_id):
 @login_required
 @csrf_exempt
 @require_http_methods(["POST"])
+@_analysis_admission
 def api_analyze_image(request):
     """API para analizar imagen con OpenAI"""
     try:
@@ -511,6 +716,9 @@ def api_analyze_image(request):
             'data': processed_data
         })
         
+    except AnalysisError as e:
+        logger.error(f"Error de análisis ({e.code}): {e.message}")
+        return _analysis_error_response(e)
     except Exception as e:
         logger.error(f"Error en API de análisis: {e}")
         return JsonResponse({'error': str(e)}, status=500)
@@ -587,14 +795,8 @@ def api_save_meal(request):
             confidence = item.get('confidence', 1.0)
             
             if item_type == 'food':
-                # Buscar o crear alimento
-                food, created = Food.objects.get_or_create(
-                    name=name,
-                    defaults={
-                        'category': FoodCategory.objects.first(),  # Usar primera categoría por defecto
-                        'calories_per_100g': calories * 100 / quantity if quantity > 0 else 0
-                    }
-                )
+                # Reconciliar con el catálogo (solo crea el alimento si no hay uno equivalente)
+                food, created, _ = reconcile_food(name, calories * 100 / quantity if quantity > 0 else 0)
                 
                 # Crear detalle de comida
                 MealDetail.objects.create(
@@ -650,18 +852,191 @@ def api_save_meal(request):
         return JsonResponse({'success': False, 'error': str(e)})
 
 
+def _enhanced_analysis(request, image_file) -> JsonResponse:
+    """Guarda la imagen, la analiza y responde con el formato de la API mejorada"""
+    # Crear registro de imagen
+    food_image = FoodImage.objects.create(
+        user=request.user,
+        image=image_file,
+        original_name=image_file.name,
+        file_size=image_file.size,
+        mime_type=image_file.content_type
+    )
+    
+    analysis_service = FoodAnalysisService()
+    
+    # Una comida repetida se resuelve al instante con el análisis anterior
+    if _suggest_repeat(request):
+        suggestion = analysis_service.suggest_repeat_meal(food_image)
+        if suggestion is not None:
+            return JsonResponse(suggestion[1])
+    
+    # Analizar imagen con OpenAI
+    analysis, processed_data = analysis_service.analyze_and_save(food_image)
+    
+    # Formatear resultados para la nueva interfaz
+    items = FoodAnalysisService.format_items(processed_data)
+    
+    return JsonResponse({
+        'success': True,
+        'analysis_id': analysis.id,
+        'items': items,
+        'total_calories': processed_data.get('total_calories', 0),
+        'analysis_confidence': processed_data.get('analysis_confidence', 0.5),
+        'warnings': analysis.screening_warnings
+    })
+
+
 @login_required
 @csrf_exempt
 @require_http_methods(["POST"])
+@_analysis_admission
 def api_analyze_image_enhanced(request):
     """API mejorada para análisis de imágenes con OpenAI"""
     try:
         if 'image' not in request.FILES:
             return JsonResponse({'success': False, 'error': 'No se proporcionó imagen'})
         
-        image_file = request.FILES['image']
+        return _enhanced_analysis(request, request.FILES['image'])
         
-        # Crear registro de imagen
+    except AnalysisError as e:
+        logger.error(f"Error de análisis ({e.code}): {e.message}")
+        return _analysis_error_response(e)
+    except Exception as e:
+        logger.error(f"Error en análisis de imagen: {e}")
+        return JsonResponse({'success': False, 'error': str(e)})
+
+
+@login_required
+@csrf_exempt
+@require_http_methods(["POST"])
+@_analysis_admission
+def api_analyze_image_stream(request):
+    """
+    API de análisis en streaming (SSE): emite un evento 'item' por cada alimento en cuanto
+    el modelo lo completa y un evento 'done' con el mismo formato que la API mejorada
+    """
+    if 'image' not in request.FILES:
+        return JsonResponse({'success': False, 'error': 'No se proporcionó imagen'}, status=400)
+    
+    image_file = request.FILES['image']
+    food_image = FoodImage.objects.create(
+        user=request.user,
+        image=image_file,
+        original_name=image_file.name,
+        file_size=image_file.size,
+        mime_type=image_file.content_type
+    )
+    suggest_repeat = _suggest_repeat(request)
+    
+    def event_stream():
+        try:
+            for event, payload in FoodAnalysisService().stream_analyze_and_save(food_image, suggest_repeat):
+                yield sse_event(event, payload)
+        except AnalysisError as e:
+            logger.error(f"Error de análisis ({e.code}): {e.message}")
+            yield sse_event('error', {'success': False, 'error': e.message, 'error_code': e.code})
+        except Exception as e:
+            logger.error(f"Error en análisis en streaming: {e}")
+            yield sse_event('error', {'success': False, 'error': str(e)})
+    
+    return _event_stream_response(event_stream())
+
+
+@login_required
+@csrf_exempt
+@require_http_methods(["POST"])
+@_analysis_admission
+def api_reanalyze(request, analysis_id):
+    """API para pedir el análisis completo de una imagen cuyo análisis se sugirió como comida repetida"""
+    analysis = get_object_or_404(OpenAIAnalysis, id=analysis_id, image__user=request.user)
+    try:
+        analysis, processed_data = FoodAnalysisService().reanalyze(analysis)
+        return JsonResponse({
+            'success': True,
+            'analysis_id': analysis.id,
+            'items': FoodAnalysisService.format_items(processed_data),
+            'total_calories': processed_data.get('total_calories', 0),
+            'analysis_confidence': processed_data.get('analysis_confidence', 0.5),
+            'warnings': analysis.screening_warnings
+        })
+    except AnalysisError as e:
+        logger.error(f"Error de análisis ({e.code}): {e.message}")
+        return _analysis_error_response(e)
+    except Exception as e:
+        logger.error(f"Error reanalizando imagen: {e}")
+        return JsonResponse({'success': False, 'error': str(e)})
+
+
+@login_required
+@csrf_exempt
+@require_http_methods(["POST"])
+@_analysis_admission
+def api_analyze_meal_images(request):
+    """API para analizar varias fotos de una misma comida y combinar los resultados"""
+    try:
+        image_files = request.FILES.getlist('images')
+        if not image_files:
+            return JsonResponse({'success': False, 'error': 'No se proporcionaron imágenes'}, status=400)
+        if len(image_files) > settings.MULTI_IMAGE_MAX_IMAGES:
+            return JsonResponse({
+                'success': False,
+                'error': f'Máximo {settings.MULTI_IMAGE_MAX_IMAGES} imágenes por comida'
+            }, status=400)
+        
+        food_images = [
+            FoodImage.objects.create(
+                user=request.user,
+                image=image_file,
+                original_name=image_file.name,
+                file_size=image_file.size,
+                mime_type=image_file.content_type
+            )
+            for image_file in image_files
+        ]
+        
+        analyses, processed_data = FoodAnalysisService().analyze_many_and_save(food_images)
+        
+        return JsonResponse({
+            'success': True,
+            'analysis_id': analyses[0].id,  # Foto principal para asociar a la comida
+            'analysis_ids': [analysis.id for analysis in analyses],
+            'items': FoodAnalysisService.format_items(processed_data),
+            'total_calories': processed_data.get('total_calories', 0),
+            'analysis_confidence': processed_data.get('analysis_confidence', 0.5),
+            'images': processed_data.get('images', [])
+        })
+        
+    except AnalysisError as e:
+        logger.error(f"Error de análisis ({e.code}): {e.message}")
+        return _analysis_error_response(e)
+    except Exception as e:
+        logger.error(f"Error en análisis de varias imágenes: {e}")
+        return JsonResponse({'success': False, 'error': str(e)})
+
+
+@login_required
+@csrf_exempt
+@require_http_methods(["POST"])
+@analysis_upload
+def api_submit_analysis_job(request):
+    """API para encolar el análisis de una imagen y responder de inmediato con el ID del trabajo"""
+    try:
+        rejection = upload_rejection(request)
+        if rejection is not None:
+            return _analysis_error_response(rejection)
+        if 'image' not in request.FILES:
+            return JsonResponse({'success': False, 'error': 'No se proporcionó imagen'}, status=400)
+        
+        meal = None
+        meal_id = request.POST.get('meal_id')
+        if meal_id:
+            meal = get_object_or_404(MealRecord, id=meal_id, user=request.user)
+        
+        # Los trabajos encolados gastan cuota igual que los análisis directos
+        quota = check_analysis_quota(request.user)
+        
+        image_file = request.FILES['image']
         food_image = FoodImage.objects.create(
             user=request.user,
             image=image_file,
@@ -670,35 +1045,499 @@ def api_analyze_image_enhanced(request):
             mime_type=image_file.content_type
         )
         
-        # Analizar imagen con OpenAI
-        analysis_service = FoodAnalysisService()
-        analysis, processed_data = analysis_service.analyze_and_save(food_image)
+        job = enqueue_analysis(food_image, meal=meal)
+        return _with_quota_headers(JsonResponse({'success': True, **job_payload(job)}, status=202), quota)
         
-        # Formatear resultados para la nueva interfaz
-        items = []
-        for food_data in processed_data.get('foods', []):
-            items.append({
-                'type': 'food',
-                'name': food_data.get('name', 'Alimento desconocido'),
-                'quantity': food_data.get('estimated_grams', 0),
-                'unit': 'g',
-                'calories': food_data.get('calories', 0),
-                'confidence': food_data.get('confidence', 0.5)
-            })
+    except AnalysisRateLimited as e:
+        return _with_quota_headers(_analysis_error_response(e), e.quota)
+    except Exception as e:
+        logger.error(f"Error encolando análisis: {e}")
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+
+@login_required
+def api_analysis_job_status(request, job_id):
+    """API de consulta (polling) del estado de un trabajo de análisis"""
+    job = get_object_or_404(AnalysisJob, id=job_id, user=request.user)
+    return JsonResponse({'success': job.status != 'failed', **job_payload(job)})
+
+
+def _job_event(job: AnalysisJob) -> str:
+    event = 'done' if job.is_finished else 'status'
+    return f"event: {event}\ndata: {json.dumps(job_payload(job))}\n\n"
+
+
+@login_required
+def api_analysis_job_events(request, job_id):
+    """
+    API SSE que emite los cambios de estado de un trabajo. Con workers síncronos cada conexión
+    ocupa un worker, así que se cierra tras ANALYSIS_JOB_EVENTS_SYNC_SECONDS y EventSource se
+    reconecta pasado `retry`; con ASGI se usa api_analysis_job_events_async.
+    """
+    job = get_object_or_404(AnalysisJob, id=job_id, user=request.user)
+    
+    def event_stream(job):
+        yield f"retry: {JOB_EVENTS_RETRY_MS}\n\n"
+        deadline = time.monotonic() + settings.ANALYSIS_JOB_EVENTS_SYNC_SECONDS
+        last_status = None
+        while True:
+            if job.status != last_status:
+                last_status = job.status
+                yield _job_event(job)
+            if job.is_finished or time.monotonic() > deadline:
+                return
+            time.sleep(1)
+            job.refresh_from_db()
+    
+    return _event_stream_response(event_stream(job))
+
+
+def _with_upload_headers(response, upload):
+    """Cabeceras tus con el estado de una subida por partes"""
+    response['Tus-Resumable'] = TUS_VERSION
+    response['Upload-Offset'] = str(upload.offset)
+    response['Upload-Length'] = str(upload.length)
+    response['Upload-Expires'] = http_date(upload.expires_at.timestamp())
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+@login_required
+@csrf_exempt
+@require_http_methods(["POST"])
+def api_create_upload(request):
+    """
+    Crea una subida por partes (estilo tus) para redes móviles inestables: el cliente envía
+    las partes con PATCH y, si la conexión se corta, consulta con HEAD los bytes recibidos y
+    sigue desde ahí en lugar de volver a enviar la foto entera
+    """
+    try:
+        length = int(request.headers.get('Upload-Length') or request.POST.get('length', ''))
+    except ValueError:
+        length = 0
+    if length <= 0:
+        return JsonResponse({'success': False, 'error': 'Falta Upload-Length'}, status=400)
+    metadata = parse_upload_metadata(request.headers.get('Upload-Metadata', ''))
+    file_name = metadata.get('filename') or request.POST.get('filename', '')
+    
+    try:
+        upload = create_upload(request.user, length, file_name)
+    except AnalysisError as e:
+        return _analysis_error_response(e)
+    
+    response = JsonResponse({
+        'success': True,
+        'upload_id': str(upload.id),
+        'offset': upload.offset,
+        'length': upload.length,
+        'expires_at': upload.expires_at.isoformat()
+    }, status=201)
+    response['Location'] = reverse('core:api_chunked_upload', args=[upload.id])
+    return _with_upload_headers(response, upload)
+
+
+@login_required
+@csrf_exempt
+@require_http_methods(["HEAD", "PATCH", "DELETE"])
+def api_chunked_upload(request, upload_id):
+    """HEAD: bytes recibidos (Upload-Offset); PATCH: añade una parte en Upload-Offset; DELETE: cancela la subida"""
+    upload = get_active_upload(request.user, upload_id)
+    if upload is None:
+        return JsonResponse({'success': False, 'error': 'Subida no encontrada o caducada'}, status=404)
+    
+    if request.method == 'HEAD':
+        return _with_upload_headers(HttpResponse(), upload)
+    if request.method == 'DELETE':
+        delete_upload(upload)
+        return HttpResponse(status=204)
+    
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Falta Upload-Offset'}, status=400)
+    try:
+        # Un byte más de lo que falta basta para detectar una parte demasiado grande
+        upload = append_chunk(upload, offset, request.read(upload.length - upload.offset + 1))
+    except AnalysisError as e:
+        return _with_upload_headers(_analysis_error_response(e), upload)
+    return _with_upload_headers(HttpResponse(status=204), upload)
+
+
+@login_required
+@csrf_exempt
+@require_http_methods(["POST"])
+@_analysis_admission(charge_quota=False)
+def api_finalize_upload(request, upload_id):
+    """
+    Cierra una subida por partes completa y la analiza igual que /api/analyze-image-enhanced/.
+    La cuota se gasta después de validar la imagen: una subida rechazada no la consume, y una
+    subida sin cuota se conserva para volver a cerrarla tras el Retry-After.
+    """
+    upload = get_active_upload(request.user, upload_id)
+    if upload is None:
+        return JsonResponse({'success': False, 'error': 'Subida no encontrada o caducada'}, status=404)
+    
+    try:
+        image_file = read_upload(upload)
+        quota = check_analysis_quota(request.user)
+        delete_upload(upload)
+        return _with_quota_headers(_enhanced_analysis(request, image_file), quota)
+    except UploadOffsetMismatch as e:
+        # Subida incompleta: se conserva para que el cliente envíe lo que falta
+        return _with_upload_headers(_analysis_error_response(e), upload)
+    except AnalysisRateLimited as e:
+        return _with_quota_headers(_analysis_error_response(e), e.quota)
+    except AnalysisError as e:
+        logger.error(f"Error de análisis ({e.code}): {e.message}")
+        return _analysis_error_response(e)
+    except Exception as e:
+        logger.error(f"Error en análisis de subida por partes: {e}")
+        return JsonResponse({'success': False, 'error': str(e)})
+
+
+@login_required
+@csrf_exempt
+@require_http_methods(["POST"])
+def api_create_direct_upload(request):
+    """
+    Prepara una subida directa al almacenamiento (S3 o compatible): responde con un POST
+    prefirmado para que los bytes de la foto no pasen por la web. Al terminar la subida,
+    el cliente llama a complete_url y el análisis se encola.
+    """
+    try:
+        data = json.loads(request.body or b'{}')
+        size = int(data.get('size', 0))
+    except (ValueError, TypeError):
+        return JsonResponse({'success': False, 'error': 'Datos no válidos'}, status=400)
+    if size <= 0:
+        return JsonResponse({'success': False, 'error': 'Falta el tamaño de la imagen (size)'}, status=400)
+    
+    try:
+        upload, post = create_direct_upload(
+            request.user, data.get('file_name', ''), data.get('content_type', ''), size
+        )
+    except AnalysisError as e:
+        return _analysis_error_response(e)
+    
+    return JsonResponse({
+        'success': True,
+        'upload_id': str(upload.id),
+        'upload': post,
+        'complete_url': reverse('core:api_complete_direct_upload', args=[upload.id]),
+        'expires_at': upload.expires_at.isoformat()
+    }, status=201)
+
+
+@login_required
+@csrf_exempt
+@require_http_methods(["POST"])
+def api_complete_direct_upload(request, upload_id):
+    """Callback del cliente tras subir la foto con el POST prefirmado: encola su análisis (como /api/analysis-jobs/)"""
+    upload = get_active_direct_upload(request.user, upload_id)
+    if upload is None:
+        return JsonResponse({'success': False, 'error': 'Subida no encontrada o caducada'}, status=404)
+    
+    try:
+        data = json.loads(request.body or b'{}')
+        meal = None
+        if data.get('meal_id'):
+            meal = get_object_or_404(MealRecord, id=data['meal_id'], user=request.user)
+        
+        quota = check_analysis_quota(request.user)
+        food_image = complete_direct_upload(upload)
+        job = enqueue_analysis(food_image, meal=meal)
+        return _with_quota_headers(JsonResponse({'success': True, **job_payload(job)}, status=202), quota)
+        
+    except AnalysisRateLimited as e:
+        return _with_quota_headers(_analysis_error_response(e), e.quota)
+    except AnalysisError as e:
+        return _analysis_error_response(e)
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Datos no válidos'}, status=400)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def api_local_direct_upload(request):
+    """
+    Destino de los POST prefirmados con FOOD_IMAGE_STORAGE=local (desarrollo y pruebas): comprueba
+    la política firmada como haría S3 y guarda el archivo. Con S3 el cliente sube al bucket.
+    """
+    if settings.FOOD_IMAGE_STORAGE != 'local':
+        raise Http404
+    try:
+        grant = signing.loads(request.POST.get('policy', ''), salt=LOCAL_UPLOAD_SALT)
+    except signing.BadSignature:
+        return HttpResponse(status=403)
+    if (grant['expires'] < time.time() or request.POST.get('key') != grant['name']
+            or request.POST.get('Content-Type') != grant['content_type']):
+        return HttpResponse(status=403)
+    image_file = request.FILES.get('file')
+    if image_file is None or not 0 < image_file.size <= grant['max_bytes']:
+        return HttpResponse(status=400)
+    food_image_storage().save(grant['name'], image_file)
+    return HttpResponse(status=204)
+
+
+# Vistas asíncronas (ASGI): mismas respuestas que las síncronas, sin bloquear un worker por análisis
+@login_required
+async def api_analysis_job_events_async(request, job_id):
+    """API SSE asíncrona: emite los cambios de estado de un trabajo hasta que termina"""
+    job = await aget_object_or_404(AnalysisJob, id=job_id, user=await request.auser())
+    
+    async def event_stream(job):
+        deadline = time.monotonic() + settings.ANALYSIS_JOB_EVENTS_TIMEOUT
+        last_status = None
+        while True:
+            if job.status != last_status:
+                last_status = job.status
+                yield _job_event(job)
+            if job.is_finished:
+                return
+            if time.monotonic() > deadline:
+                yield "event: timeout\ndata: {}\n\n"
+                return
+            await asyncio.sleep(1)
+            await job.arefresh_from_db()
+    
+    return _event_stream_response(event_stream(job))
+
+
+@login_required
+@csrf_exempt
+@require_http_methods(["POST"])
+@_analysis_admission
+async def api_analyze_image_async(request):
+    """API asíncrona para analizar imagen con OpenAI"""
+    try:
+        if 'image' not in request.FILES:
+            return JsonResponse({'error': 'No se proporcionó imagen'}, status=400)
+        
+        user = await request.auser()
+        image_file = request.FILES['image']
+        
+        food_image = await FoodImage.objects.acreate(
+            user=user,
+            image=image_file,
+            original_name=image_file.name,
+            file_size=image_file.size,
+            mime_type=image_file.content_type
+        )
+        
+        analysis, processed_data = await AsyncFoodAnalysisService().analyze_and_save(food_image)
         
         return JsonResponse({
             'success': True,
             'analysis_id': analysis.id,
-            'items': items,
+            'data': processed_data
+        })
+        
+    except AnalysisError as e:
+        logger.error(f"Error de análisis ({e.code}): {e.message}")
+        return _analysis_error_response(e)
+    except Exception as e:
+        logger.error(f"Error en API de análisis: {e}")
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+@login_required
+@csrf_exempt
+@require_http_methods(["POST"])
+@_analysis_admission
+async def api_analyze_image_enhanced_async(request):
+    """API asíncrona mejorada para análisis de imágenes con OpenAI"""
+    try:
+        if 'image' not in request.FILES:
+            return JsonResponse({'success': False, 'error': 'No se proporcionó imagen'})
+        
+        user = await request.auser()
+        image_file = request.FILES['image']
+        
+        food_image = await FoodImage.objects.acreate(
+            user=user,
+            image=image_file,
+            original_name=image_file.name,
+            file_size=image_file.size,
+            mime_type=image_file.content_type
+        )
+        
+        analysis_service = AsyncFoodAnalysisService()
+        if _suggest_repeat(request):
+            suggestion = await analysis_service.suggest_repeat_meal(food_image)
+            if suggestion is not None:
+                return JsonResponse(suggestion[1])
+        
+        analysis, processed_data = await analysis_service.analyze_and_save(food_image)
+        
+        return JsonResponse({
+            'success': True,
+            'analysis_id': analysis.id,
+            'items': FoodAnalysisService.format_items(processed_data),
             'total_calories': processed_data.get('total_calories', 0),
-            'analysis_confidence': processed_data.get('analysis_confidence', 0.5)
+            'analysis_confidence': processed_data.get('analysis_confidence', 0.5),
+            'warnings': analysis.screening_warnings
         })
         
+    except AnalysisError as e:
+        logger.error(f"Error de análisis ({e.code}): {e.message}")
+        return _analysis_error_response(e)
     except Exception as e:
         logger.error(f"Error en análisis de imagen: {e}")
         return JsonResponse({'success': False, 'error': str(e)})
 
 
+@login_required
+@csrf_exempt
+@require_http_methods(["POST"])
+@_analysis_admission
+async def api_analyze_image_stream_async(request):
+    """API asíncrona de análisis en streaming (SSE)"""
+    if 'image' not in request.FILES:
+        return JsonResponse({'success': False, 'error': 'No se proporcionó imagen'}, status=400)
+    
+    user = await request.auser()
+    image_file = request.FILES['image']
+    food_image = await FoodImage.objects.acreate(
+        user=user,
+        image=image_file,
+        original_name=image_file.name,
+        file_size=image_file.size,
+        mime_type=image_file.content_type
+    )
+    suggest_repeat = _suggest_repeat(request)
+    
+    async def event_stream():
+        try:
+            async for event, payload in AsyncFoodAnalysisService().stream_analyze_and_save(food_image, suggest_repeat):
+                yield sse_event(event, payload)
+        except AnalysisError as e:
+            logger.error(f"Error de análisis ({e.code}): {e.message}")
+            yield sse_event('error', {'success': False, 'error': e.message, 'error_code': e.code})
+        except Exception as e:
+            logger.error(f"Error en análisis en streaming: {e}")
+            yield sse_event('error', {'success': False, 'error': str(e)})
+    
+    return _event_stream_response(event_stream())
+
+
+@login_required
+@csrf_exempt
+@require_http_methods(["POST"])
+@_analysis_admission
+async def api_analyze_meal_images_async(request):
+    """API asíncrona para analizar varias fotos de una misma comida"""
+    try:
+        image_files = request.FILES.getlist('images')
+        if not image_files:
+            return JsonResponse({'success': False, 'error': 'No se proporcionaron imágenes'}, status=400)
+        if len(image_files) > settings.MULTI_IMAGE_MAX_IMAGES:
+            return JsonResponse({
+                'success': False,
+                'error': f'Máximo {settings.MULTI_IMAGE_MAX_IMAGES} imágenes por comida'
+            }, status=400)
+        
+        user = await request.auser()
+        food_images = []
+        for image_file in image_files:
+            food_images.append(await FoodImage.objects.acreate(
+                user=user,
+                image=image_file,
+                original_name=image_file.name,
+                file_size=image_file.size,
+                mime_type=image_file.content_type
+            ))
+        
+        analyses, processed_data = await AsyncFoodAnalysisService().analyze_many_and_save(food_images)
+        
+        return JsonResponse({
+            'success': True,
+            'analysis_id': analyses[0].id,
+            'analysis_ids': [analysis.id for analysis in analyses],
+            'items': FoodAnalysisService.format_items(processed_data),
+            'total_calories': processed_data.get('total_calories', 0),
+            'analysis_confidence': processed_data.get('analysis_confidence', 0.5),
+            'images': processed_data.get('images', [])
+        })
+        
+    except AnalysisError as e:
+        logger.error(f"Error de análisis ({e.code}): {e.message}")
+        return _analysis_error_response(e)
+    except Exception as e:
+        logger.error(f"Error en análisis de varias imágenes: {e}")
+        return JsonResponse({'success': False, 'error': str(e)})
+
+
+@login_required
+@analysis_upload
+async def meal_analysis_async(request, meal_id):
+    """Vista asíncrona para analizar una comida con imagen"""
+    user = await request.auser()
+    try:
+        meal = await MealRecord.objects.aget(id=meal_id, user=user)
+    except MealRecord.DoesNotExist:
+        raise Http404("Comida no encontrada")
+    
+    if request.method == 'POST':
+        rejection = await sync_to_async(upload_rejection)(request)
+        if rejection is not None:
+            messages.error(request, rejection.message)
+            return await sync_to_async(render)(request, 'core/meal_analysis.html', {'meal': meal})
+    
+    if request.method == 'POST' and 'food_image' in request.FILES:
+        image_file = request.FILES['food_image']
+        
+        try:
+            await sync_to_async(check_analysis_quota)(user)
+        except AnalysisRateLimited as e:
+            messages.error(request, e.message)
+            return await sync_to_async(render)(request, 'core/meal_analysis.html', {'meal': meal})
+        
+        food_image = await FoodImage.objects.acreate(
+            user=user,
+            image=image_file,
+            original_name=image_file.name,
+            file_size=image_file.size,
+            mime_type=image_file.content_type
+        )
+        
+        if settings.ANALYSIS_JOBS_ENABLED:
+            await sync_to_async(enqueue_analysis)(food_image, meal=meal)
+            messages.info(request, 'Imagen recibida. El análisis se está procesando.')
+            return redirect('core:meal_detail', meal_id=meal.id)
+        
+        try:
+            async with analysis_bulkhead().aadmit():
+                analysis, processed_data = await AsyncFoodAnalysisService().analyze_and_save(food_image)
+            
+            meal.image = food_image
+            meal.total_calories = processed_data['total_calories']
+            await meal.asave()
+            
+            await ActivityLog.objects.acreate(
+                user=user,
+                action='analysis_requested',
+                details={
+                    'meal_id': meal.id,
+                    'analysis_id': analysis.id,
+                    'calories_found': processed_data['total_calories']
+                }
+            )
+            
+            messages.success(request, 'Análisis completado exitosamente')
+            return redirect('core:meal_detail', meal_id=meal.id)
+            
+        except AnalysisError as e:
+            logger.error(f"Error en análisis de comida ({e.code}): {e.message}")
+            messages.error(request, f'{e.message}. Inténtalo de nuevo.')
+            await food_image.adelete()
+        except Exception as e:
+            logger.error(f"Error en análisis de comida: {e}")
+            messages.error(request, 'Error al analizar la imagen. Inténtalo de nuevo.')
+            await food_image.adelete()
+    
+    return await sync_to_async(render)(request, 'core/meal_analysis.html', {'meal': meal})
+
+
 @login_required
 def api_food_suggestions(request):
     """API para obtener sugerencias de alimentos"""
@@ -758,14 +1597,8 @@ def api_quick_save_meal(request):
             calories = (grams * cal_per_100g) / 100 if grams and cal_per_100g else 0
             food_name = food_data.get('name', 'Alimento desconocido')
             
-            # Buscar o crear alimento
-            food, created = Food.objects.get_or_create(
-                name=food_name,
-                defaults={
-                    'category': FoodCategory.objects.first(),  # Usar primera categoría por defecto
-                    'calories_per_100g': cal_per_100g if cal_per_100g > 0 else 100
-                }
-            )
+            # Reconciliar con el catálogo (solo crea el alimento si no hay uno equivalente)
+            food, created, _ = reconcile_food(food_name, cal_per_100g if cal_per_100g > 0 else 100)
             
             # Crear detalle de comida con los nombres de campo correctos
             MealDetail.objects.create(
@@ -58,6 +58,7 @@ MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'core.middleware.AnalysisUploadMiddleware',  # Antes de CSRF: procesa las imágenes de análisis al recibirlas
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
@@ -98,6 +99,17 @@ DATABASES = {
 }
 
 
+# Cache compartida entre procesos (circuit breaker, límites de concurrencia...)
+# Requiere `python manage.py createcachetable` con el backend de base de datos
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': config('CACHE_LOCATION', default='under1000k_cache'),
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -161,6 +173,170 @@ SECURE_CONTENT_TYPE_NOSNIFF = True
 # OpenAI API Key
 OPENAI_API_KEY = config('OPENAI_API_KEY', default='')
 
+# Pool de conexiones del cliente de OpenAI (uno por proceso)
+OPENAI_POOL_MAX_CONNECTIONS = config('OPENAI_POOL_MAX_CONNECTIONS', default=20, cast=int)
+OPENAI_POOL_MAX_KEEPALIVE = config('OPENAI_POOL_MAX_KEEPALIVE', default=10, cast=int)
+OPENAI_POOL_KEEPALIVE_EXPIRY = config('OPENAI_POOL_KEEPALIVE_EXPIRY', default=60.0, cast=float)
+OPENAI_CONNECT_TIMEOUT = config('OPENAI_CONNECT_TIMEOUT', default=5.0, cast=float)
+OPENAI_READ_TIMEOUT = config('OPENAI_READ_TIMEOUT', default=60.0, cast=float)
+OPENAI_MAX_RETRIES = config('OPENAI_MAX_RETRIES', default=2, cast=int)
+OPENAI_HTTP2 = config('OPENAI_HTTP2', default=True, cast=bool)  # requiere el paquete h2
+
+# Transporte de las llamadas a OpenAI: live, record, replay o synthetic (ver core/openai_transport.py)
+OPENAI_TRANSPORT_MODE = config('OPENAI_TRANSPORT_MODE', default='live')
+OPENAI_CASSETTE_DIR = BASE_DIR / config('OPENAI_CASSETTE_DIR', default='cassettes')
+OPENAI_REPLAY_LATENCY = config('OPENAI_REPLAY_LATENCY', default=0.0, cast=float)
+OPENAI_REPLAY_LATENCY_JITTER = config('OPENAI_REPLAY_LATENCY_JITTER', default=0.0, cast=float)
+OPENAI_SYNTHETIC_SEED = config('OPENAI_SYNTHETIC_SEED', default='under1000k')
+
+# Presupuesto de tiempo, reintentos y circuit breaker de las llamadas de análisis
+ANALYSIS_DEADLINE_SECONDS = config('ANALYSIS_DEADLINE_SECONDS', default=45.0, cast=float)
+ANALYSIS_FALLBACK_MIN_SECONDS = config('ANALYSIS_FALLBACK_MIN_SECONDS', default=10.0, cast=float)
+ANALYSIS_MAX_ATTEMPTS = config('ANALYSIS_MAX_ATTEMPTS', default=3, cast=int)
+ANALYSIS_RETRY_BASE_DELAY = config('ANALYSIS_RETRY_BASE_DELAY', default=0.5, cast=float)
+ANALYSIS_RETRY_MAX_DELAY = config('ANALYSIS_RETRY_MAX_DELAY', default=4.0, cast=float)
+ANALYSIS_HEDGE_AFTER_SECONDS = config('ANALYSIS_HEDGE_AFTER_SECONDS', default=0.0, cast=float)  # 0 = sin hedging
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = config('CIRCUIT_BREAKER_FAILURE_THRESHOLD', default=5, cast=int)
+CIRCUIT_BREAKER_FAILURE_WINDOW = config('CIRCUIT_BREAKER_FAILURE_WINDOW', default=60, cast=int)
+CIRCUIT_BREAKER_RECOVERY_TIMEOUT = config('CIRCUIT_BREAKER_RECOVERY_TIMEOUT', default=30, cast=int)
+
+# Bulkhead de análisis entre workers (ver core/resilience.py): como mucho ANALYSIS_MAX_IN_FLIGHT
+# análisis a la vez y ANALYSIS_QUEUE_SIZE esperando plaza; el resto recibe 429 con Retry-After.
+# Con gunicorn síncrono, MAX_IN_FLIGHT + QUEUE_SIZE debe ser menor que el número de workers
+# para que siempre quede alguno libre para el resto de páginas
+ANALYSIS_BULKHEAD_ENABLED = config('ANALYSIS_BULKHEAD_ENABLED', default=True, cast=bool)
+ANALYSIS_MAX_IN_FLIGHT = config('ANALYSIS_MAX_IN_FLIGHT', default=2, cast=int)
+ANALYSIS_QUEUE_SIZE = config('ANALYSIS_QUEUE_SIZE', default=1, cast=int)
+ANALYSIS_QUEUE_TIMEOUT = config('ANALYSIS_QUEUE_TIMEOUT', default=2.0, cast=float)  # segundos
+ANALYSIS_SLOT_LEASE_MARGIN = config('ANALYSIS_SLOT_LEASE_MARGIN', default=30, cast=float)  # segundos tras el deadline
+ANALYSIS_OVERLOAD_RETRY_AFTER = config('ANALYSIS_OVERLOAD_RETRY_AFTER', default=5, cast=float)  # segundos
+
+# Cuotas de análisis con token buckets en BD (ver core/rate_limits.py): ráfaga máxima (burst) y
+# recarga por hora, por usuario según UserProfile.analysis_tier (None = sin cuota) y global
+ANALYSIS_RATE_LIMITS_ENABLED = config('ANALYSIS_RATE_LIMITS_ENABLED', default=True, cast=bool)
+ANALYSIS_RATE_LIMIT_TIERS = {
+    'free': {
+        'burst': config('ANALYSIS_RATE_FREE_BURST', default=5, cast=int),
+        'per_hour': config('ANALYSIS_RATE_FREE_PER_HOUR', default=20, cast=float),
+    },
+    'premium': {
+        'burst': config('ANALYSIS_RATE_PREMIUM_BURST', default=15, cast=int),
+        'per_hour': config('ANALYSIS_RATE_PREMIUM_PER_HOUR', default=120, cast=float),
+    },
+    'unlimited': None,
+}
+ANALYSIS_GLOBAL_RATE_LIMIT = {
+    'burst': config('ANALYSIS_GLOBAL_RATE_BURST', default=30, cast=int),
+    'per_hour': config('ANALYSIS_GLOBAL_RATE_PER_HOUR', default=600, cast=float),
+}
+
+# Single-flight (ver core/single_flight.py): una misma imagen del mismo usuario se analiza una sola vez
+# aunque lleguen varias peticiones a la vez; su resultado se conserva SINGLE_FLIGHT_RESULT_TTL segundos
+SINGLE_FLIGHT_ENABLED = config('SINGLE_FLIGHT_ENABLED', default=True, cast=bool)
+SINGLE_FLIGHT_RESULT_TTL = config('SINGLE_FLIGHT_RESULT_TTL', default=60, cast=int)
+
+# Caché de análisis por contenido de imagen
+ANALYSIS_CACHE_ENABLED = config('ANALYSIS_CACHE_ENABLED', default=True, cast=bool)
+ANALYSIS_CACHE_TTL_SECONDS = config('ANALYSIS_CACHE_TTL_SECONDS', default=30 * 24 * 3600, cast=int)
+ANALYSIS_CACHE_MAX_ENTRIES = config('ANALYSIS_CACHE_MAX_ENTRIES', default=5000, cast=int)
+
+# Vistas de análisis asíncronas (requiere servir la app por ASGI, ver DEPLOYMENT.md)
+ANALYSIS_ASYNC_VIEWS = config('ANALYSIS_ASYNC_VIEWS', default=False, cast=bool)
+
+# Análisis de varias fotos de una misma comida
+MULTI_IMAGE_MAX_IMAGES = config('MULTI_IMAGE_MAX_IMAGES', default=5, cast=int)
+MULTI_IMAGE_MAX_PARALLEL = config('MULTI_IMAGE_MAX_PARALLEL', default=3, cast=int)
+
+# Subida de imágenes a las vistas de análisis (ver core/uploads.py)
+ANALYSIS_UPLOAD_MAX_BYTES = config('ANALYSIS_UPLOAD_MAX_BYTES', default=10 * 1024 * 1024, cast=int)
+ANALYSIS_UPLOAD_MAX_PIXELS = config('ANALYSIS_UPLOAD_MAX_PIXELS', default=40_000_000, cast=int)
+
+# Subidas por partes reanudables (estilo tus, ver core/chunked_uploads.py)
+CHUNKED_UPLOAD_DIR = BASE_DIR / config('CHUNKED_UPLOAD_DIR', default='partial_uploads')
+CHUNKED_UPLOAD_EXPIRY_SECONDS = config('CHUNKED_UPLOAD_EXPIRY_SECONDS', default=24 * 3600, cast=int)
+
+# Almacenamiento de las fotos: 'local' (MEDIA_ROOT) o 's3' (S3 o compatible como MinIO, requiere django-storages)
+FOOD_IMAGE_STORAGE = config('FOOD_IMAGE_STORAGE', default='local')
+AWS_STORAGE_BUCKET_NAME = config('AWS_STORAGE_BUCKET_NAME', default='')
+AWS_S3_ENDPOINT_URL = config('AWS_S3_ENDPOINT_URL', default=None)  # MinIO: http://localhost:9000
+AWS_S3_REGION_NAME = config('AWS_S3_REGION_NAME', default=None)
+AWS_ACCESS_KEY_ID = config('AWS_ACCESS_KEY_ID', default=None)
+AWS_SECRET_ACCESS_KEY = config('AWS_SECRET_ACCESS_KEY', default=None)
+AWS_QUERYSTRING_EXPIRE = config('AWS_QUERYSTRING_EXPIRE', default=3600, cast=int)  # URLs firmadas de lectura
+
+# Subidas directas al almacenamiento con POST prefirmado (ver core/direct_uploads.py)
+DIRECT_UPLOAD_EXPIRY_SECONDS = config('DIRECT_UPLOAD_EXPIRY_SECONDS', default=900, cast=int)
+
+# Recolector de fotos abandonadas y archivos huérfanos (python manage.py collect_media_garbage)
+MEDIA_GC_GRACE_SECONDS = config('MEDIA_GC_GRACE_SECONDS', default=7 * 24 * 3600, cast=int)
+MEDIA_GC_BATCH_SIZE = config('MEDIA_GC_BATCH_SIZE', default=1000, cast=int)
+MEDIA_GC_INTERVAL_SECONDS = config('MEDIA_GC_INTERVAL_SECONDS', default=24 * 3600, cast=int)  # 0: run_analysis_worker no lo ejecuta
+
+# Preprocesado de imágenes antes de enviarlas al modelo de visión
+ANALYSIS_IMAGE_MAX_SIDE = config('ANALYSIS_IMAGE_MAX_SIDE', default=1536, cast=int)
+ANALYSIS_IMAGE_FORMAT = config('ANALYSIS_IMAGE_FORMAT', default='JPEG')  # JPEG o WEBP
+ANALYSIS_IMAGE_QUALITY = config('ANALYSIS_IMAGE_QUALITY', default=85, cast=int)
+
+# Versiones reducidas de las fotos (miniatura, mediana y tamaño de análisis, ver core/renditions.py)
+IMAGE_RENDITIONS_ENABLED = config('IMAGE_RENDITIONS_ENABLED', default=True, cast=bool)
+IMAGE_RENDITION_THUMB_SIDE = config('IMAGE_RENDITION_THUMB_SIDE', default=200, cast=int)
+IMAGE_RENDITION_MEDIUM_SIDE = config('IMAGE_RENDITION_MEDIUM_SIDE', default=800, cast=int)
+IMAGE_RENDITION_QUALITY = config('IMAGE_RENDITION_QUALITY', default=80, cast=int)
+IMAGE_RENDITION_WORKERS = config('IMAGE_RENDITION_WORKERS', default=2, cast=int)  # 0: en el mismo proceso
+
+# Cola de trabajos de análisis (python manage.py run_analysis_worker)
+ANALYSIS_JOBS_ENABLED = config('ANALYSIS_JOBS_ENABLED', default=False, cast=bool)
+ANALYSIS_JOB_MAX_ATTEMPTS = config('ANALYSIS_JOB_MAX_ATTEMPTS', default=3, cast=int)
+ANALYSIS_JOB_STALE_SECONDS = config('ANALYSIS_JOB_STALE_SECONDS', default=300, cast=int)
+ANALYSIS_JOB_EVENTS_TIMEOUT = config('ANALYSIS_JOB_EVENTS_TIMEOUT', default=120, cast=int)
+# Con workers síncronos cada conexión SSE dura como mucho esto y el cliente se reconecta
+ANALYSIS_JOB_EVENTS_SYNC_SECONDS = config('ANALYSIS_JOB_EVENTS_SYNC_SECONDS', default=15, cast=int)
+
+# Reconciliación de nombres analizados con el catálogo de alimentos (ver core/food_matching.py)
+FOOD_MATCH_THRESHOLD = config('FOOD_MATCH_THRESHOLD', default=0.75, cast=float)
+FOOD_MATCH_DIMENSIONS = config('FOOD_MATCH_DIMENSIONS', default=1024, cast=int)
+FOOD_MATCH_INDEX_TTL = config('FOOD_MATCH_INDEX_TTL', default=300, cast=int)
+
+# Categorización automática de alimentos por palabras clave (ver core/categorizer.py)
+FOOD_CATEGORIZER_TTL = config('FOOD_CATEGORIZER_TTL', default=300, cast=int)
+
+# Sugerencia de comidas repetidas por hash perceptual (ver core/meal_matching.py)
+REPEAT_MEAL_SUGGESTIONS = config('REPEAT_MEAL_SUGGESTIONS', default=True, cast=bool)
+REPEAT_MEAL_MAX_DISTANCE = config('REPEAT_MEAL_MAX_DISTANCE', default=8, cast=int)  # bits distintos de 64
+REPEAT_MEAL_LOOKBACK_DAYS = config('REPEAT_MEAL_LOOKBACK_DAYS', default=60, cast=int)
+REPEAT_MEAL_INDEX_TTL = config('REPEAT_MEAL_INDEX_TTL', default=300, cast=int)
+REPEAT_MEAL_INDEX_USERS = config('REPEAT_MEAL_INDEX_USERS', default=500, cast=int)
+
+# Enrutado por niveles de modelo (ver core/model_routing.py): se prueba primero un modelo rápido
+# con imagen en baja resolución y prompt corto, y se escala al siguiente nivel si falla la
+# validación o la confianza del análisis queda por debajo de ANALYSIS_ESCALATION_CONFIDENCE
+ANALYSIS_ROUTING_ENABLED = config('ANALYSIS_ROUTING_ENABLED', default=True, cast=bool)
+ANALYSIS_ESCALATION_CONFIDENCE = config('ANALYSIS_ESCALATION_CONFIDENCE', default=0.7, cast=float)
+ANALYSIS_MODEL_TIERS = [
+    {
+        'name': 'fast',
+        'model': config('ANALYSIS_FAST_MODEL', default='gpt-5-mini'),
+        'detail': config('ANALYSIS_FAST_IMAGE_DETAIL', default='low'),
+        'compact_prompt': True,
+    },
+    {
+        'name': 'full',
+        'model': config('ANALYSIS_FULL_MODEL', default='gpt-5'),
+        'detail': 'auto',
+        'compact_prompt': False,
+    },
+]
+
+# Cribado local de imágenes antes de la llamada a la API (ver core/image_screening.py)
+IMAGE_SCREENING_ENABLED = config('IMAGE_SCREENING_ENABLED', default=True, cast=bool)
+IMAGE_SCREEN_MIN_SIDE = config('IMAGE_SCREEN_MIN_SIDE', default=200, cast=int)  # píxeles
+IMAGE_SCREEN_MIN_BRIGHTNESS = config('IMAGE_SCREEN_MIN_BRIGHTNESS', default=20, cast=float)  # media de grises 0-255
+IMAGE_SCREEN_MAX_BRIGHTNESS = config('IMAGE_SCREEN_MAX_BRIGHTNESS', default=245, cast=float)
+IMAGE_SCREEN_MIN_CONTRAST = config('IMAGE_SCREEN_MIN_CONTRAST', default=8, cast=float)  # desviación típica
+IMAGE_SCREEN_BLUR_REJECT = config('IMAGE_SCREEN_BLUR_REJECT', default=5, cast=float)  # varianza del laplaciano
+IMAGE_SCREEN_BLUR_WARN = config('IMAGE_SCREEN_BLUR_WARN', default=30, cast=float)
+IMAGE_SCREEN_DUPLICATE_DISTANCE = config('IMAGE_SCREEN_DUPLICATE_DISTANCE', default=3, cast=int)  # bits del hash perceptual
+
 # Logging configuration
 from core.logging_config import setup_logging
 setup_logging()